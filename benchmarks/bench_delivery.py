@@ -0,0 +1,135 @@
+##############################################################################
+#
+# Copyright (c) 2026 Zope Foundation and Contributors.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+"""Benchmarks of the latency of sending one message, per delivery method.
+
+Every worker process starts its own SMTP sink on a free port of localhost.
+Run with::
+
+    python benchmarks/bench_delivery.py -o delivery.json
+
+Pass ``--latency`` to let the sink acknowledge each message after that
+many seconds, like a real relay.
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import pyperf
+import transaction
+from zope.sendmail.maildir import Maildir
+
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from fixtures import large_attachment  # noqa: E402
+from fixtures import plain_text  # noqa: E402
+from smtpsink import SMTPSink  # noqa: E402
+
+from Products.MailHost.MailHost import MailHost  # noqa: E402
+from Products.MailHost.queue import make_queue_processor  # noqa: E402
+
+
+MESSAGES = {
+    'plain_text': plain_text,
+    'large_attachment': large_attachment,
+}
+
+
+def make_mailhost(port, queue_path=None, pool_size=0):
+    mh = MailHost('MailHost', smtp_host='127.0.0.1', smtp_port=port)
+    mh.smtp_pool_size = pool_size
+    if queue_path is not None:
+        mh.smtp_queue = True
+        mh.smtp_queue_directory = queue_path
+        Maildir(queue_path, True)
+    return mh
+
+
+def time_send(loops, mh, message, immediate=False):
+    start = time.perf_counter()
+    for i in range(loops):
+        mh.send(message, mto='jane@example.com', mfrom='site@example.com',
+                immediate=immediate)
+        if not immediate:
+            transaction.commit()
+    return time.perf_counter() - start
+
+
+def time_queued(loops, mh, message, queue_path):
+    elapsed = time_send(loops, mh, message)
+    empty_queue(queue_path)
+    return elapsed
+
+
+def empty_queue(queue_path):
+    for subdir in ('new', 'cur'):
+        path = os.path.join(queue_path, subdir)
+        for name in os.listdir(path):
+            os.unlink(os.path.join(path, name))
+
+
+def time_queue_drain(loops, mh, message, queue_path):
+    """ Time the queue processor sending *loops* queued messages. """
+    empty_queue(queue_path)
+    for i in range(loops):
+        mh.send(message, mto='jane@example.com', mfrom='site@example.com')
+    transaction.commit()
+    group = make_queue_processor(mh._makeMailer, queue_path)
+    start = time.perf_counter()
+    for worker in group.workers:
+        worker.run(forever=False)
+    return time.perf_counter() - start
+
+
+def add_cmdline_args(cmd, args):
+    cmd.extend(('--latency', str(args.latency)))
+
+
+def main():
+    runner = pyperf.Runner(add_cmdline_args=add_cmdline_args)
+    runner.argparser.add_argument('--latency', type=float, default=0.0,
+                                  help='seconds the SMTP sink waits before '
+                                       'acknowledging a message')
+    args = runner.parse_args()
+    runner.metadata['description'] = 'MailHost delivery latency'
+
+    # The queue processor is started by the benchmarks themselves
+    os.environ['MAILHOST_QUEUE_ONLY'] = '1'
+    sink = SMTPSink(latency=args.latency).start()
+    tmpdir = tempfile.mkdtemp(suffix='MailHostBenchmarks')
+    try:
+        for name, factory in sorted(MESSAGES.items()):
+            message = factory()
+            runner.bench_time_func('immediate[%s]' % name, time_send,
+                                   make_mailhost(sink.port), message, True)
+            runner.bench_time_func('immediate_pooled[%s]' % name, time_send,
+                                   make_mailhost(sink.port, pool_size=1),
+                                   message, True)
+            runner.bench_time_func('direct[%s]' % name, time_send,
+                                   make_mailhost(sink.port), message)
+            queue_path = os.path.join(tmpdir, name)
+            mh = make_mailhost(sink.port, queue_path)
+            runner.bench_time_func('queued[%s]' % name, time_queued, mh,
+                                   message, queue_path)
+            runner.bench_time_func('queue_drain[%s]' % name,
+                                   time_queue_drain, mh, message, queue_path)
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+        sink.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+##############################################################################
+#
+# Copyright (c) 2026 Zope Foundation and Contributors.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+"""Benchmarks of building and serializing messages.
+
+Run with::
+
+    python benchmarks/bench_messages.py -o messages.json
+"""
+
+import os
+import sys
+
+import pyperf
+
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from fixtures import many_recipients  # noqa: E402
+from fixtures import send_fixtures  # noqa: E402
+
+from Products.MailHost.generator import as_bytes  # noqa: E402
+from Products.MailHost.MailHost import _encode_address_string  # noqa: E402
+from Products.MailHost.MailHost import _mungeHeaders  # noqa: E402
+from Products.MailHost.MailHost import _prepareMessage  # noqa: E402
+from Products.MailHost.MailHost import _set_recursive_charset  # noqa: E402
+from Products.MailHost.MailHost import message_from_string  # noqa: E402
+
+
+def bench_munge_headers(messageText, mto):
+    _mungeHeaders(messageText, mto=mto, mfrom='site@example.com',
+                  charset='utf-8')
+
+
+def bench_set_recursive_charset(messageText):
+    if isinstance(messageText, str):
+        messageText = message_from_string(messageText)
+    _set_recursive_charset(messageText, 'utf-8')
+
+
+def bench_encode_address_strings(addresses):
+    for address in addresses:
+        _encode_address_string(address, 'utf-8')
+
+
+def main():
+    runner = pyperf.Runner()
+    runner.metadata['description'] = 'MailHost message building'
+    fixtures = send_fixtures()
+    for name, (messageText, mto) in sorted(fixtures.items()):
+        runner.bench_func('munge_headers[%s]' % name,
+                          bench_munge_headers, messageText, mto)
+        runner.bench_func('set_recursive_charset[%s]' % name,
+                          bench_set_recursive_charset, messageText)
+        prepared = _prepareMessage(messageText, mto=mto,
+                                   mfrom='site@example.com',
+                                   charset='utf-8')[0]
+        runner.bench_func('as_bytes[%s]' % name, as_bytes, prepared)
+
+    recipients = many_recipients()[1].split(', ')
+    runner.bench_func('encode_address_string[ascii]',
+                      bench_encode_address_strings, recipients)
+    runner.bench_func('encode_address_string[non_ascii]',
+                      bench_encode_address_strings,
+                      ['Jürgen Müller <juergen%d@example.com>' % i
+                       for i in range(len(recipients))])
+
+
+if __name__ == '__main__':
+    main()
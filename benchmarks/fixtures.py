@@ -0,0 +1,91 @@
+##############################################################################
+#
+# Copyright (c) 2026 Zope Foundation and Contributors.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+"""Messages used by the benchmarks.
+
+All content is generated deterministically, so results can be compared
+between runs and releases.
+"""
+
+import random
+from email.mime.application import MIMEApplication
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+
+
+PARAGRAPH = ('Lorem ipsum dolor sit amet, consectetur adipiscing elit, sed '
+             'do eiusmod tempor incididunt ut labore et dolore magna aliqua. '
+             'Ut enim ad minim veniam, quis nostrud exercitation ullamco.\n')
+
+HEADERS = ('From: Zope Site <site@example.com>\n'
+           'To: Jane Doe <jane@example.com>\n'
+           'Subject: Your weekly digest\n'
+           'Date: Sun, 27 Aug 2006 17:00:00 +0200\n')
+
+
+def plain_text():
+    """ A plain text newsletter of about 4 KiB, as a string. """
+    return HEADERS + '\n' + PARAGRAPH * 20
+
+
+def multipart_alternative():
+    """ A text and HTML newsletter, as a ``Message``. """
+    msg = MIMEMultipart('alternative')
+    msg['From'] = 'Zope Site <site@example.com>'
+    msg['To'] = 'Jane Doe <jane@example.com>'
+    msg['Subject'] = 'Your weekly digest'
+    msg.attach(MIMEText(PARAGRAPH * 20, 'plain', 'utf-8'))
+    html = '<html><body>%s</body></html>' % (('<p>%s</p>' % PARAGRAPH) * 20)
+    msg.attach(MIMEText(html, 'html', 'utf-8'))
+    return msg
+
+
+def many_recipients(count=200):
+    """ A plain text message and a To header with *count* addresses. """
+    recipients = ', '.join('Recipient %d <user%d@example.com>' % (i, i)
+                           for i in range(count))
+    return (HEADERS.replace('To: Jane Doe <jane@example.com>\n', '')
+            + '\n' + PARAGRAPH * 5), recipients
+
+
+def large_attachment(size=5 * 1024 * 1024):
+    """ A message with a binary attachment of *size* bytes. """
+    msg = MIMEMultipart()
+    msg['From'] = 'Zope Site <site@example.com>'
+    msg['To'] = 'Jane Doe <jane@example.com>'
+    msg['Subject'] = 'The report you asked for'
+    msg.attach(MIMEText(PARAGRAPH, 'plain', 'utf-8'))
+    data = random.Random(42).randbytes(size)
+    msg.attach(MIMEApplication(data, 'octet-stream', Name='report.bin'))
+    return msg
+
+
+def non_ascii_headers():
+    """ A message with non-ASCII names and subject, as a string. """
+    return ('From: Jürgen Müller <juergen@example.com>\n'
+            'To: Ærøskøbing Fælles <info@example.com>,'
+            ' François Dupré <francois@example.com>\n'
+            'Subject: Grüße aus Köln – Ünïcödé ✓\n'
+            'Date: Sun, 27 Aug 2006 17:00:00 +0200\n'
+            '\n' + 'Schöne Grüße\n' * 50)
+
+
+# name -> (messageText, mto) as passed to MailHost.send
+def send_fixtures():
+    text, recipients = many_recipients()
+    return {
+        'plain_text': (plain_text(), None),
+        'multipart_alternative': (multipart_alternative(), None),
+        'many_recipients': (text, recipients),
+        'large_attachment': (large_attachment(), None),
+        'non_ascii_headers': (non_ascii_headers(), None),
+    }
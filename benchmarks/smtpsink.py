@@ -0,0 +1,105 @@
+##############################################################################
+#
+# Copyright (c) 2026 Zope Foundation and Contributors.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+"""A local SMTP server which accepts and discards all mail.
+
+It speaks just enough ESMTP for ``smtplib`` and stands in for the mail
+relay in the delivery benchmarks. Run it on its own with::
+
+    python benchmarks/smtpsink.py [port]
+"""
+
+import socketserver
+import sys
+import threading
+import time
+
+
+class SMTPSinkHandler(socketserver.StreamRequestHandler):
+
+    disable_nagle_algorithm = True
+
+    def reply(self, line):
+        self.wfile.write(line + b'\r\n')
+
+    def handle(self):
+        self.reply(b'220 localhost SMTP sink ready')
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line[:4].upper()
+            if command == b'EHLO':
+                self.reply(b'250-localhost\r\n250-PIPELINING\r\n'
+                           b'250 8BITMIME')
+            elif command == b'HELO':
+                self.reply(b'250 localhost')
+            elif command == b'DATA':
+                self.reply(b'354 End data with <CR><LF>.<CR><LF>')
+                size = 0
+                for data in self.rfile:
+                    if data == b'.\r\n':
+                        break
+                    size += len(data)
+                if self.server.latency:
+                    time.sleep(self.server.latency)
+                self.server.received(size)
+                self.reply(b'250 Ok: queued')
+            elif command == b'QUIT':
+                self.reply(b'221 Bye')
+                return
+            elif command in (b'MAIL', b'RCPT', b'RSET', b'NOOP'):
+                self.reply(b'250 Ok')
+            else:
+                self.reply(b'502 Command not implemented')
+
+
+class SMTPSink(socketserver.ThreadingTCPServer):
+    """ Accept mail on *port* of localhost, 0 picks a free port.
+
+    With *latency* every message is acknowledged after that many seconds,
+    like by a relay which does some work per message.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, port=0, latency=0.0):
+        super().__init__(('127.0.0.1', port), SMTPSinkHandler)
+        self.latency = latency
+        self.messages = 0
+        self.bytes = 0
+        self._lock = threading.Lock()
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def received(self, size):
+        with self._lock:
+            self.messages += 1
+            self.bytes += size
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return self
+
+
+if __name__ == '__main__':
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8025
+    sink = SMTPSink(port)
+    print('Accepting mail on port %d' % sink.port)
+    try:
+        sink.serve_forever()
+    except KeyboardInterrupt:
+        print('%d messages, %d bytes' % (sink.messages, sink.bytes))
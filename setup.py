@@ -66,6 +66,8 @@ setup(
     ],
     extras_require={
         'genericsetup': ['Products.GenericSetup >= 2.0b1'],
+        'async': ['aiosmtplib >= 3.0'],
+        'benchmark': ['pyperf'],
     },
     include_package_data=True,
 )
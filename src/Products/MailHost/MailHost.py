@@ -11,27 +11,22 @@
 #
 ##############################################################################
 
+import atexit
 import email.charset
 import logging
 import os
 import re
 import time
 from copy import copy
-from copy import deepcopy
 from email import encoders
 from email import message_from_string
-from email import policy
-from email._policybase import Compat32
 from email.charset import Charset
-from email.generator import BytesGenerator
-from email.generator import _has_surrogates
 from email.header import Header
 from email.message import Message
 from email.utils import formataddr
 from email.utils import getaddresses
 from email.utils import parseaddr
 from functools import partial
-from io import BytesIO
 from os.path import realpath
 from threading import Lock
 
@@ -47,17 +42,40 @@ from OFS.role import RoleManager
 from OFS.SimpleItem import Item
 from Persistence import Persistent
 from zope.interface import implementer
-from zope.sendmail.delivery import DirectMailDelivery
-from zope.sendmail.delivery import QueuedMailDelivery
-from zope.sendmail.delivery import QueueProcessorThread
-from zope.sendmail.maildir import Maildir
-from zope.sendmail.mailer import SMTPMailer
 
-from Products.MailHost.decorator import synchronized
+from Products.MailHost import aio
+from Products.MailHost import metrics
+from Products.MailHost.builder import close_build_pools
+from Products.MailHost.builder import result
+from Products.MailHost.builder import submit
+from Products.MailHost.cache import LRUCache
+from Products.MailHost.cache import cache_statistics
+from Products.MailHost.dedup import get_sent_index
+from Products.MailHost.dedup import is_duplicate
+from Products.MailHost.dedup import message_key
+from Products.MailHost.delivery import DirectMailBatchDelivery
+from Products.MailHost.delivery import render_on_commit
+from Products.MailHost.generator import FixedBytesGenerator  # noqa: F401
+from Products.MailHost.generator import FixedMessage  # noqa: F401
+from Products.MailHost.generator import PrefixedMessage
+from Products.MailHost.generator import as_bytes
+from Products.MailHost.generator import fixed_policy
 from Products.MailHost.interfaces import IMailHost
-
-
-queue_threads = {}  # maps MailHost path -> queue processor threads
+from Products.MailHost.pool import PooledSMTPMailer
+from Products.MailHost.pool import SMTPConnectionPool
+from Products.MailHost.pool import close_pool
+from Products.MailHost.pool import close_pools
+from Products.MailHost.pool import get_pool
+from Products.MailHost.queue import ProcessorRegistry
+from Products.MailHost.queue import check_priority
+from Products.MailHost.routing import parse_routes
+from Products.MailHost.routing import route_envelopes
+from Products.MailHost.storage import backends as queue_backends
+from Products.MailHost.storage import get_queue
+from Products.MailHost.throttle import get_limiter
+
+
+queue_threads = ProcessorRegistry()  # maps queue path -> queue processor
 
 LOG = logging.getLogger('MailHost')
 
@@ -65,6 +83,60 @@ LOG = logging.getLogger('MailHost')
 email.charset.add_charset('utf-8', email.charset.QP, email.charset.QP, 'utf-8')
 CHARSET_RE = re.compile(r'charset=[\'"]?([\w-]+)[\'"]?', re.IGNORECASE)
 
+# Seconds mail delivery gets to finish at process exit, unless set by the
+# MAILHOST_SHUTDOWN_TIMEOUT environment variable
+SHUTDOWN_TIMEOUT = 10.0
+
+
+def shutdown(timeout=None):
+    """ Stop the mail delivery of this process within *timeout* seconds.
+
+    This runs at process exit. The queue processors take no further
+    messages and finish the ones they are sending, the asynchronous
+    delivery engine the ones handed to it, until the deadline. Then all
+    SMTP connections are closed, the processes building messages are
+    stopped and the metrics registry is flushed, if it has a ``flush``
+    method. Returns the number of messages left in each
+    queue by queue directory.
+    """
+    if timeout is None:
+        timeout = float(os.environ.get('MAILHOST_SHUTDOWN_TIMEOUT',
+                                       SHUTDOWN_TIMEOUT))
+    deadline = time.monotonic() + timeout
+    queues = [getattr(queue_threads.get(key), 'queue', None)
+              for key in queue_threads.keys()]
+    for key in queue_threads.shutdown(timeout):
+        LOG.warning('Thread for %s did not stop in time, the message it '
+                    'is sending may be sent again' % key)
+    engine = aio._engine
+    if engine is not None:
+        engine.shutdown(max(deadline - time.monotonic(), 0))
+        if engine.pending:
+            LOG.warning('%d messages handed to the asynchronous delivery '
+                        'were not sent' % engine.pending)
+    close_pools()
+    close_build_pools()
+    left = {}
+    for queue in queues:
+        if queue is None:
+            continue
+        try:
+            counts = queue.statistics(max_age=0)
+        except ValueError:
+            continue
+        path = queue.path
+        left[path] = counts['new'] + counts['sending'] + counts['deferred']
+        if left[path]:
+            LOG.info('%d messages left in the mail queue %s'
+                     % (left[path], path))
+    flush = getattr(metrics.get_registry(), 'flush', None)
+    if flush is not None:
+        flush()
+    return left
+
+
+atexit.register(shutdown)
+
 
 class MailHostError(Exception):
     pass
@@ -107,8 +179,24 @@ class MailBase(Implicit, Item, RoleManager):
     smtp_pwd = ''
     smtp_queue = False
     smtp_queue_directory = '/tmp'
+    smtp_queue_workers = 1
+    smtp_queue_max_attempts = 20  # 0 to retry undeliverable mail forever
+    smtp_queue_weighted = False  # let low priority mail through meanwhile
+    smtp_queue_backend = 'maildir'  # see Products.MailHost.storage
+    smtp_render_on_commit = False  # build non-immediate mail on commit
+    smtp_dedup_window = 0.0  # seconds to drop duplicate mail, 0 to send it
+    smtp_build_processes = 0  # processes building large messages, 0: none
+    smtp_build_threshold = 256 * 1024  # build messages larger than this there
+    smtp_async = False
     force_tls = False
     implicit_tls = False
+    smtp_pool_size = 0
+    smtp_pool_idle_timeout = 60.0
+    smtp_rate_limit = 0.0  # messages per second, 0 for no limit
+    smtp_max_sessions = 0  # concurrent SMTP connections, 0 for no limit
+    smtp_stream_threshold = 0  # stream messages larger than this, 0: none
+    smtp_recipient_batch_size = 0  # most recipients per envelope, 0: all
+    smtp_routes = ()  # lines routing recipient domains to other relays
     lock = Lock()
 
     manage_options = ((
@@ -155,12 +243,33 @@ class MailBase(Implicit, Item, RoleManager):
                            smtp_queue_directory='/tmp',
                            force_tls=False,
                            implicit_tls=False,
+                           smtp_pool_size=0,
+                           smtp_pool_idle_timeout=60.0,
+                           smtp_queue_workers=1,
+                           smtp_async=False,
+                           smtp_rate_limit=0.0,
+                           smtp_max_sessions=0,
+                           smtp_recipient_batch_size=0,
+                           smtp_queue_max_attempts=20,
+                           smtp_routes=(),
+                           smtp_queue_weighted=False,
+                           smtp_queue_backend='maildir',
+                           smtp_render_on_commit=False,
+                           smtp_dedup_window=0.0,
+                           smtp_build_processes=0,
+                           smtp_build_threshold=256 * 1024,
+                           smtp_stream_threshold=0,
                            REQUEST=None):
         """Make the changes.
         """
         title = str(title)
         smtp_host = str(smtp_host)
         smtp_port = int(smtp_port)
+        smtp_routes = self._checkQueueSettings(smtp_routes,
+                                               smtp_queue_backend)
+        pool_keys = self._getPoolKeys()
+        processor_keys = self._getProcessorKeys()
+        queue_backend = self.smtp_queue_backend
 
         self.title = title
         self.smtp_host = smtp_host
@@ -171,6 +280,25 @@ class MailBase(Implicit, Item, RoleManager):
         self.implicit_tls = implicit_tls
         self.smtp_queue = smtp_queue
         self.smtp_queue_directory = smtp_queue_directory
+        self.smtp_pool_size = int(smtp_pool_size)
+        self.smtp_pool_idle_timeout = float(smtp_pool_idle_timeout)
+        self.smtp_queue_workers = max(int(smtp_queue_workers), 1)
+        self.smtp_async = bool(smtp_async)
+        self.smtp_rate_limit = max(float(smtp_rate_limit), 0.0)
+        self.smtp_max_sessions = max(int(smtp_max_sessions), 0)
+        self.smtp_recipient_batch_size = max(int(smtp_recipient_batch_size),
+                                             0)
+        self.smtp_queue_max_attempts = max(int(smtp_queue_max_attempts), 0)
+        self.smtp_routes = smtp_routes
+        self.smtp_queue_weighted = bool(smtp_queue_weighted)
+        self.smtp_queue_backend = smtp_queue_backend
+        self.smtp_render_on_commit = bool(smtp_render_on_commit)
+        self.smtp_dedup_window = max(float(smtp_dedup_window), 0.0)
+        self.smtp_build_processes = max(int(smtp_build_processes), 0)
+        self.smtp_build_threshold = max(int(smtp_build_threshold), 0)
+        self.smtp_stream_threshold = max(int(smtp_stream_threshold), 0)
+        self._closeUnusedPools(pool_keys)
+        self._stopUnusedProcessors(processor_keys, queue_backend)
 
         if REQUEST is not None:
             msg = 'MailHost %s updated' % self.id
@@ -213,13 +341,68 @@ class MailBase(Implicit, Item, RoleManager):
              encode=None,
              immediate=False,
              charset=None,
-             msg_type=None):
+             msg_type=None,
+             recipient_batch_size=None,
+             personalize=False,
+             priority=None,
+             idempotency_key=None):
         # send *messageText* modified by the other parameters.
         # *messageText* can be an ``email.message.Message`` or a string.
-        msg, mto, mfrom = _mungeHeaders(messageText, mto, mfrom,
-                                        subject, charset, msg_type,
-                                        encode)
-        self._send(mfrom, mto, msg, immediate)
+        # Recipients beyond *recipient_batch_size*, by default
+        # ``smtp_recipient_batch_size``, go into further envelopes, with
+        # *personalize* every recipient gets their own message.
+        # Queued mail of a *priority* is sent before or after others.
+        # Within ``smtp_dedup_window`` seconds, mail with the same
+        # *idempotency_key*, or else the same arguments, is sent once.
+        metrics.inc('mailhost_messages_total')
+        if recipient_batch_size is None:
+            recipient_batch_size = self.smtp_recipient_batch_size
+        recipient_batch_size = int(recipient_batch_size or 0)
+        kw = _priority_kw(priority)
+        keys = []
+        if self.smtp_dedup_window:
+            if idempotency_key is not None:
+                key = 'key:%s' % idempotency_key
+            else:
+                key = message_key(messageText, mto, mfrom, subject, encode,
+                                  charset, msg_type, personalize)
+            if self._isDuplicate(key, immediate):
+                return
+            keys.append(key)
+        args = (messageText, mto, mfrom, subject, encode, charset, msg_type,
+                immediate, recipient_batch_size, personalize, kw)
+        try:
+            if self.smtp_render_on_commit and not immediate:
+                # Transactions which abort or are retried build nothing
+                render_on_commit(self._renderMessage, *_snapshot(args))
+            else:
+                self._renderMessage(*args)
+        except BaseException:
+            self._forgetKeys(keys, immediate)
+            raise
+
+    @security.private
+    def _renderMessage(self, messageText, mto, mfrom, subject, encode,
+                       charset, msg_type, immediate, recipient_batch_size,
+                       personalize, kw):
+        """ Build the message for ``send`` and hand it to the delivery """
+        with metrics.timed('mailhost_send_seconds'):
+            args = (messageText, mto, mfrom, subject, encode, charset,
+                    msg_type, recipient_batch_size, personalize)
+            if self._buildsInPool(messageText):
+                future = submit(int(self.smtp_build_processes),
+                                _buildEnvelopes, *args)
+                envelopes, fanned_out = result(
+                    future, _buildEnvelopes, *args,
+                    serialize=self._serializeMessage)
+            else:
+                envelopes, fanned_out = _buildEnvelopes(
+                    *args, serialize=self._serializeMessage)
+            if fanned_out:
+                self._send_many(envelopes, immediate, **kw)
+            else:
+                (mfrom, mto, message), = envelopes
+                self._send(mfrom, mto, message, immediate, **kw)
 
     # This is here for backwards compatibility only. Possibly it could
     # be used to send messages at a scheduled future time, or via a mail queue?
@@ -232,58 +415,376 @@ class MailBase(Implicit, Item, RoleManager):
         msg = f'From: {mfrom}\nTo: {mto}\nSubject: {subject}\n\n{body}'
         self.send(msg, immediate=immediate)
 
-    def _makeMailer(self):
-        """ Create a SMTPMailer """
-        return SMTPMailer(hostname=self.smtp_host,
-                          port=int(self.smtp_port),
-                          username=self.smtp_uid or None,
-                          password=self.smtp_pwd or None,
-                          force_tls=self.force_tls,
-                          implicit_tls=self.implicit_tls)
+    @security.protected(use_mailhost_services)
+    def send_many(self, messages, immediate=False, priority=None):
+        # send all *messages* over a single SMTP session or queue write.
+        # Each item of *messages* is either a message as accepted by
+        # ``send`` or a tuple of ``send`` arguments in the order
+        # ``(messageText, mto, mfrom, subject, encode, charset, msg_type)``.
+        messages = list(messages)
+        kw = _priority_kw(priority)
+        keys = []
+        if self.smtp_dedup_window:
+            unique = []
+            for message in messages:
+                key = message_key(message)
+                if not self._isDuplicate(key, immediate):
+                    unique.append(message)
+                    keys.append(key)
+            messages = unique
+        try:
+            if self.smtp_render_on_commit and not immediate:
+                # Transactions which abort or are retried build nothing
+                render_on_commit(self._renderMessages,
+                                 [_snapshot(message) for message in messages],
+                                 immediate, kw)
+            else:
+                self._renderMessages(messages, immediate, kw)
+        except BaseException:
+            self._forgetKeys(keys, immediate)
+            raise
+
+    @security.private
+    def _renderMessages(self, messages, immediate, kw):
+        """ Build the messages for ``send_many`` and hand them over """
+        envelopes = []
+        pending = {}  # maps index in envelopes -> (Future, message)
+        for message in messages:
+            if not isinstance(message, (tuple, list)):
+                message = (message, )
+            message = tuple(message) + (None, ) * (7 - len(message))
+            if self._buildsInPool(message[0]):
+                # Large messages are built in parallel
+                pending[len(envelopes)] = (
+                    submit(int(self.smtp_build_processes), _buildMessage,
+                           *message), message)
+                envelopes.append(None)
+            else:
+                envelopes.append(_buildMessage(
+                    *message, serialize=self._serializeMessage))
+        for i, (future, message) in pending.items():
+            envelopes[i] = result(future, _buildMessage, *message,
+                                  serialize=self._serializeMessage)
+        metrics.inc('mailhost_messages_total', len(envelopes))
+        self._send_many(envelopes, immediate, **kw)
+
+    @security.private
+    def _getSentIndex(self):
+        """ Return the index of the keys of mail sent recently """
+        if self.smtp_queue:
+            # The index lives in the queue directory, made by the queue
+            self._getQueue().create()
+            return get_sent_index(self._getQueueDirectory())
+        return get_sent_index()
+
+    @security.private
+    def _isDuplicate(self, key, immediate=False):
+        """ Tell whether mail with *key* was sent in the dedup window.
+
+        Otherwise *key* is recorded, see ``Products.MailHost.dedup``.
+        """
+        return is_duplicate(self._getSentIndex(), key,
+                            float(self.smtp_dedup_window), immediate)
+
+    @security.private
+    def _forgetKeys(self, keys, immediate=False):
+        """ Forget *keys* of mail which failed to be sent immediately.
+
+        The keys of other mail are only recorded on commit.
+        """
+        if keys and immediate:
+            self._getSentIndex().forget(keys)
+
+    @security.private
+    def _buildsInPool(self, messageText):
+        """ Tell whether *messageText* is built by ``smtp_build_processes``
+        """
+        if not self.smtp_build_processes:
+            return False
+        if isinstance(messageText, Message):
+            size = _estimate_size(messageText)
+        else:
+            size = len(messageText or '')
+        return size >= self.smtp_build_threshold
+
+    @security.private
+    def _serializeMessage(self, mo):
+        """ Return the bytes to send for the ``Message`` *mo*.
+
+        With a ``smtp_stream_threshold``, larger messages are returned
+        unchanged, the delivery then streams them into the queue file or
+        the SMTP connection instead of keeping a serialized copy in memory.
+        ``_send``, ``_send_many`` and the mailers then get ``Message``
+        objects, so it is off by default.
+        """
+        threshold = self.smtp_stream_threshold
+        if threshold and _estimate_size(mo) >= threshold:
+            return mo
+        return as_bytes(mo)
+
+    def _makeMailer(self, route=None):
+        """ Create a SMTPMailer, for the relay of *route* if given """
+        key = self._getPoolKey(route)
+        # The limits apply to all mail for this relay, whatever the delivery
+        limiter = get_limiter(key, float(self.smtp_rate_limit),
+                              int(self.smtp_max_sessions))
+        pool_size = int(self.smtp_pool_size)
+        if pool_size > 0:
+            pool = get_pool(key, pool_size,
+                            float(self.smtp_pool_idle_timeout), limiter)
+            pool.limiter = limiter
+        else:
+            # A private pool which keeps nothing: one session per message
+            pool = SMTPConnectionPool(limiter=limiter)
+        hostname, port, username, password, force_tls, implicit_tls = key
+        return PooledSMTPMailer(pool,
+                                hostname=hostname,
+                                port=port,
+                                username=username,
+                                password=password,
+                                force_tls=force_tls,
+                                implicit_tls=implicit_tls)
+
+    @security.private
+    def _makeRouteMailer(self, route):
+        """ Create a SMTPMailer for *route*, None for our own relay """
+        if route is None:
+            # Keep working with overrides of _makeMailer without arguments
+            return self._makeMailer()
+        return self._makeMailer(route)
+
+    @security.private
+    def _makeDirectDelivery(self, route=None):
+        """ Create the delivery used when the mail queue is off """
+        if self.smtp_async:
+            if aio.available():
+                settings = aio.SMTPSettings(*self._getPoolKey(route))
+                return DirectMailBatchDelivery(
+                    aio.AsyncMailer(aio.get_engine(), settings))
+            LOG.warning('Asynchronous delivery requires the aiosmtplib '
+                        'package, falling back to synchronous delivery')
+        return DirectMailBatchDelivery(self._makeRouteMailer(route))
 
     @security.private
-    def _getThreadKey(self):
+    def _getPoolKey(self, route=None):
+        """ Return the key used to find our SMTP connection pool.
+
+        With a *route*, the key of the pool for its relay is returned.
+        """
+        if route is not None:
+            return route.settings()
+        return (self.smtp_host, int(self.smtp_port),
+                self.smtp_uid or None, self.smtp_pwd or None,
+                bool(self.force_tls), bool(self.implicit_tls))
+
+    @security.private
+    def _getRoutes(self):
+        """ Return the parsed ``smtp_routes``.
+        """
+        lines = self.smtp_routes
+        if not lines:
+            return ()
+        cached = getattr(self, '_v_routes', None)
+        if cached is None or cached[0] != lines:
+            cached = self._v_routes = (lines, parse_routes(lines))
+        return cached[1]
+
+    @security.private
+    def _getQueueDirectory(self, route=None):
+        """ Return the queue directory, of *route* if given.
+
+        Each route has a queue of its own inside ``smtp_queue_directory``.
+        """
+        if route is not None:
+            return os.path.join(self.smtp_queue_directory,
+                                'route-' + route.name)
+        return self.smtp_queue_directory
+
+    @security.private
+    def _getQueue(self, route=None):
+        """ Return the queue storage, of *route* if given.
+        """
+        return get_queue(self._getQueueDirectory(route),
+                         self.smtp_queue_backend)
+
+    @security.private
+    def _makeQueuedDelivery(self, route=None, priority=None):
+        """ Create the delivery into the queue for *route* and *priority*
+        """
+        queue = self._getQueue(route)
+        if route is not None:
+            # The queues of routes live inside the main queue
+            self._getQueue().create()
+            queue.create()
+        return queue.delivery(priority)
+
+    @security.private
+    def _getThreadKey(self, route=None):
         """ Return the key used to find our processor thread.
+
+        The real path of the queue directory is looked up once for every
+        queue directory this MailHost uses.
         """
-        return realpath(self.smtp_queue_directory)
+        path = self._getQueueDirectory(route)
+        keys = getattr(self, '_v_thread_keys', None)
+        if keys is None:
+            keys = self._v_thread_keys = {}
+        key = keys.get(path)
+        if key is None:
+            key = keys[path] = realpath(path)
+        return key
+
+    @security.private
+    def _getProcessorKeys(self):
+        """ Return the keys of the processors of all our queues.
+        """
+        return {self._getThreadKey(route)
+                for route in (None, ) + self._getRoutes()}
+
+    @security.private
+    def _checkQueueSettings(self, smtp_routes, smtp_queue_backend):
+        """ Return *smtp_routes* as tuple of lines, once checked.
+
+        Raises ValueError for invalid routes and unknown queue backends.
+        """
+        if isinstance(smtp_routes, str):
+            smtp_routes = smtp_routes.splitlines()
+        smtp_routes = tuple(line.strip() for line in smtp_routes
+                            if line.strip())
+        parse_routes(smtp_routes)  # raises ValueError for invalid routes
+        if smtp_queue_backend not in queue_backends:
+            raise ValueError('Unknown queue backend %r' % smtp_queue_backend)
+        return smtp_routes
+
+    @security.private
+    def _getPoolKeys(self):
+        """ Return the keys of the SMTP connection pools of all relays.
+        """
+        if getattr(self, 'smtp_host', None) is None:
+            return set()
+        return {self._getPoolKey(route)
+                for route in (None, ) + self._getRoutes()}
+
+    @security.private
+    def _closeUnusedPools(self, keys):
+        """ Close the connection pools of *keys* which are of no use anymore.
+
+        *keys* are those from before a change of the settings. Connections
+        pooled for a changed or removed relay are closed, all of them if
+        pooling is turned off.
+        """
+        if int(self.smtp_pool_size) > 0:
+            keys = keys - self._getPoolKeys()
+        for key in keys:
+            close_pool(key)
+
+    @security.private
+    def _stopUnusedProcessors(self, keys, queue_backend):
+        """ Stop the processors of *keys* which are of no use anymore.
+
+        *keys* and *queue_backend* are those from before a change of the
+        settings. Processors of removed routes or queue directories are
+        stopped, all of them if the queue backend changed.
+        """
+        if queue_backend == self.smtp_queue_backend:
+            keys = keys - self._getProcessorKeys()
+        _stop_processors(keys)
 
-    @synchronized(lock)
     def _stopQueueProcessorThread(self):
-        """ Stop thread for processing the mail queue.
+        """ Stop threads for processing the mail queues.
         """
-        key = self._getThreadKey()
-        if key in queue_threads:
-            thread = queue_threads[key]
-            thread.stop()
-            while thread.is_alive():
-                # wait until thread is really dead
-                time.sleep(0.3)
-            del queue_threads[key]
-            LOG.info('Thread for %s stopped' % key)
+        _stop_processors(self._getProcessorKeys())
 
-    @synchronized(lock)
     def _startQueueProcessorThread(self):
-        """ Start thread for processing the mail queue.
+        """ Start threads for processing the mail queues.
+
+        Every route has its own queue and threads, so a slow relay does not
+        hold up mail for the others. Processors already running are found
+        without taking a lock.
         """
-        key = self._getThreadKey()
-        if key not in queue_threads:
-            thread = QueueProcessorThread()
-            thread.setMailer(self._makeMailer())
-            thread.setQueuePath(self.smtp_queue_directory)
-            thread.start()
-            queue_threads[key] = thread
-            LOG.info('Thread for %s started' % key)
+        for route in (None, ) + self._getRoutes():
+            key = self._getThreadKey(route)
+            processor = queue_threads.get(key)
+            if processor is not None and processor.is_alive():
+                continue
+            factory = partial(self._getQueue(route).processor,
+                              partial(self._makeRouteMailer, route),
+                              self.smtp_queue_workers,
+                              self.smtp_queue_max_attempts,
+                              self.smtp_queue_weighted)
+            if queue_threads.start(key, factory):
+                LOG.info('Thread for %s started' % key)
 
     @security.protected(view)
     def queueLength(self):
         """ return length of mail queue """
 
         try:
-            maildir = Maildir(self.smtp_queue_directory)
-            return len([item for item in maildir])
+            statistics = self.queueStatistics()
         except ValueError:
-            return 'n/a - %s is not a maildir - please verify your ' \
+            return 'n/a - %s is not a mail queue - please verify your ' \
                    'configuration' % self.smtp_queue_directory
+        return (statistics['new'] + statistics['sending']
+                + statistics['deferred'])
+
+    @security.protected(view)
+    def queueStatistics(self):
+        """ return the number of new, sending, deferred, failed and dead mails
+
+        Messages in the queues of all routes are counted. Raises
+        ``ValueError`` if there is no queue in the queue directory.
+        """
+        statistics = self._getQueue().statistics()
+        for route in self._getRoutes():
+            try:
+                counts = self._getQueue(route).statistics()
+            except ValueError:
+                continue  # nothing was queued for the route yet
+            for state, count in counts.items():
+                statistics[state] += count
+        return statistics
+
+    @security.protected(view)
+    def deliveryMetrics(self):
+        """ return the delivery counters and timings of this process
+        """
+        return metrics.get_registry().snapshot()
+
+    @security.protected(view)
+    def deliveryMetricsText(self, REQUEST=None):
+        """ return the delivery metrics in the Prometheus text format
+        """
+        text = metrics.get_registry().prometheus()
+        statistics = self.cacheStatistics()
+        for name, help in (('hits', 'Lookups answered from a cache'),
+                           ('misses', 'Lookups not answered from a cache')):
+            text += ('# HELP mailhost_cache_%s_total %s\n'
+                     '# TYPE mailhost_cache_%s_total counter\n'
+                     % (name, help, name))
+            for cache, values in sorted(statistics.items()):
+                text += 'mailhost_cache_%s_total{cache="%s"} %d\n' % (
+                    name, cache, values[name])
+        if self.smtp_queue:
+            try:
+                statistics = self.queueStatistics()
+            except ValueError:
+                pass
+            else:
+                text += ('# HELP mailhost_queue_messages Messages in the '
+                         'mail queue\n# TYPE mailhost_queue_messages gauge\n')
+                for state, count in sorted(statistics.items()):
+                    text += 'mailhost_queue_messages{state="%s"} %d\n' % (
+                        state, count)
+        if REQUEST is not None:
+            REQUEST.RESPONSE.setHeader('Content-Type',
+                                       'text/plain; version=0.0.4')
+        return text
+
+    @security.protected(view)
+    def cacheStatistics(self):
+        """ return the hits, misses and sizes of the caches of this process
+        """
+        return cache_statistics()
 
     @security.protected(view)
     def queueThreadAlive(self):
@@ -321,27 +822,64 @@ class MailBase(Implicit, Item, RoleManager):
             return self.manage_main(self, REQUEST, manage_tabs_message=msg)
 
     @security.private
-    def _send(self, mfrom, mto, messageText, immediate=False):
-        """ Send the message """
+    def _send(self, mfrom, mto, messageText, immediate=False, priority=None):
+        """ Send the message
 
-        if immediate:
+        *messageText* are the bytes of the message or a ``Message`` object,
+        which is then serialized while it is written out. Queued messages
+        go into the lane of their *priority*.
+        """
+
+        if self.smtp_routes or priority is not None:
+            # Recipients may be spread over several routes
+            self._send_many([(mfrom, mto, messageText)], immediate, priority)
+        elif immediate:
             self._makeMailer().send(mfrom, mto, messageText)
         else:
             if self.smtp_queue:
                 # Start queue processor thread, if necessary
                 if not os.environ.get('MAILHOST_QUEUE_ONLY', False):
                     self._startQueueProcessorThread()
-                delivery = QueuedMailDelivery(self.smtp_queue_directory)
+                delivery = self._makeQueuedDelivery()
 
                 # The queued mail delivery breaks if the To address is just
                 # a string. All other delivery mechanisms work fine.
                 if isinstance(mto, str):
                     mto = [mto]
             else:
-                delivery = DirectMailDelivery(self._makeMailer())
+                delivery = self._makeDirectDelivery()
 
             delivery.send(mfrom, mto, messageText)
 
+    @security.private
+    def _send_many(self, envelopes, immediate=False, priority=None):
+        """ Send ``(mfrom, mto, messageText)`` triples in one batch """
+
+        routes = self._getRoutes()
+        if routes:
+            routed = route_envelopes(routes, envelopes)
+        else:
+            routed = [(None, envelopes)]
+        if self.smtp_queue and not immediate:
+            # Start queue processor thread, if necessary
+            if not os.environ.get('MAILHOST_QUEUE_ONLY', False):
+                self._startQueueProcessorThread()
+
+        for route, envelopes in routed:
+            if immediate:
+                self._makeRouteMailer(route).send_many(envelopes)
+            else:
+                if self.smtp_queue:
+                    delivery = self._makeQueuedDelivery(route, priority)
+                    envelopes = [(mfrom,
+                                  [mto] if isinstance(mto, str) else mto,
+                                  messageText)
+                                 for mfrom, mto, messageText in envelopes]
+                else:
+                    delivery = self._makeDirectDelivery(route)
+
+                delivery.sendMany(envelopes)
+
 
 InitializeClass(MailBase)
 
@@ -350,6 +888,59 @@ class MailHost(Persistent, MailBase):
     """persistent version"""
 
 
+def _priority_kw(priority):
+    """ Return the keyword arguments passing *priority* on to ``_send``.
+
+    It is left out unless given, for subclasses overriding ``_send`` with
+    the signature it had before priorities.
+    """
+    if check_priority(priority) is None:
+        return {}
+    return {'priority': priority}
+
+
+def _buildMessage(messageText, mto=None, mfrom=None, subject=None,
+                  encode=None, charset=None, msg_type=None,
+                  serialize=as_bytes):
+    """ Return the ``(mfrom, mto, message)`` envelope for ``send_many``.
+
+    The message is serialized by *serialize*. This also runs in the
+    processes building large messages, see ``Products.MailHost.builder``.
+    """
+    mo, mto, mfrom = _prepareMessage(messageText, mto, mfrom, subject,
+                                     charset, msg_type, encode)
+    return mfrom, mto, serialize(mo)
+
+
+def _buildEnvelopes(messageText, mto, mfrom, subject, encode, charset,
+                    msg_type, recipient_batch_size, personalize,
+                    serialize=as_bytes):
+    """ Return the envelopes for ``send`` and whether there are several.
+
+    See ``_buildMessage``.
+    """
+    replace_to = bool(mto)
+    mo, mto, mfrom = _prepareMessage(messageText, mto, mfrom, subject,
+                                     charset, msg_type, encode)
+    if personalize or 0 < recipient_batch_size < len(mto):
+        return _fan_out(mo, mto, mfrom, recipient_batch_size, personalize,
+                        replace_to), True
+    return [(mfrom, mto, serialize(mo))], False
+
+
+def _snapshot(args):
+    """ Return *args* for building a message later.
+
+    ``Message`` objects and lists of recipients are copied, so changes
+    made to them after sending are not sent.
+    """
+    if not isinstance(args, (tuple, list)):
+        args = (args, )
+    return tuple(_copy_message(arg) if isinstance(arg, Message)
+                 else list(arg) if isinstance(arg, list) else arg
+                 for arg in args)
+
+
 # All encodings supported by mimetools for BBB
 ENCODERS = {
     'base64': encoders.encode_base64,
@@ -373,6 +964,19 @@ def _mungeHeaders(messageText, mto=None, mfrom=None, subject=None,
     """Sets missing message headers, and deletes Bcc.
        returns fixed message, fixed mto and fixed mfrom.
 
+       See ``_prepareMessage`` for the arguments.
+    """
+    mo, mto, mfrom = _prepareMessage(messageText, mto, mfrom, subject,
+                                     charset, msg_type, encode)
+    return as_bytes(mo), mto, mfrom
+
+
+@metrics.timed('mailhost_munge_headers_seconds')
+def _prepareMessage(messageText, mto=None, mfrom=None, subject=None,
+                    charset=None, msg_type=None, encode=None):
+    """Sets missing message headers, and deletes Bcc.
+       returns fixed ``Message`` object, fixed mto and fixed mfrom.
+
        *messageText* can be either a ``Message`` or a
        string representation for a message.
        In the latter case, the representation is converted to
@@ -385,17 +989,18 @@ def _mungeHeaders(messageText, mto=None, mfrom=None, subject=None,
 
     if isinstance(messageText, Message):
         # We already have a message, make a copy to operate on
-        mo = deepcopy(messageText)
-    else:
-        # Otherwise parse the input message
-        mo = message_from_string(_string_transform(messageText, charset))
+        mo = _copy_message(messageText)
 
-    if msg_type and not mo.get('Content-Type'):
-        # we don't use get_content_type because that has a default
-        # value of 'text/plain'
-        mo.set_type(msg_type)
+        if msg_type and not mo.get('Content-Type'):
+            # we don't use get_content_type because that has a default
+            # value of 'text/plain'
+            mo.set_type(msg_type)
 
-    charset = _set_recursive_charset(mo, charset=charset)
+        charset = _set_recursive_charset(mo, charset=charset)
+    else:
+        # Otherwise parse the input message
+        mo, charset = _parse_message(_string_transform(messageText, charset),
+                                     charset, msg_type)
 
     # Parameters given will *always* override headers in the messageText.
     # This is so that you can't override or add to subscribers by adding
@@ -411,7 +1016,7 @@ def _mungeHeaders(messageText, mto=None, mfrom=None, subject=None,
 
     if mto:
         if isinstance(mto, str):
-            mto = [formataddr(addr) for addr in getaddresses((mto, ))]
+            mto = _format_addresses(mto)
         # this violates what is said above (parameters always override)
         # if not mo.get('To'):
         if mto:
@@ -424,7 +1029,7 @@ def _mungeHeaders(messageText, mto=None, mfrom=None, subject=None,
         for header in ('To', 'Cc', 'Bcc'):
             v = ','.join(mo.get_all(header) or [])
             if v:
-                mto += [formataddr(addr) for addr in getaddresses((v, ))]
+                mto += _format_addresses(v)
         if not mto:
             raise MailHostError('No message recipients designated')
 
@@ -458,7 +1063,144 @@ def _mungeHeaders(messageText, mto=None, mfrom=None, subject=None,
             if not mo['Mime-Version']:
                 mo['Mime-Version'] = '1.0'
 
-    return as_bytes(mo), mto, mfrom
+    return mo, mto, mfrom
+
+
+class _MessagePlan:
+    """What parsing a single part message with a given header block gave.
+
+    ``headers`` are the parsed headers, with the type set from ``msg_type``,
+    ``set_charset`` is the ``Charset`` to set on the message, if any, and
+    ``charset`` the charset to use for encoding headers.
+    """
+
+    __slots__ = ('headers', 'set_charset', 'charset')
+
+    def __init__(self, headers, set_charset, charset):
+        self.headers = headers
+        self.set_charset = set_charset
+        self.charset = charset
+
+
+# Maps (header block, charset, msg_type) -> _MessagePlan
+_plan_cache = LRUCache(256, 'message_plans')
+
+
+def _split_message(text):
+    """Split *text* after the empty line ending the header block.
+
+    Returns ``(None, text)`` if there is no such line.
+    """
+    end = -1
+    for separator in ('\n\n', '\r\n\r\n'):
+        index = text.find(separator)
+        if index >= 0 and (end < 0 or index < end):
+            end = index + len(separator)
+    if end < 0:
+        return None, text
+    return text[:end], text[end:]
+
+
+def _parse_message(text, charset=None, msg_type=None):
+    """Parse *text*, set its type and charset and return it with the charset.
+
+    Messages generated from the same template usually have the same headers
+    and only differ in the body. For single part messages the parsed headers
+    and the charset decisions are therefore cached by header block, so only
+    the body has to be taken over for the next message with these headers.
+    """
+    header, body = _split_message(text)
+    key = (header, charset, msg_type)
+    plan = _plan_cache.get(key) if header is not None else None
+    if plan is not None:
+        mo = _message_factory(policy=fixed_policy)
+        mo._headers = list(plan.headers)
+        mo._payload = body
+        if plan.set_charset is not None:
+            mo.set_charset(plan.set_charset)
+        return mo, plan.charset
+
+    mo = message_from_string(text)
+    if msg_type and not mo.get('Content-Type'):
+        # we don't use get_content_type because that has a default
+        # value of 'text/plain'
+        mo.set_type(msg_type)
+    cacheable = (header is not None and not mo.defects and
+                 not mo.is_multipart() and
+                 mo.get_content_maintype() not in ('multipart', 'message') and
+                 mo.get_unixfrom() is None and mo._payload == body)
+    if cacheable:
+        headers = tuple(mo._headers)
+        set_charset = None
+        if charset and not CHARSET_RE.search(mo['Content-Type'] or ''):
+            set_charset = Charset(charset)
+    charset = _set_recursive_charset(mo, charset=charset)
+    if cacheable:
+        _plan_cache.set(key, _MessagePlan(headers, set_charset, charset))
+    return mo, charset
+
+
+def _stop_processors(keys):
+    """Stop the queue processors of *keys*, if running."""
+    for key in keys:
+        if key not in queue_threads:
+            continue
+        if queue_threads.stop(key):
+            LOG.info('Thread for %s stopped' % key)
+        else:
+            LOG.warning('Thread for %s did not stop in time' % key)
+
+
+def _fan_out(mo, mto, mfrom, batch_size, personalize=False, replace_to=True):
+    """Return the envelopes for sending *mo* to *mto* in batches.
+
+    The message is serialized once and its bytes are shared by all
+    envelopes. With *personalize* there is one envelope per recipient, a
+    ``PrefixedMessage`` with its own address as ``To`` header in front of
+    the shared bytes. Otherwise a ``To`` header
+    listing all of *mto* is replaced by ``undisclosed-recipients:;`` if
+    *replace_to* is set, i.e. if it was made from the ``mto`` argument.
+    """
+    if personalize or replace_to:
+        del mo['To']
+        if not personalize:
+            mo['To'] = 'undisclosed-recipients:;'
+    message = as_bytes(mo)
+    if personalize:
+        policy = mo.policy
+        return [(mfrom, [addr],
+                 PrefixedMessage(policy.fold_binary(
+                     'To', str(_encode_address_string(addr, None))), message))
+                for addr in mto]
+    return [(mfrom, mto[start:start + batch_size], message)
+            for start in range(0, len(mto), batch_size)]
+
+
+def _estimate_size(msg):
+    """Return the approximate size of the payload data of *msg*."""
+    payload = msg._payload
+    if isinstance(payload, list):
+        return sum(_estimate_size(part) for part in payload
+                   if isinstance(part, Message))
+    return len(payload or '')
+
+
+def _copy_message(msg):
+    """Return a copy of *msg* which can be changed without affecting *msg*.
+
+    Only the ``Message`` objects of the MIME tree and their header lists are
+    copied. The payload data is immutable and shared with the original, so
+    large attachments are neither traversed nor duplicated as they would be
+    by ``deepcopy``.
+    """
+    mo = copy(msg)
+    mo._headers = list(msg._headers)
+    mo.defects = list(msg.defects)
+    payload = msg._payload
+    if isinstance(payload, list):
+        mo._payload = [_copy_message(part) if isinstance(part, Message)
+                       else part for part in payload]
+    return mo
 
 
 def _set_recursive_charset(payload, charset=None):
@@ -505,62 +1247,46 @@ def _try_encode(text, charset):
         return text.encode()
 
 
+# Maps (address, charset) -> address as formatted for a header
+_address_cache = LRUCache(4096, 'addresses')
+
+# Maps a comma separated list of addresses -> tuple of formatted addresses
+_address_list_cache = LRUCache(1024, 'address_lists')
+
+
 def _encode_address_string(text, charset):
     """Split the email into parts and use header encoding on the name
     part if needed. We do this because the actual addresses need to be
     ASCII with no encoding for most SMTP servers, but the non-address
     parts should be encoded appropriately."""
+    key = (text, charset) if isinstance(text, str) else None
+    formatted = _address_cache.get(key) if key is not None else None
+    if formatted is None:
+        name, addr = parseaddr(text)
+        if isinstance(name, bytes):
+            try:
+                name.decode('us-ascii')
+            except UnicodeDecodeError:
+                if charset:
+                    name = Charset(charset).header_encode(name)
+        formatted = formataddr((name, addr))
+        if key is not None:
+            _address_cache.set(key, formatted)
     header = Header()
-    name, addr = parseaddr(text)
-    if isinstance(name, bytes):
-        try:
-            name.decode('us-ascii')
-        except UnicodeDecodeError:
-            if charset:
-                charset = Charset(charset)
-                name = charset.header_encode(name)
     # We again replace rather than raise an error or pass an 8bit string
-    header.append(formataddr((name, addr)), errors='replace')
+    header.append(formatted, errors='replace')
     return header
 
 
-def as_bytes(msg):
-    return msg.as_bytes()
-
-
-# work around https://github.com/python/cpython/issues/85479
-
-
-class FixedBytesGenerator(BytesGenerator):
-    def _handle_text(self, msg):
-        payload = msg._payload
-        if payload is None:
-            return
-        charset = msg.get_param('charset', 'utf-8')
-        if (charset is not None
-                and not self.policy.cte_type == '7bit'
-                and not _has_surrogates(payload)):
-            msg = copy(msg)
-            msg._payload = payload.encode(charset).decode(
-                'ascii', 'surrogateescape')
-        super()._handle_text(msg)
-
-    _writeBody = _handle_text
-
-
-class FixedMessage(Message):
-    def as_bytes(self, unixfrom=False, policy=None):
-        policy = self.policy if policy is None else policy
-        fp = BytesIO()
-        g = FixedBytesGenerator(fp, mangle_from_=False, policy=policy)
-        g.flatten(self, unixfrom=unixfrom)
-        return fp.getvalue()
-
+def _format_addresses(text):
+    """Return the addresses in the comma separated list *text*, formatted
+    the same way."""
+    addresses = _address_list_cache.get(text)
+    if addresses is None:
+        addresses = tuple(formataddr(addr) for addr in getaddresses((text, )))
+        _address_list_cache.set(text, addresses)
+    return list(addresses)
 
-if hasattr(Compat32, 'message_factory'):
-    fixed_policy = policy.compat32.clone(
-        linesep='\r\n', message_factory=FixedMessage)
-else:
-    fixed_policy = policy.compat32.clone(linesep='\r\n')
 
 message_from_string = partial(message_from_string, policy=fixed_policy)
+_message_factory = getattr(fixed_policy, 'message_factory', None) or Message
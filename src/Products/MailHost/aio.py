@@ -0,0 +1,272 @@
+##############################################################################
+#
+# Copyright (c) 2026 Zope Foundation and Contributors.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+"""Asynchronous mail delivery on an asyncio event loop.
+
+This requires the ``aiosmtplib`` package, which is installed with the
+``async`` extra of Products.MailHost.
+"""
+
+import asyncio
+import logging
+import threading
+import time
+from collections import defaultdict
+from email.message import Message
+
+from Products.MailHost import metrics
+from Products.MailHost.generator import PrefixedMessage
+from Products.MailHost.generator import as_bytes
+
+
+try:
+    import aiosmtplib
+except ImportError:
+    aiosmtplib = None
+
+LOG = logging.getLogger('MailHost')
+
+# Maximum number of SMTP sessions the engine keeps in flight
+MAX_SESSIONS = 200
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def available():
+    """ Return whether asynchronous delivery can be used.
+    """
+    return aiosmtplib is not None
+
+
+class AsyncDeliveryEngine:
+    """ Deliver mail from an asyncio event loop running in its own thread.
+
+    Messages are handed over with ``submit``, which returns at once. Up to
+    ``max_sessions`` SMTP sessions are active concurrently, spread over all
+    relays, and idle sessions are kept per relay for reuse.
+    """
+
+    smtp = None  # the SMTP client class, aiosmtplib.SMTP by default
+    closed = False  # set by ``shutdown``, no mail is taken then
+
+    def __init__(self, max_sessions=MAX_SESSIONS):
+        self.max_sessions = max_sessions
+        self._loop = None
+        self._thread = None
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._idle_event = threading.Event()
+        self._idle_event.set()
+        self._sessions = None
+        self._clients = defaultdict(list)  # maps settings -> idle clients
+
+    def start(self):
+        with self._lock:
+            if self.closed or (self._thread is not None
+                               and self._thread.is_alive()):
+                return
+            self._loop = asyncio.new_event_loop()
+            self._thread = threading.Thread(
+                target=self._run, name='Products.MailHost.AsyncDelivery',
+                daemon=True)
+            self._thread.start()
+
+    def is_alive(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def _run(self):
+        asyncio.set_event_loop(self._loop)
+        self._sessions = asyncio.Semaphore(self.max_sessions)
+        self._loop.run_forever()
+        self._loop.run_until_complete(self._close_clients())
+        self._loop.close()
+
+    def submit(self, settings, fromaddr, toaddrs, message):
+        """ Queue *message* for delivery to the relay given by *settings*.
+
+        *settings* is a ``SMTPSettings`` instance. The message is sent in the
+        background; failures are logged.
+        """
+        if isinstance(toaddrs, str):
+            toaddrs = [toaddrs]
+        if self.closed:
+            # Starting the loop again at process exit would have it killed
+            # in the middle of sending
+            metrics.inc('mailhost_smtp_failed_total')
+            LOG.error('Asynchronous delivery was shut down, mail from %s '
+                      'to %s was not sent', fromaddr, ', '.join(toaddrs))
+            return
+        if isinstance(message, (Message, PrefixedMessage)):
+            message = as_bytes(message)
+        self.start()
+        with self._lock:
+            self._pending += 1
+            self._idle_event.clear()
+        asyncio.run_coroutine_threadsafe(
+            self._deliver(settings, fromaddr, list(toaddrs), message),
+            self._loop)
+
+    def wait(self, timeout=None):
+        """ Wait until all submitted messages were handled.
+
+        Returns whether that happened within *timeout* seconds.
+        """
+        return self._idle_event.wait(timeout)
+
+    @property
+    def pending(self):
+        """ The number of submitted messages not yet handled.
+        """
+        return self._pending
+
+    def stop(self, timeout=None):
+        """ Wait up to *timeout* seconds for pending messages, then stop.
+
+        Stopping the event loop takes from the same *timeout*.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        self.wait(timeout)
+        with self._lock:
+            thread, loop = self._thread, self._loop
+            self._thread = None
+        if thread is not None and thread.is_alive():
+            loop.call_soon_threadsafe(loop.stop)
+            if deadline is not None:
+                timeout = max(deadline - time.monotonic(), 0)
+            thread.join(timeout)
+
+    def shutdown(self, timeout=None):
+        """ Stop as ``stop`` does, for good: mail submitted later is dropped.
+        """
+        self.closed = True
+        self.stop(timeout)
+
+    async def _deliver(self, settings, fromaddr, toaddrs, message):
+        try:
+            async with self._sessions:
+                client = await self._acquire(settings)
+                try:
+                    await client.sendmail(fromaddr, toaddrs, message)
+                except BaseException:
+                    self._discard(client)
+                    raise
+                self._clients[settings].append(client)
+            metrics.inc('mailhost_smtp_sent_total')
+            metrics.inc('mailhost_smtp_sent_bytes_total', len(message))
+        except Exception:
+            metrics.inc('mailhost_smtp_failed_total')
+            LOG.error('Asynchronous delivery from %s to %s via %s:%s failed',
+                      fromaddr, ', '.join(toaddrs), settings.hostname,
+                      settings.port, exc_info=True)
+        finally:
+            with self._lock:
+                self._pending -= 1
+                if not self._pending:
+                    self._idle_event.set()
+
+    async def _acquire(self, settings):
+        clients = self._clients[settings]
+        while clients:
+            client = clients.pop()
+            if client.is_connected:
+                return client
+        smtp = self.smtp or aiosmtplib.SMTP
+        client = smtp(**settings.client_kwargs())
+        await client.connect()
+        return client
+
+    def _discard(self, client):
+        if client.is_connected:
+            client.close()
+
+    async def _close_clients(self):
+        clients = [client for idle in self._clients.values()
+                   for client in idle]
+        self._clients.clear()
+        for client in clients:
+            if client.is_connected:
+                try:
+                    await client.quit()
+                except Exception:
+                    client.close()
+
+
+class SMTPSettings(tuple):
+    """ The relay and credentials a message is delivered with.
+    """
+
+    def __new__(cls, hostname='localhost', port=25, username=None,
+                password=None, force_tls=False, implicit_tls=False,
+                timeout=None):
+        return tuple.__new__(cls, (hostname, int(port), username, password,
+                                   bool(force_tls), bool(implicit_tls),
+                                   timeout))
+
+    hostname = property(lambda self: self[0])
+    port = property(lambda self: self[1])
+
+    def client_kwargs(self):
+        hostname, port, username, password, force_tls, implicit_tls, \
+            timeout = self
+        kwargs = {'hostname': hostname, 'port': port,
+                  'username': username, 'password': password}
+        if implicit_tls:
+            kwargs.update(use_tls=True, start_tls=False)
+        elif force_tls:
+            kwargs['start_tls'] = True
+        if timeout is not None:
+            kwargs['timeout'] = timeout
+        return kwargs
+
+
+class AsyncMailer:
+    """ Mailer handing messages over to the AsyncDeliveryEngine.
+
+    It is used with ``DirectMailBatchDelivery``: messages are handed over
+    when the transaction commits and ``send`` does not wait for the SMTP
+    server.
+
+    The ``smtp_rate_limit`` and ``smtp_max_sessions`` of a MailHost do not
+    apply, as waiting for them would block the event loop. The engine
+    limits the sessions of all relays to its ``max_sessions`` instead.
+    """
+
+    def __init__(self, engine, settings):
+        self.engine = engine
+        self.settings = settings
+
+    def vote(self, fromaddr, toaddrs, message):
+        self.engine.start()
+
+    def abort(self):
+        pass
+
+    def send(self, fromaddr, toaddrs, message):
+        self.engine.submit(self.settings, fromaddr, toaddrs, message)
+
+    def send_many(self, envelopes):
+        for fromaddr, toaddrs, message in envelopes:
+            self.send(fromaddr, toaddrs, message)
+
+
+def get_engine():
+    """ Return the engine shared by all MailHosts of this process.
+
+    It is stopped at process exit by ``Products.MailHost.MailHost.shutdown``.
+    """
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = AsyncDeliveryEngine()
+    return _engine
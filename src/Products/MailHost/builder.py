@@ -0,0 +1,136 @@
+##############################################################################
+#
+# Copyright (c) 2026 Zope Foundation and Contributors.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+"""Building large messages in other processes.
+
+Preparing the headers, setting the charsets and encoding the payload of a
+large message takes a while, during which the thread building it holds the
+GIL. A MailHost with ``smtp_build_processes`` hands messages larger than
+``smtp_build_threshold`` to a pool of that many processes instead, which
+return them serialized. The processes are started, not forked, as forking
+a process running threads is not safe, and only when first needed.
+
+A pool which breaks, because one of its processes died, is replaced by a
+new one, and the messages it was building are built in the thread which
+sent them instead. So are messages not built within ``BUILD_TIMEOUT``
+seconds, as the process building them may hang, and their pool is
+replaced as well.
+"""
+
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from threading import Lock
+from weakref import WeakKeyDictionary
+
+
+LOG = logging.getLogger('MailHost')
+
+# Seconds to wait for a message built in another process
+BUILD_TIMEOUT = 60.0
+
+build_pools = {}  # maps number of processes -> ProcessPoolExecutor
+build_pools_lock = Lock()
+
+_submitted = WeakKeyDictionary()  # maps Future -> (size, executor)
+
+
+def get_build_pool(size):
+    """ Return the shared pool of *size* processes, started if needed.
+
+    Pools of other sizes, left over from a change of
+    ``smtp_build_processes``, are shut down once their messages are built.
+    """
+    with build_pools_lock:
+        executor = build_pools.get(size)
+        stale = []
+        if executor is None:
+            stale = list(build_pools.values())
+            build_pools.clear()
+            executor = build_pools[size] = ProcessPoolExecutor(
+                size, mp_context=multiprocessing.get_context('spawn'))
+    for other in stale:
+        other.shutdown(wait=False)
+    return executor
+
+
+def submit(size, fn, *args):
+    """ Run ``fn(*args)`` in the pool of *size* processes.
+
+    Returns a ``Future`` of the result. A pool which broke, because one of
+    its processes died, is replaced by a new one.
+    """
+    executor = get_build_pool(size)
+    try:
+        future = executor.submit(fn, *args)
+    except BrokenProcessPool:
+        _discard(size, executor)
+        executor = get_build_pool(size)
+        future = executor.submit(fn, *args)
+    _submitted[future] = (size, executor)
+    future.add_done_callback(
+        lambda future: _discard_if_broken(size, executor, future))
+    return future
+
+
+def result(future, fn, *args, **kw):
+    """ Return the result of *future*, as returned by ``submit``.
+
+    If the pool broke while running it, or it did not finish within
+    ``BUILD_TIMEOUT`` seconds, ``fn(*args, **kw)`` is run in this process
+    instead. A pool which timed out is replaced.
+    """
+    try:
+        return future.result(timeout=BUILD_TIMEOUT)
+    except BrokenProcessPool:
+        LOG.warning('Message build process died, building in process')
+    except TimeoutError:
+        LOG.error('Message build process did not finish in %s seconds, '
+                  'building in process', BUILD_TIMEOUT)
+        future.cancel()
+        submitted = _submitted.get(future)
+        if submitted is not None:
+            _discard(*submitted, hanging=True)
+    return fn(*args, **kw)
+
+
+def _discard_if_broken(size, executor, future):
+    if not future.cancelled() and isinstance(future.exception(),
+                                             BrokenProcessPool):
+        _discard(size, executor)
+
+
+def _discard(size, executor, hanging=False):
+    """ Drop the broken *executor*, the next ``submit`` starts a new pool.
+
+    The processes of a *hanging* executor are ended where possible.
+    """
+    with build_pools_lock:
+        if build_pools.get(size) is executor:
+            del build_pools[size]
+    terminate = getattr(executor, 'terminate_workers', None)  # Python 3.14
+    if hanging and terminate is not None:
+        terminate()
+    else:
+        executor.shutdown(wait=False)
+
+
+def close_build_pools():
+    """ Stop the processes of all pools, dropping messages not started.
+    """
+    with build_pools_lock:
+        executors = list(build_pools.values())
+        build_pools.clear()
+    for executor in executors:
+        executor.shutdown(wait=True, cancel_futures=True)
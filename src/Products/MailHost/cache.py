@@ -0,0 +1,78 @@
+##############################################################################
+#
+# Copyright (c) 2026 Zope Foundation and Contributors.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+"""Bounded caches for the results of message preparation.
+"""
+
+from collections import OrderedDict
+from threading import Lock
+
+
+_marker = object()
+
+caches = {}  # maps name -> named LRUCache, for reporting
+
+
+class LRUCache:
+    """ Thread-safe mapping keeping the *maxsize* most recently used items.
+
+    Lookups through ``get`` are counted as hits and misses. A cache with a
+    *name* is listed by ``cache_statistics``.
+    """
+
+    def __init__(self, maxsize=256, name=None):
+        self.maxsize = maxsize
+        self.name = name
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = Lock()
+        if name is not None:
+            caches[name] = self
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        with self._lock:
+            value = self._data.get(key, _marker)
+            if value is _marker:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = 0
+
+    def statistics(self):
+        """ Return the number of ``hits`` and ``misses`` and the ``size``.
+        """
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses,
+                    'size': len(self._data), 'maxsize': self.maxsize}
+
+
+def cache_statistics():
+    """ Return the statistics of all named caches by name.
+    """
+    return {name: cache.statistics() for name, cache in caches.items()}
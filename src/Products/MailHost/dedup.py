@@ -0,0 +1,259 @@
+##############################################################################
+#
+# Copyright (c) 2026 Zope Foundation and Contributors.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+"""Keys of recently sent mail, for dropping duplicates.
+
+A MailHost with a ``smtp_dedup_window`` records a key for every message it
+sends, the ``idempotency_key`` given to ``send`` or a hash of the arguments.
+Mail with a key recorded in the last ``smtp_dedup_window`` seconds is
+dropped before it is built. The keys of queued mail are recorded in
+``sent.sqlite`` in the queue directory, which all processes using the queue
+share, those of mail sent without a queue in memory.
+
+The keys of mail sent in a transaction are recorded when it votes, so a
+request retried after a ``ConflictError`` sends its mail once, and of two
+requests sending the same mail at once the second fails to commit with a
+``DuplicateMailError``, which Zope retries. Mail sent immediately is
+recorded at once, and forgotten if sending fails.
+"""
+
+import hashlib
+import logging
+import os
+import sqlite3
+import time
+from email.message import Message
+from threading import Lock
+
+import transaction
+from transaction.interfaces import TransientError
+
+from Products.MailHost import metrics
+from Products.MailHost.delivery import BatchDataManager
+from Products.MailHost.sqlite import BUSY_TIMEOUT
+from Products.MailHost.sqlite import _transaction
+
+
+LOG = logging.getLogger('MailHost')
+
+INDEX_FILE = 'sent.sqlite'
+
+# Most keys kept in an index, the oldest are removed first
+MAX_KEYS = 100000
+
+# Number of keys recorded between removals of old keys
+PRUNE_INTERVAL = 100
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sent (
+    key TEXT PRIMARY KEY,
+    time REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sent_time ON sent (time);
+"""
+
+_indexes = {}  # maps queue path or None -> SentIndex
+_indexes_lock = Lock()
+
+
+class SentIndex:
+    """ Keys of the mail sent recently, with the time they were recorded.
+
+    The keys are kept in the ``INDEX_FILE`` database in the existing
+    folder at *path*, or in memory if *path* is ``None``. All threads
+    share one connection.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        if path is None:
+            self.database = ':memory:'
+        else:
+            self.database = os.path.join(path, INDEX_FILE)
+        self._connection = None
+        self._lock = Lock()
+        self._recorded = 0
+
+    def _connect(self):
+        if self._connection is None:
+            connection = sqlite3.connect(self.database, timeout=BUSY_TIMEOUT,
+                                         isolation_level=None,
+                                         check_same_thread=False)
+            if self.path is not None:
+                connection.execute('PRAGMA journal_mode=WAL')
+            connection.executescript(SCHEMA)
+            self._connection = connection
+        return self._connection
+
+    def seen(self, key, window):
+        """ Tell whether *key* was recorded in the last *window* seconds. """
+        with self._lock:
+            row = self._connect().execute(
+                'SELECT 1 FROM sent WHERE key = ? AND time > ?',
+                (key, time.time() - window)).fetchone()
+        return row is not None
+
+    def record(self, keys, window):
+        """ Record *keys* and return those not seen in *window* seconds.
+
+        Keys older than *window* seconds, and the oldest keys beyond
+        ``MAX_KEYS``, are removed now and then.
+        """
+        now = time.time()
+        recorded = []
+        with self._lock, _transaction(self._connect()) as connection:
+            for key in keys:
+                cursor = connection.execute(
+                    'INSERT INTO sent (key, time) VALUES (?, ?) '
+                    'ON CONFLICT (key) DO UPDATE SET time = excluded.time '
+                    'WHERE time <= ?', (key, now, now - window))
+                if cursor.rowcount:
+                    recorded.append(key)
+            self._recorded += len(keys)
+            if self._recorded >= PRUNE_INTERVAL:
+                self._recorded = 0
+                connection.execute('DELETE FROM sent WHERE time <= ?',
+                                   (now - window, ))
+                connection.execute(
+                    'DELETE FROM sent WHERE key IN (SELECT key FROM sent '
+                    'ORDER BY time DESC LIMIT -1 OFFSET ?)', (MAX_KEYS, ))
+        return recorded
+
+    def forget(self, keys):
+        """ Remove *keys*, for mail which could not be sent after all. """
+        with self._lock, _transaction(self._connect()) as connection:
+            connection.executemany('DELETE FROM sent WHERE key = ?',
+                                   [(key, ) for key in keys])
+
+
+class DuplicateMailError(TransientError):
+    """ Another transaction sent mail with the same key meanwhile.
+
+    Raised while the transaction votes. Zope retries the request, which
+    then finds the key and drops the mail.
+    """
+
+
+class SentKeysDataManager(BatchDataManager):
+    """ Record the keys of the mail sent in a transaction when it commits.
+
+    The keys are reserved while the transaction votes, so of two
+    transactions sending the same mail only one commits. The reservation
+    is undone if the transaction aborts after all.
+    """
+
+    def __init__(self, index, window):
+        super().__init__()
+        self.index = index
+        self.window = window
+        self.reserved = []
+
+    def add(self, key):
+        self.messages.append(key)
+
+    def tpc_vote(self, txn):
+        self.reserved = self.index.record(self.messages, self.window)
+        if len(self.reserved) < len(self.messages):
+            raise DuplicateMailError(
+                'Mail with the same key was sent by another transaction')
+
+    def tpc_finish(self, txn):
+        self.reserved = []
+
+    def tpc_abort(self, txn):
+        super().tpc_abort(txn)
+        reserved, self.reserved = self.reserved, []
+        if reserved:
+            try:
+                self.index.forget(reserved)
+            except Exception:
+                LOG.exception('Failed to forget mail keys in %s',
+                              self.index.database)
+
+
+def get_sent_index(path=None):
+    """ Return the index of the mail sent through the queue at *path*.
+
+    Without a *path* the index of mail sent without a queue is returned.
+    """
+    with _indexes_lock:
+        index = _indexes.get(path)
+        if index is None:
+            index = _indexes[path] = SentIndex(path)
+        return index
+
+
+def is_duplicate(index, key, window, immediate=False):
+    """ Tell whether mail with *key* was sent in the last *window* seconds.
+
+    Otherwise *key* is recorded in *index*, right away if the mail is sent
+    *immediate*, else when the current transaction commits.
+    """
+    if immediate:
+        duplicate = not index.record([key], window)
+    else:
+        txn = transaction.get()
+        try:
+            manager = txn.data(index)
+        except KeyError:
+            manager = SentKeysDataManager(index, window)
+            txn.join(manager)
+            txn.set_data(index, manager)
+        duplicate = key in manager.messages or index.seen(key, window)
+        if not duplicate:
+            manager.add(key)
+    if duplicate:
+        metrics.inc('mailhost_duplicates_total')
+    return duplicate
+
+
+def message_key(*args):
+    """ Return the key of the mail sent with the ``send`` arguments *args*.
+    """
+    digest = hashlib.sha256()
+    _update(digest, args)
+    return 'sha256:' + digest.hexdigest()
+
+
+def _update(digest, value):
+    """ Add *value* to *digest*, telling apart values of different types.
+    """
+    if isinstance(value, (tuple, list)):
+        digest.update(b'L%d:' % len(value))
+        for item in value:
+            _update(digest, item)
+        return
+    if isinstance(value, Message):
+        # Serializing would give a multipart message without a boundary a
+        # random one, changing the key and the caller's message
+        digest.update(b'M')
+        _update(digest, [_describe(part) for part in value.walk()])
+        return
+    if value is None:
+        tag, data = b'N', b''
+    elif isinstance(value, bytes):
+        tag, data = b'B', value
+    else:
+        tag, data = b'S', str(value).encode('utf-8', 'surrogatepass')
+    digest.update(b'%s%d:' % (tag, len(data)))
+    digest.update(data)
+
+
+def _describe(part):
+    """ Return the headers, content type and payload of the message *part*.
+    """
+    headers = [(name, str(value)) for name, value in part.items()]
+    if part.is_multipart():
+        payload = None
+    else:
+        payload = part.get_payload(decode=True)
+    return headers, part.get_content_type(), payload
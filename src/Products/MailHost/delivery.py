@@ -0,0 +1,395 @@
+##############################################################################
+#
+# Copyright (c) 2026 Zope Foundation and Contributors.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+"""Mail delivery implementations extending those of zope.sendmail.
+
+Besides bytes, these deliveries accept ``email.message.Message`` objects,
+which are serialized straight into the queue file or the SMTP connection.
+"""
+
+import email.parser
+import logging
+import os
+import random
+import socket
+import time
+from email.message import Message
+
+import transaction
+from transaction.interfaces import IDataManagerSavepoint
+from transaction.interfaces import ISavepointDataManager
+from zope.interface import implementer
+from zope.sendmail.delivery import DirectMailDelivery
+from zope.sendmail.delivery import MailDataManager
+from zope.sendmail.delivery import QueuedMailDelivery
+from zope.sendmail.maildir import Maildir
+from zope.sendmail.maildir import MaildirMessageWriter
+
+from Products.MailHost import metrics
+from Products.MailHost.generator import PrefixedMessage
+from Products.MailHost.generator import flatten
+
+
+LOG = logging.getLogger('MailHost')
+
+_maildirs = {}  # maps queue path -> Maildir
+
+
+def add_message_id(delivery, message):
+    """ Return the message id and *message* with a ``Message-Id`` header.
+
+    This is what ``AbstractMailDelivery.send`` does to each message before
+    joining the transaction. A ``Message`` object gets the header set in
+    place, a ``PrefixedMessage`` a new prefix with it, anything else is
+    returned as bytes.
+    """
+    if isinstance(message, Message):
+        messageid = message['Message-Id']
+        if messageid is None:
+            messageid = '<%s>' % delivery.newMessageId()
+            message['Message-Id'] = messageid
+    else:
+        if isinstance(message, str):
+            message = message.encode('utf-8')
+        if isinstance(message, PrefixedMessage):
+            prefix, body = message.prefix, message.body
+        else:
+            prefix, body = b'', message
+        # determine line separator type (assumes consistency)
+        nli = body.find(b'\n')
+        line_sep = b'\n' if nli < 1 or body[nli - 1:nli] != b'\r' \
+            else b'\r\n'
+        end = body.find(line_sep * 2)
+        header = body[:end] if end >= 0 else body
+        messageid = email.parser.BytesParser().parsebytes(
+            header, headersonly=True).get('Message-Id')
+        if messageid is None:
+            messageid = '<%s>' % delivery.newMessageId()
+            prefix = b'Message-Id: %s%s%s' % (
+                messageid.encode(), line_sep, prefix)
+            if isinstance(message, PrefixedMessage):
+                message = PrefixedMessage(prefix, body)
+            else:
+                message = prefix + body
+    if not messageid.startswith('<') or not messageid.endswith('>'):
+        raise ValueError('Malformed Message-Id header')
+    return messageid[1:-1], message
+
+
+class DirectMailBatchDelivery(DirectMailDelivery):
+    """ Direct delivery of one or many messages over a single SMTP session.
+    """
+
+    def send(self, fromaddr, toaddrs, message):
+        messageid, message = add_message_id(self, message)
+        transaction.get().join(
+            self.createDataManager(fromaddr, toaddrs, message))
+        return messageid
+
+    def sendMany(self, envelopes):
+        """ Send ``(fromaddr, toaddrs, message)`` triples on commit.
+        """
+        envelopes = [(fromaddr, toaddrs, add_message_id(self, message)[1])
+                     for fromaddr, toaddrs, message in envelopes]
+        if not envelopes:
+            return
+        mailer = self.mailer
+
+        def vote(envelopes):
+            mailer.vote(*envelopes[0])
+
+        transaction.get().join(
+            MailDataManager(mailer.send_many, args=(envelopes, ),
+                            vote=vote, onAbort=mailer.abort))
+
+
+@implementer(ISavepointDataManager)
+class BatchDataManager:
+    """ Base for writing all messages queued in one transaction at once.
+
+    The messages are collected until the transaction commits. Subclasses
+    write them out in ``tpc_vote``, so a full disk aborts the transaction,
+    and hand them to the queue processor in ``tpc_finish``.
+    """
+
+    def __init__(self):
+        self.messages = []
+        # Use the default thread transaction manager.
+        self.transaction_manager = transaction.manager
+
+    def add(self, fromaddr, toaddrs, message):
+        self.messages.append((fromaddr, toaddrs, message))
+
+    def commit(self, txn):
+        pass
+
+    def abort(self, txn):
+        del self.messages[:]
+
+    def tpc_abort(self, txn):
+        self.abort(txn)
+
+    def sortKey(self):
+        return str(id(self))
+
+    def savepoint(self):
+        return QueueSavepoint(self)
+
+    def tpc_begin(self, txn, subtransaction=False):
+        assert not subtransaction
+
+    def beforeCompletion(self, txn):
+        "This object does not do anything in beforeCompletion"
+
+    afterCompletion = beforeCompletion
+
+
+class QueueDataManager(BatchDataManager):
+    """ Write all messages queued in one transaction into one mail queue.
+
+    The messages are written to the ``tmp`` folder of the queue and synced
+    to disk while the transaction votes. When it is finished, the messages
+    are moved to ``new`` and the folder is synced once for all of them.
+    """
+
+    def __init__(self, maildir):
+        super().__init__()
+        self.maildir = maildir
+        self.written = []
+
+    def _write(self, fromaddr, toaddrs, message):
+        with metrics.timed('mailhost_queue_write_seconds'):
+            msg = self.maildir.newMessage()
+            self.written.append(msg)
+            msg.write(b'X-Zope-From: %s\n' % fromaddr.encode())
+            msg.write(b'X-Zope-To: %s\n' % ', '.join(toaddrs).encode())
+            if isinstance(message, (Message, PrefixedMessage)):
+                flatten(message, msg)
+            else:
+                msg.write(message)
+        metrics.inc('mailhost_queue_written_total')
+
+    def abort(self, txn):
+        for msg in self.written:
+            try:
+                msg.abort()
+            except OSError:
+                LOG.exception('Failed to remove %s', msg.filename)
+        del self.written[:]
+        super().abort(txn)
+
+    def tpc_vote(self, txn):
+        try:
+            for fromaddr, toaddrs, message in self.messages:
+                self._write(fromaddr, toaddrs, message)
+            for msg in self.written:
+                msg.sync()
+                msg.close()
+        except OSError:
+            # The queue folder may have been removed since it was checked
+            _maildirs.pop(self.maildir.path, None)
+            raise
+
+    def tpc_finish(self, txn):
+        # As in MailDataManager, an exception here must not break the
+        # transaction, which is already committed elsewhere. Every message
+        # is moved on its own, so one failure does not hold up the others.
+        for msg in self.written:
+            try:
+                msg.commit()
+            except Exception:
+                LOG.exception('Failed to move %s to %s', msg.filename,
+                              msg.new_filename)
+        try:
+            fsync_directory(os.path.join(self.maildir.path, 'new'))
+        except Exception:
+            LOG.exception('Failed in tpc_finish for %s', self.maildir.path)
+
+
+@implementer(IDataManagerSavepoint)
+class QueueSavepoint:
+    """ Forget the messages queued after the savepoint on rollback. """
+
+    def __init__(self, manager):
+        self.manager = manager
+        self.length = len(manager.messages)
+
+    def rollback(self):
+        del self.manager.messages[self.length:]
+
+
+def fsync_directory(path):
+    """ Sync the entries of the folder at *path* to disk, where possible.
+    """
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:  # Windows cannot open folders
+        return
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class QueueMessageWriter(MaildirMessageWriter):
+    """ A message being written into a queue, which can be synced to disk.
+    """
+
+    def __init__(self, file, filename, new_filename):
+        super().__init__(file, filename, new_filename)
+        self.file = file
+        self.filename = filename
+        self.new_filename = new_filename
+
+    def sync(self):
+        """ Write the message out to disk. """
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+
+class QueueMaildir(Maildir):
+    """ A ``Maildir`` writing new messages with a ``QueueMessageWriter``.
+    """
+
+    def newMessage(self):
+        host = socket.gethostname()
+        for attempt in range(1000):
+            unique = '%d.%d.%s.%d' % (time.time(), os.getpid(), host,
+                                      random.randrange(0x7fffffff))
+            filename = os.path.join(self.path, 'tmp', unique)
+            try:
+                fd = os.open(filename, os.O_CREAT | os.O_EXCL | os.O_WRONLY,
+                             0o600)
+            except FileExistsError:
+                continue
+            return QueueMessageWriter(os.fdopen(fd, 'wb'), filename,
+                                      os.path.join(self.path, 'new', unique))
+        raise RuntimeError('Failed to create a unique file name in %s'
+                           % os.path.join(self.path, 'tmp'))
+
+
+def get_maildir(path):
+    """ Return the ``Maildir`` at *path*, created if needed, checked once.
+    """
+    maildir = _maildirs.get(path)
+    if maildir is None:
+        maildir = _maildirs[path] = QueueMaildir(path, True)
+    return maildir
+
+
+class QueuedMailBatchDelivery(QueuedMailDelivery):
+    """ Queued delivery of one or many messages into one mail queue.
+
+    All messages queued into the same queue during a transaction are
+    written by one ``QueueDataManager``.
+    """
+
+    def send(self, fromaddr, toaddrs, message):
+        messageid, message = add_message_id(self, message)
+        self.getDataManager().add(fromaddr, toaddrs, message)
+        return messageid
+
+    def sendMany(self, envelopes):
+        """ Queue ``(fromaddr, toaddrs, message)`` triples on commit.
+        """
+        manager = self.getDataManager()
+        for fromaddr, toaddrs, message in envelopes:
+            manager.add(fromaddr, toaddrs, add_message_id(self, message)[1])
+
+    def getDataManager(self):
+        """ Return the data manager of the queue in the current transaction.
+        """
+        maildir = get_maildir(self.queuePath)
+        txn = transaction.get()
+        try:
+            return txn.data(maildir)
+        except KeyError:
+            manager = QueueDataManager(maildir)
+            txn.join(manager)
+            txn.set_data(maildir, manager)
+            return manager
+
+
+class StorageMailDelivery(QueuedMailBatchDelivery):
+    """ Queued delivery of one or many messages into a queue storage.
+
+    The messages are added with their priority to the data manager made
+    by ``dataManagerFactory`` for the *queue*, one per transaction.
+    """
+
+    dataManagerFactory = None
+
+    def __init__(self, queue, priority=None):
+        super().__init__(queue.path)
+        self.queue = queue
+        self.priority = priority or 'normal'
+
+    def send(self, fromaddr, toaddrs, message):
+        messageid, message = add_message_id(self, message)
+        self.getDataManager().add(fromaddr, toaddrs, message, self.priority)
+        return messageid
+
+    def sendMany(self, envelopes):
+        manager = self.getDataManager()
+        for fromaddr, toaddrs, message in envelopes:
+            manager.add(fromaddr, toaddrs, add_message_id(self, message)[1],
+                        self.priority)
+
+    def getDataManager(self):
+        txn = transaction.get()
+        try:
+            return txn.data(self.queue)
+        except KeyError:
+            manager = self.dataManagerFactory(self.queue)
+            txn.join(manager)
+            txn.set_data(self.queue, manager)
+            return manager
+
+
+class RenderDataManager(BatchDataManager):
+    """ Build the mail sent in one transaction only when it commits.
+
+    ``add`` records a callable with its arguments. A before commit hook
+    calls them in order, so their messages are built and handed to their
+    delivery just before the transaction votes. Nothing is built for
+    transactions which abort, and a savepoint rollback forgets what was
+    added after the savepoint.
+    """
+
+    def add(self, render, *args):
+        self.messages.append((render, args))
+
+    def render(self):
+        messages = list(self.messages)
+        del self.messages[:]
+        for render, args in messages:
+            render(*args)
+
+    def tpc_vote(self, txn):
+        pass
+
+    def tpc_finish(self, txn):
+        pass
+
+
+def render_on_commit(render, *args):
+    """ Call *render* with *args* when the current transaction commits.
+    """
+    txn = transaction.get()
+    try:
+        manager = txn.data(RenderDataManager)
+    except KeyError:
+        manager = RenderDataManager()
+        txn.join(manager)
+        txn.set_data(RenderDataManager, manager)
+        txn.addBeforeCommitHook(manager.render)
+    manager.add(render, *args)
@@ -56,26 +56,105 @@ class MailHostXMLAdapter(XMLAdapterBase):
             qdir = ''
         node.setAttribute('smtp_queue_directory', str(qdir))
 
+        workers = getattr(self.context, 'smtp_queue_workers', 1)
+        node.setAttribute('smtp_queue_workers', str(workers))
+        max_attempts = getattr(self.context, 'smtp_queue_max_attempts', 20)
+        node.setAttribute('smtp_queue_max_attempts', str(max_attempts))
+        weighted = bool(getattr(self.context, 'smtp_queue_weighted', False))
+        node.setAttribute('smtp_queue_weighted', str(weighted))
+        backend = getattr(self.context, 'smtp_queue_backend', 'maildir')
+        node.setAttribute('smtp_queue_backend', backend)
+
+        smtp_async = bool(getattr(self.context, 'smtp_async', False))
+        node.setAttribute('smtp_async', str(smtp_async))
+        on_commit = bool(getattr(self.context, 'smtp_render_on_commit', False))
+        node.setAttribute('smtp_render_on_commit', str(on_commit))
+        dedup_window = getattr(self.context, 'smtp_dedup_window', 0.0)
+        node.setAttribute('smtp_dedup_window', str(dedup_window))
+        processes = getattr(self.context, 'smtp_build_processes', 0)
+        node.setAttribute('smtp_build_processes', str(processes))
+        threshold = getattr(self.context, 'smtp_build_threshold', 256 * 1024)
+        node.setAttribute('smtp_build_threshold', str(threshold))
+
+        pool_size = getattr(self.context, 'smtp_pool_size', 0)
+        node.setAttribute('smtp_pool_size', str(pool_size))
+        idle_timeout = getattr(self.context, 'smtp_pool_idle_timeout', 60.0)
+        node.setAttribute('smtp_pool_idle_timeout', str(idle_timeout))
+        rate_limit = getattr(self.context, 'smtp_rate_limit', 0.0)
+        node.setAttribute('smtp_rate_limit', str(rate_limit))
+        max_sessions = getattr(self.context, 'smtp_max_sessions', 0)
+        node.setAttribute('smtp_max_sessions', str(max_sessions))
+
+        batch_size = getattr(self.context, 'smtp_recipient_batch_size', 0)
+        node.setAttribute('smtp_recipient_batch_size', str(batch_size))
+        stream_threshold = getattr(self.context, 'smtp_stream_threshold', 0)
+        node.setAttribute('smtp_stream_threshold', str(stream_threshold))
+
+        for line in getattr(self.context, 'smtp_routes', ()):
+            child = self._doc.createElement('route')
+            child.appendChild(self._doc.createTextNode(line))
+            node.appendChild(child)
+
         self._logger.info('Mailhost exported.')
         return node
 
     def _importNode(self, node):
         """Import the object from the DOM node.
+
+        All values are read and checked as by ``manage_makeChanges``
+        before any is set, so an invalid node changes nothing.
         """
-        self.context.smtp_host = str(node.getAttribute('smtp_host'))
-        self.context.smtp_port = int(node.getAttribute('smtp_port'))
-        smtp_uid = node.getAttribute('smtp_uid')
-        smtp_pwd = node.getAttribute('smtp_pwd')
-        self.context.smtp_uid = smtp_uid
-        self.context.smtp_pwd = smtp_pwd
+        context = self.context
+        values = {'smtp_host': str(node.getAttribute('smtp_host')),
+                  'smtp_port': int(node.getAttribute('smtp_port')),
+                  'smtp_uid': node.getAttribute('smtp_uid'),
+                  'smtp_pwd': node.getAttribute('smtp_pwd')}
 
         # Older MH instances won't have 'smtp_queue' in instance dict
-        if 'smtp_queue' in self.context.__dict__:
+        if 'smtp_queue' in context.__dict__:
             if node.hasAttribute('smtp_queue'):
                 queue = node.getAttribute('smtp_queue')
-                self.context.smtp_queue = self._convertToBoolean(queue)
+                values['smtp_queue'] = self._convertToBoolean(queue)
             if node.hasAttribute('smtp_queue_directory'):
                 qd = node.getAttribute('smtp_queue_directory')
-                self.context.smtp_queue_directory = str(qd)
+                values['smtp_queue_directory'] = str(qd)
+
+        for name, convert in (
+                ('smtp_queue_workers', lambda v: max(int(v), 1)),
+                ('smtp_queue_max_attempts', lambda v: max(int(v), 0)),
+                ('smtp_queue_weighted', self._convertToBoolean),
+                ('smtp_async', self._convertToBoolean),
+                ('smtp_render_on_commit', self._convertToBoolean),
+                ('smtp_dedup_window', lambda v: max(float(v), 0.0)),
+                ('smtp_build_processes', lambda v: max(int(v), 0)),
+                ('smtp_build_threshold', lambda v: max(int(v), 0)),
+                ('smtp_pool_size', int),
+                ('smtp_pool_idle_timeout', float),
+                ('smtp_rate_limit', lambda v: max(float(v), 0.0)),
+                ('smtp_max_sessions', lambda v: max(int(v), 0)),
+                ('smtp_recipient_batch_size', lambda v: max(int(v), 0)),
+                ('smtp_stream_threshold', lambda v: max(int(v), 0))):
+            if node.hasAttribute(name):
+                values[name] = convert(node.getAttribute(name))
+
+        backend = context.smtp_queue_backend
+        if node.hasAttribute('smtp_queue_backend'):
+            backend = str(node.getAttribute('smtp_queue_backend'))
+        routes = tuple(self._getNodeText(child)
+                       for child in node.childNodes
+                       if child.nodeName == 'route')
+        if not routes and not self.environ.shouldPurge():
+            routes = context.smtp_routes
+        # Checked as by manage_makeChanges, raises ValueError
+        values['smtp_routes'] = context._checkQueueSettings(routes, backend)
+        values['smtp_queue_backend'] = backend
+
+        processor_keys = context._getProcessorKeys()
+        queue_backend = context.smtp_queue_backend
+        pool_keys = context._getPoolKeys()
+        for name, value in values.items():
+            setattr(context, name, value)
+        context._closeUnusedPools(pool_keys)
+        context._stopUnusedProcessors(processor_keys, queue_backend)
 
         self._logger.info('Mailhost imported.')
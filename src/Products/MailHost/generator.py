@@ -0,0 +1,126 @@
+##############################################################################
+#
+# Copyright (c) 2026 Zope Foundation and Contributors.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+"""Serialization of outgoing messages.
+"""
+
+from copy import copy
+from email import policy
+from email._policybase import Compat32
+from email.generator import BytesGenerator
+from email.generator import _has_surrogates
+from email.message import Message
+from io import BytesIO
+
+from Products.MailHost import metrics
+from Products.MailHost.cache import LRUCache
+
+
+# Maps (policy, name, value) -> header line as written by the generator
+_folded_headers = LRUCache(1024, 'folded_headers')
+
+
+@metrics.timed('mailhost_as_bytes_seconds')
+def as_bytes(msg):
+    return msg.as_bytes()
+
+
+def flatten(msg, fp):
+    """Write *msg* to the binary file *fp*.
+
+    The result is the same as ``fp.write(as_bytes(msg))``, without building
+    the whole message in memory first.
+    """
+    if isinstance(msg, PrefixedMessage):
+        fp.write(msg.prefix)
+        fp.write(msg.body)
+        return
+    if isinstance(msg, FixedMessage):
+        generator = FixedBytesGenerator
+    else:
+        generator = BytesGenerator
+    generator(fp, mangle_from_=False, policy=msg.policy).flatten(msg)
+
+
+class PrefixedMessage:
+    """A serialized message with header lines to send in front of it.
+
+    The personalized copies of a message share its bytes as *body*, instead
+    of each holding the concatenation. ``flatten`` writes both parts one
+    after the other, ``as_bytes`` returns the concatenation.
+    """
+
+    __slots__ = ('prefix', 'body')
+
+    def __init__(self, prefix, body):
+        self.prefix = prefix
+        self.body = body
+
+    def __len__(self):
+        return len(self.prefix) + len(self.body)
+
+    def __bytes__(self):
+        return self.prefix + self.body
+
+    as_bytes = __bytes__
+
+
+# work around https://github.com/python/cpython/issues/85479
+
+
+class FixedBytesGenerator(BytesGenerator):
+    def _write_headers(self, msg):
+        # Folding is costly and most headers repeat from message to message
+        policy = self.policy
+        for h, v in msg.raw_items():
+            if isinstance(v, str):
+                key = (policy, h, v)
+                folded = _folded_headers.get(key)
+                if folded is None:
+                    folded = policy.fold_binary(h, v)
+                    _folded_headers.set(key, folded)
+            else:
+                folded = policy.fold_binary(h, v)
+            self._fp.write(folded)
+        # A blank line always separates headers from body
+        self.write(self._NL)
+
+    def _handle_text(self, msg):
+        payload = msg._payload
+        if payload is None:
+            return
+        charset = msg.get_param('charset', 'utf-8')
+        if (charset is not None
+                and not self.policy.cte_type == '7bit'
+                and not _has_surrogates(payload)):
+            msg = copy(msg)
+            msg._payload = payload.encode(charset).decode(
+                'ascii', 'surrogateescape')
+        super()._handle_text(msg)
+
+    _writeBody = _handle_text
+
+
+class FixedMessage(Message):
+    def as_bytes(self, unixfrom=False, policy=None):
+        policy = self.policy if policy is None else policy
+        fp = BytesIO()
+        g = FixedBytesGenerator(fp, mangle_from_=False, policy=policy)
+        g.flatten(self, unixfrom=unixfrom)
+        return fp.getvalue()
+
+
+if hasattr(Compat32, 'message_factory'):
+    fixed_policy = policy.compat32.clone(
+        linesep='\r\n', message_factory=FixedMessage)
+else:
+    fixed_policy = policy.compat32.clone(linesep='\r\n')
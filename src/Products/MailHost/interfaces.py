@@ -13,12 +13,71 @@
 """MailHost interfaces.
 """
 
+from zope.interface import Attribute
 from zope.interface import Interface
 
 
 class IMailHost(Interface):
 
     def send(messageText, mto=None, mfrom=None, subject=None, encode=None,
-             charset=None, msg_type=None):
+             charset=None, msg_type=None, recipient_batch_size=None,
+             personalize=False, priority=None, idempotency_key=None):
         """Send mail.
+
+        With *recipient_batch_size* the recipients are split into envelopes
+        of at most that many addresses. With *personalize* every recipient
+        gets a message with only their own address in the ``To`` header.
+        Either way the message is serialized only once.
+
+        Queued mail of *priority* ``high`` is sent before mail of ``normal``
+        priority, the default, and that before mail of ``low`` priority.
+
+        With a ``smtp_dedup_window`` mail with the same *idempotency_key*,
+        or the same arguments if none is given, as mail sent in the last
+        ``smtp_dedup_window`` seconds is dropped.
+        """
+
+    def send_many(messages, immediate=False, priority=None):
+        """Send many mails over a single SMTP session or queue write.
+
+        Each item of *messages* is either a message as accepted by ``send``
+        or a tuple of ``send`` arguments in the order ``(messageText, mto,
+        mfrom, subject, encode, charset, msg_type)``. All are queued with
+        the same *priority*.
+        """
+
+
+class IQueueStorage(Interface):
+    """Storage of the messages of a mail queue."""
+
+    path = Attribute("The directory of the queue.")
+
+    def create():
+        """Create the queue at ``path`` if it does not exist yet.
+        """
+
+    def delivery(priority=None):
+        """Return a delivery queueing mail of *priority* into the queue.
+
+        The delivery has the ``send`` and ``sendMany`` methods of
+        ``Products.MailHost.delivery.QueuedMailBatchDelivery`` and writes
+        the messages when the transaction commits.
+        """
+
+    def processor(mailer_factory, count=1, max_attempts=20, weighted=False):
+        """Return a processor sending the queued mail in *count* threads.
+
+        Every thread gets a mailer from *mailer_factory*. Messages which
+        could not be sent *max_attempts* times are given up, 0 retries
+        them forever. The processor has the ``start``, ``halt``, ``stop``,
+        ``join`` and ``is_alive`` methods of
+        ``Products.MailHost.queue.QueueProcessorGroup``.
+        """
+
+    def statistics(max_age=2.0):
+        """Return the number of messages in the queue by state.
+
+        The states are ``new``, ``sending``, ``deferred``, ``failed`` and
+        ``dead``. Counts may be up to *max_age* seconds old. Raises
+        ``ValueError`` if there is no queue at ``path``.
         """
@@ -0,0 +1,181 @@
+##############################################################################
+#
+# Copyright (c) 2026 Zope Foundation and Contributors.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+"""Counters and timings of mail delivery.
+
+The module functions ``inc``, ``observe`` and ``timed`` record into the
+current registry, a ``MetricsRegistry`` unless another object with ``inc``
+and ``observe`` methods was installed with ``set_registry``, e.g. to forward
+the measurements to a statsd server.
+"""
+
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from threading import Lock
+
+
+# Upper bounds of the histogram buckets, in seconds
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0)
+
+COUNTERS = {
+    'mailhost_messages_total': 'Messages passed to MailHost.send',
+    'mailhost_smtp_sent_total': 'Messages accepted by the SMTP server',
+    'mailhost_smtp_failed_total': 'Messages the SMTP server did not accept',
+    'mailhost_smtp_sent_bytes_total': 'Bytes of messages sent via SMTP',
+    'mailhost_queue_written_total': 'Messages written into the mail queue',
+    'mailhost_queue_processed_total':
+        'Queued messages handled by the queue processor',
+    'mailhost_queue_retries_total': 'Queued messages deferred for a retry',
+    'mailhost_duplicates_total':
+        'Messages dropped as duplicates of mail sent recently',
+}
+
+HISTOGRAMS = {
+    'mailhost_send_seconds': 'Duration of MailHost.send',
+    'mailhost_munge_headers_seconds': 'Duration of preparing the headers',
+    'mailhost_as_bytes_seconds': 'Duration of serializing a message',
+    'mailhost_smtp_connect_seconds':
+        'Duration of opening a SMTP connection, up to EHLO and STARTTLS',
+    'mailhost_smtp_auth_seconds': 'Duration of the SMTP login',
+    'mailhost_smtp_data_seconds':
+        'Duration of a SMTP mail transaction, from MAIL FROM to DATA',
+    'mailhost_queue_write_seconds':
+        'Duration of writing a message into the mail queue',
+    'mailhost_queue_process_seconds':
+        'Duration of handling a queued message by the queue processor',
+}
+
+
+class Histogram:
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+
+class MetricsRegistry:
+    """ Thread-safe registry of counters and histograms.
+    """
+
+    def __init__(self, counters=COUNTERS, histograms=HISTOGRAMS):
+        self.help = dict(counters)
+        self.help.update(histograms)
+        self.counters = dict.fromkeys(counters, 0)
+        self.histograms = {name: Histogram() for name in histograms}
+        self._lock = Lock()
+
+    def inc(self, name, amount=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def observe(self, name, value):
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.observe(value)
+
+    def snapshot(self):
+        """ Return the current values as a mapping.
+
+        Counters map to their value, histograms to a mapping with the
+        ``count`` and ``sum`` of the observations and the cumulative counts
+        of the ``buckets`` by upper bound.
+        """
+        with self._lock:
+            result = dict(self.counters)
+            for name, histogram in self.histograms.items():
+                cumulative = 0
+                buckets = []
+                for bound, count in zip(histogram.buckets + (float('inf'), ),
+                                        histogram.counts):
+                    cumulative += count
+                    buckets.append((bound, cumulative))
+                result[name] = {'count': histogram.count,
+                                'sum': histogram.sum,
+                                'buckets': buckets}
+        return result
+
+    def prometheus(self):
+        """ Return the current values in the Prometheus text format.
+        """
+        lines = []
+        for name, value in sorted(self.snapshot().items()):
+            if name in self.help:
+                lines.append('# HELP %s %s' % (name, self.help[name]))
+            if not isinstance(value, dict):
+                lines.append('# TYPE %s counter' % name)
+                lines.append('%s %s' % (name, _format(value)))
+                continue
+            lines.append('# TYPE %s histogram' % name)
+            for bound, count in value['buckets']:
+                lines.append('%s_bucket{le="%s"} %d'
+                             % (name, _format(bound), count))
+            lines.append('%s_sum %s' % (name, _format(value['sum'])))
+            lines.append('%s_count %d' % (name, value['count']))
+        return '\n'.join(lines) + '\n'
+
+    def reset(self):
+        with self._lock:
+            self.counters = dict.fromkeys(self.counters, 0)
+            self.histograms = {name: Histogram(histogram.buckets)
+                               for name, histogram in self.histograms.items()}
+
+
+def _format(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+_registry = MetricsRegistry()
+
+
+def get_registry():
+    return _registry
+
+
+def set_registry(registry):
+    """ Install *registry* to receive all measurements.
+    """
+    global _registry
+    _registry = registry
+
+
+def inc(name, amount=1):
+    _registry.inc(name, amount)
+
+
+def observe(name, value):
+    _registry.observe(name, value)
+
+
+@contextmanager
+def timed(name):
+    """ Record the time spent in the ``with`` block in histogram *name*.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _registry.observe(name, time.perf_counter() - start)
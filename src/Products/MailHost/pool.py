@@ -0,0 +1,380 @@
+##############################################################################
+#
+# Copyright (c) 2026 Zope Foundation and Contributors.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+"""Pooling of live SMTP sessions.
+"""
+
+import re
+import smtplib
+import time
+from collections import deque
+from email.message import Message
+from threading import Lock
+
+from zope.sendmail.mailer import SMTPMailer
+
+from Products.MailHost import metrics
+from Products.MailHost.generator import PrefixedMessage
+from Products.MailHost.generator import flatten
+
+
+connection_pools = {}  # maps SMTP connection settings -> connection pool
+pools_lock = Lock()
+
+# Seconds to wait for a free session before looking for idle connections
+SESSION_WAIT = 1.0
+
+# Seconds to wait for a free session in all before giving up
+SESSION_TIMEOUT = 30.0
+
+
+class SessionUnavailable(smtplib.SMTPException):
+    """ No SMTP session became available within ``SESSION_TIMEOUT``.
+    """
+
+
+class SMTPConnectionPool:
+    """ Thread-safe pool of idle, authenticated SMTP connections.
+
+    At most ``max_size`` idle connections are kept. Connections which were
+    idle for longer than ``idle_timeout`` seconds or which do not answer a
+    ``NOOP`` are closed instead of being handed out again. A pool with a
+    ``max_size`` of 0 keeps nothing and closes every connection on release.
+
+    With a ``limiter``, a ``RelayLimiter``, new connections are only opened
+    while it grants a session, and closing a connection gives it back.
+    """
+
+    def __init__(self, max_size=0, idle_timeout=60.0, limiter=None):
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.limiter = limiter
+        self._idle = deque()  # (connection, time of release), oldest first
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._idle)
+
+    def acquire(self, connect, timeout=None):
+        """ Return a healthy connection, calling *connect* if none is idle.
+
+        If the limiter grants no session for *timeout* seconds,
+        ``SESSION_TIMEOUT`` by default, ``SessionUnavailable`` is raised.
+        Waiting without end would deadlock a thread which holds the
+        sessions itself, e.g. one sending several messages directly in one
+        transaction.
+        """
+        limiter = self.limiter
+        if timeout is None:
+            timeout = SESSION_TIMEOUT
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._lock:
+                # Reuse the most recently used connection, it is the one
+                # most likely to still be alive on the server side.
+                idle = self._idle.pop() if self._idle else None
+            if idle is not None:
+                connection, released = idle
+                if time.time() - released > self.idle_timeout:
+                    self._close(connection)
+                elif self._check(connection.noop):
+                    return connection
+                else:
+                    self._close(connection)
+            elif limiter is None or limiter.open_session(
+                    min(SESSION_WAIT, max(deadline - time.monotonic(), 0))):
+                break
+            elif time.monotonic() >= deadline:
+                raise SessionUnavailable(
+                    'No SMTP session available within %s seconds, all %s '
+                    'are in use' % (timeout, limiter.max_sessions))
+        try:
+            return connect()
+        except BaseException:
+            if limiter is not None:
+                limiter.close_session()
+            raise
+
+    def release(self, connection, reset=False):
+        """ Hand *connection* back to the pool.
+
+        With *reset* the session state is cleared with ``RSET`` first, which
+        is required after a failed or aborted mail transaction.
+        """
+        if reset and not self._check(connection.rset):
+            self._close(connection)
+            return
+        now = time.time()
+        expired = []
+        with self._lock:
+            while self._idle and now - self._idle[0][1] > self.idle_timeout:
+                expired.append(self._idle.popleft()[0])
+            if len(self._idle) < self.max_size:
+                self._idle.append((connection, now))
+                connection = None
+        for conn in expired:
+            self._close(conn)
+        if connection is not None:
+            self._close(connection)
+        elif self.limiter is not None:
+            # Somebody may be waiting for a session to become available
+            self.limiter.wake()
+
+    def discard(self, connection):
+        """ Close *connection* without returning it to the pool.
+        """
+        self._close(connection)
+
+    def clear(self):
+        """ Close all idle connections.
+        """
+        with self._lock:
+            idle = [connection for connection, released in self._idle]
+            self._idle.clear()
+        for connection in idle:
+            self._close(connection)
+
+    def _check(self, command):
+        try:
+            code, response = command()
+        except (smtplib.SMTPException, OSError):
+            return False
+        return code == 250
+
+    def _close(self, connection):
+        try:
+            connection.quit()
+        except (smtplib.SMTPException, OSError):
+            # The server went away already, just drop the socket
+            connection.close()
+        if self.limiter is not None:
+            self.limiter.close_session()
+
+
+def get_pool(key, max_size, idle_timeout, limiter=None):
+    """ Return the shared pool for the connection settings *key*.
+    """
+    pool = connection_pools.get(key)
+    if pool is None:
+        with pools_lock:
+            pool = connection_pools.get(key)
+            if pool is None:
+                pool = connection_pools[key] = SMTPConnectionPool(
+                    limiter=limiter)
+    pool.max_size = max_size
+    pool.idle_timeout = idle_timeout
+    return pool
+
+
+def close_pool(key):
+    """ Close and forget the shared pool for the connection settings *key*.
+    """
+    with pools_lock:
+        pool = connection_pools.pop(key, None)
+    if pool is not None:
+        pool.clear()
+
+
+def close_pools():
+    """ Close and forget all shared pools.
+    """
+    with pools_lock:
+        pools = list(connection_pools.values())
+        connection_pools.clear()
+    for pool in pools:
+        pool.clear()
+
+
+_EOL_RE = re.compile(br'\r\n|\r|\n')
+
+
+class DataWriter:
+    """ Binary file writing the ``DATA`` of a SMTP transaction to a socket.
+
+    Line endings are normalized to CRLF and lines starting with a period are
+    escaped, as ``smtplib.SMTP.data`` does for a complete message.
+    """
+
+    def __init__(self, sock, bufsize=64 * 1024):
+        self.written = 0  # number of bytes sent
+        self._sock = sock
+        self._bufsize = bufsize
+        self._buffer = bytearray()
+        self._last = b'\n'  # the last byte written, before conversion
+
+    def write(self, data):
+        if not data:
+            return
+        last = data[-1:]
+        if self._last == b'\r' and data[:1] == b'\n':
+            # the CR of this CRLF was already written as a line ending
+            data = data[1:]
+        data = _EOL_RE.sub(b'\r\n', data)
+        if self._last in (b'\r', b'\n') and data[:1] == b'.':
+            data = b'.' + data
+        self._buffer += data.replace(b'\n.', b'\n..')
+        self._last = last
+        if len(self._buffer) >= self._bufsize:
+            self.flush()
+
+    def flush(self):
+        if self._buffer:
+            self._sock.sendall(self._buffer)
+            self.written += len(self._buffer)
+            self._buffer = bytearray()
+
+    def close(self):
+        """ Terminate the data with ``<CRLF>.<CRLF>`` and send it.
+        """
+        if self._last not in (b'\r', b'\n'):
+            self._buffer += b'\r\n'
+        self._buffer += b'.\r\n'
+        self.flush()
+
+
+def sendmail_message(connection, fromaddr, toaddrs, message):
+    """ Send the ``Message`` *message* like ``connection.sendmail`` would.
+
+    The message is serialized straight into the socket of *connection*,
+    without building the whole message as bytes in memory first. After a
+    failure the caller has to reset the session with ``RSET``.
+    """
+    connection.ehlo_or_helo_if_needed()
+    code, response = connection.mail(fromaddr)
+    if code != 250:
+        if code == 421:
+            connection.close()
+        raise smtplib.SMTPSenderRefused(code, response, fromaddr)
+    if isinstance(toaddrs, str):
+        toaddrs = [toaddrs]
+    refused = {}
+    for toaddr in toaddrs:
+        code, response = connection.rcpt(toaddr)
+        if code not in (250, 251):
+            refused[toaddr] = (code, response)
+        if code == 421:
+            connection.close()
+            raise smtplib.SMTPRecipientsRefused(refused)
+    if len(refused) == len(toaddrs):
+        raise smtplib.SMTPRecipientsRefused(refused)
+    connection.putcmd('data')
+    code, response = connection.getreply()
+    if code != 354:
+        raise smtplib.SMTPDataError(code, response)
+    writer = DataWriter(connection.sock)
+    flatten(message, writer)
+    writer.close()
+    metrics.inc('mailhost_smtp_sent_bytes_total', writer.written)
+    code, response = connection.getreply()
+    if code != 250:
+        if code == 421:
+            connection.close()
+        raise smtplib.SMTPDataError(code, response)
+    return refused
+
+
+class PooledSMTPMailer(SMTPMailer):
+    """ SMTPMailer which borrows its sessions from a SMTPConnectionPool.
+
+    Connections are opened, secured and authenticated once and then reused
+    for as long as the pool keeps them, instead of paying for a TCP connect,
+    ``EHLO``, TLS handshake and ``AUTH`` on every message.
+    """
+
+    def __init__(self, pool, **kw):
+        super().__init__(**kw)
+        self.pool = pool
+
+    def _connect(self):
+        """ Open a new connection, ready for sending mail.
+        """
+        kwargs = {} if self.timeout is None else {'timeout': self.timeout}
+        start = time.perf_counter()
+        connection = self.smtp(self.hostname, str(self.port), **kwargs)
+        try:
+            code, response = connection.ehlo()
+            if code < 200 or code >= 300:
+                code, response = connection.helo()
+                if code < 200 or code >= 300:
+                    raise RuntimeError('Error sending HELO to the SMTP server '
+                                       '(code=%s, response=%s)'
+                                       % (code, response))
+
+            # encryption support
+            if not self.implicit_tls:
+                have_tls = connection.has_extn('starttls')
+                if not have_tls and self.force_tls:
+                    raise RuntimeError(
+                        'TLS is not available but TLS is required')
+                if have_tls and not self.no_tls:
+                    connection.starttls()
+                    connection.ehlo()
+            metrics.observe('mailhost_smtp_connect_seconds',
+                            time.perf_counter() - start)
+
+            if connection.does_esmtp:
+                if self.username is not None and self.password is not None:
+                    with metrics.timed('mailhost_smtp_auth_seconds'):
+                        connection.login(self.username, self.password)
+            elif self.username:
+                raise RuntimeError('Mailhost does not support ESMTP but a '
+                                   'username is configured')
+        except BaseException:
+            connection.close()
+            raise
+        return connection
+
+    def vote(self, fromaddr, toaddrs, message):
+        if self.connection is None:
+            self.connection = self.pool.acquire(self._connect)
+
+    def abort(self):
+        connection = self.connection
+        if connection is not None:
+            self.connection = None
+            self.pool.release(connection, reset=True)
+
+    def send(self, fromaddr, toaddrs, message):
+        self.send_many([(fromaddr, toaddrs, message)])
+
+    def send_many(self, envelopes):
+        """ Send ``(fromaddr, toaddrs, message)`` triples over one session.
+        """
+        limiter = self.pool.limiter
+        for fromaddr, toaddrs, message in envelopes:
+            self.vote(fromaddr, toaddrs, message)
+            if limiter is not None:
+                limiter.throttle()
+            start = time.perf_counter()
+            try:
+                if isinstance(message, (Message, PrefixedMessage)):
+                    sendmail_message(self.connection, fromaddr, toaddrs,
+                                     message)
+                else:
+                    self.connection.sendmail(fromaddr, toaddrs, message)
+                    metrics.inc('mailhost_smtp_sent_bytes_total',
+                                len(message))
+            except smtplib.SMTPServerDisconnected:
+                metrics.inc('mailhost_smtp_failed_total')
+                connection, self.connection = self.connection, None
+                self.pool.discard(connection)
+                raise
+            except BaseException:
+                metrics.inc('mailhost_smtp_failed_total')
+                self.abort()
+                raise
+            metrics.observe('mailhost_smtp_data_seconds',
+                            time.perf_counter() - start)
+            metrics.inc('mailhost_smtp_sent_total')
+        connection, self.connection = self.connection, None
+        if connection is not None:
+            self.pool.release(connection)
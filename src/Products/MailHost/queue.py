@@ -0,0 +1,694 @@
+##############################################################################
+#
+# Copyright (c) 2026 Zope Foundation and Contributors.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+"""Processing of the mail queue by several worker threads.
+"""
+
+import json
+import logging
+import os
+import smtplib
+import time
+from collections import deque
+from email.utils import parseaddr
+from itertools import zip_longest
+from threading import Event
+from threading import Lock
+from threading import Thread
+from zlib import crc32
+
+from zope.sendmail.maildir import Maildir
+from zope.sendmail.queue import QueueProcessorThread
+
+from Products.MailHost import metrics
+
+
+# Seconds for which queue statistics are served from the cache
+STATISTICS_MAX_AGE = 2.0
+
+# Delivery attempts after which a message is moved to the ``dead`` folder
+MAX_ATTEMPTS = 20
+
+# Seconds before the first retry of a message, doubled after each attempt
+RETRY_DELAY = 60.0
+RETRY_MAX_DELAY = 4 * 3600.0
+
+# Priorities of queued mail, highest first. Messages of normal priority are
+# queued into the queue directory itself, the others into lanes inside it.
+PRIORITIES = ('high', 'normal', 'low')
+
+# Messages taken from each lane in turn when the lanes are weighted
+LANE_WEIGHTS = (8, 4, 1)
+
+# Seconds to wait for the threads of a stopped queue processor to finish
+STOP_TIMEOUT = 10.0
+
+# Messages a StorageWorkerThread claims at once
+CLAIM_SIZE = 100
+
+_statistics = {}  # maps queue path -> (time of count, statistics)
+
+
+class QueueWorkerThread(QueueProcessorThread):
+    """ Queue processor thread handling one partition of a mail queue.
+
+    Messages are assigned to workers by a hash of their file name, so the
+    workers of a group do not compete for the same messages. Each message is
+    still claimed with the hard link protocol of ``zope.sendmail`` before it
+    is sent, which keeps workers of other processes from sending it twice.
+
+    The lanes of the queue are drained in the order of their priority. With
+    *weighted* lanes, the lower lanes get a share of the deliveries given by
+    ``LANE_WEIGHTS`` even while the higher lanes are busy.
+    """
+
+    lanes = ()
+
+    def __init__(self, index=0, count=1, interval=3.0,
+                 max_attempts=MAX_ATTEMPTS, weighted=False):
+        super().__init__(interval)
+        self.index = index
+        self.count = count
+        self.max_attempts = max_attempts
+        self.weighted = weighted
+        self.name = 'Products.MailHost.QueueWorkerThread-%d' % index
+        self._attempted = None
+        self._failed = set()
+        self._seen = set()
+        self._destinations = {}  # maps lane path -> {filename: destination}
+        self._pending = []
+        self._credits = []
+        self._wakeup = Event()
+
+    def setMaildir(self, maildir):
+        super().setMaildir(maildir)
+        self.lanes = [maildir]
+
+    def setQueuePath(self, path):
+        super().setQueuePath(path)
+        self.lanes = [self.maildir if priority == 'normal' else
+                      Maildir(lane_directory(path, priority), True)
+                      for priority in PRIORITIES]
+
+    def _owns(self, filename):
+        if self.count <= 1:
+            return True
+        name = os.path.basename(filename).encode('utf-8', 'surrogateescape')
+        return crc32(name) % self.count == self.index
+
+    def _parseMessage(self, message):
+        fromaddr, toaddrs, message = super()._parseMessage(message)
+        # Only called once the message is claimed for sending
+        self._attempted = toaddrs
+        return fromaddr, toaddrs, message
+
+    def _destination(self, filename):
+        """ Return the recipient domains of the message in *filename*. """
+        try:
+            with open(filename, 'rb') as f:
+                envelope = f.readline() + f.readline()
+        except OSError:
+            return ''
+        return _destination(super()._parseMessage(envelope)[1])
+
+    def _schedule(self, maildir):
+        """ Return the ``(destination, filename)`` of the messages due.
+
+        Messages waiting for a retry or seen in this run are left out. The
+        others are grouped by their recipient domains and the groups take
+        turns, oldest message first, so a destination with many messages
+        cannot hold up others. The destinations are kept from one run to
+        the next, so each message is only read for it once.
+        """
+        now = time.time()
+        groups = {}
+        known = self._destinations.get(maildir.path, {})
+        destinations = {}  # of the messages still queued
+        for filename in maildir:
+            if not self._owns(filename):
+                continue
+            destination = known.get(filename)
+            if destination is not None:
+                destinations[filename] = destination
+            if filename in self._seen:
+                continue
+            state = _read_retry_state(filename)
+            if state.get('next', 0) > now:
+                continue
+            if destination is None:
+                destination = state.get('destination')
+                if destination is None:
+                    destination = self._destination(filename)
+                if destination:
+                    destinations[filename] = destination
+            groups.setdefault(destination, []).append(
+                (destination, filename))
+        self._destinations[maildir.path] = destinations
+        return _interleave(groups)
+
+    def _defer(self, filename, toaddrs):
+        """ Schedule the next attempt to send *filename* or give up on it.
+        """
+        head, tail = os.path.split(filename)
+        destination = _destination(toaddrs)
+        self._failed.add(destination)
+        state = _read_retry_state(filename)
+        attempts = state.get('attempts', 0) + 1
+        state = {'attempts': attempts, 'destination': destination,
+                 'next': time.time() + retry_delay(attempts)}
+        if self.max_attempts and attempts >= self.max_attempts:
+            dead = os.path.join(self.maildir.path, 'dead')
+            os.makedirs(dead, exist_ok=True)
+            os.rename(filename, os.path.join(dead, tail))
+            _write_retry_state(os.path.join(dead, tail), state)
+            self._unlink_if_exists(_retry_filename(filename))
+            self.log.error('Giving up on mail to %s (%s) after %d attempts',
+                           ', '.join(toaddrs), filename, attempts)
+        else:
+            _write_retry_state(filename, state)
+            metrics.inc('mailhost_queue_retries_total')
+        # Our claim on the message would block retries for hours
+        self._unlink_if_exists(os.path.join(head, '.sending-' + tail))
+
+    def _process_one_file(self, filename):
+        self._attempted = None
+        with metrics.timed('mailhost_queue_process_seconds'):
+            super()._process_one_file(filename)
+        metrics.inc('mailhost_queue_processed_total')
+        if self._attempted is None:
+            # Claimed by another worker or process
+            return
+        if os.path.exists(filename):
+            # Neither sent nor rejected
+            try:
+                self._defer(filename, self._attempted)
+            except OSError:
+                self.log.exception('Failed to defer %s', filename)
+        else:
+            self._unlink_if_exists(_retry_filename(filename))
+
+    def _next(self):
+        """ Return the next ``(destination, filename)`` to process or None.
+
+        A lane is listed again when it ran out of messages, so mail queued
+        into a higher lane meanwhile is sent next. A lane with no credits
+        left gives way to the lower lanes until all lanes used theirs.
+        """
+        for cycle in range(2):
+            for index, maildir in enumerate(self.lanes):
+                if not self._credits[index]:
+                    continue
+                pending = self._pending[index]
+                if not pending:
+                    pending.extend(self._schedule(maildir))
+                if pending:
+                    self._credits[index] -= 1
+                    item = pending.popleft()
+                    self._seen.add(item[1])
+                    return item
+            self._credits = self._weights()
+        return None
+
+    def _weights(self):
+        if self.weighted and len(self.lanes) == len(LANE_WEIGHTS):
+            return list(LANE_WEIGHTS)
+        return [float('inf')] * len(self.lanes)
+
+    def run(self, forever=True):
+        while not self._stopped:
+            self._failed.clear()
+            self._seen.clear()
+            self._pending = [deque() for lane in self.lanes]
+            self._credits = self._weights()
+            for destination, filename in iter(self._next, None):
+                # if we are asked to stop while sending messages, do so
+                if self._stopped:
+                    break
+                # a destination failing once is not tried again this round
+                if destination not in self._failed:
+                    self._process_one_file(filename)
+            else:
+                if forever:
+                    # Returns early when the thread is stopped
+                    self._wakeup.wait(self.interval)
+
+            # A testing plug
+            if not forever:
+                break
+
+    def halt(self):
+        """ Take no further messages, without waiting for the current one.
+        """
+        self._stopped = True
+        self._wakeup.set()
+
+    def stop(self):
+        self.halt()
+        # Wait for the message being sent, if any
+        super().stop()
+
+
+class QueueProcessorGroup:
+    """ A group of QueueWorkerThreads draining the same mail queue.
+
+    The group behaves like a single ``QueueProcessorThread`` towards the
+    MailHost, which keeps it in ``queue_threads``. Its ``queue`` is the
+    queue storage drained, if known.
+    """
+
+    def __init__(self, workers, queue=None):
+        self.workers = list(workers)
+        self.queue = queue
+
+    def start(self):
+        for worker in self.workers:
+            worker.start()
+
+    def halt(self):
+        for worker in self.workers:
+            worker.halt()
+
+    def stop(self):
+        # All workers finish their current message at the same time
+        self.halt()
+        for worker in self.workers:
+            worker.stop()
+
+    def is_alive(self):
+        return any(worker.is_alive() for worker in self.workers)
+
+    def join(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for worker in self.workers:
+            if deadline is not None:
+                timeout = max(deadline - time.monotonic(), 0)
+            worker.join(timeout)
+
+
+class ProcessorRegistry:
+    """ The running queue processors by key, usually their queue directory.
+
+    Processors are looked up without locking. Starting and stopping them
+    takes a lock for their key only, so a processor shutting down does not
+    hold up those of other queues, and concurrent starts for the same key
+    end up with a single processor.
+    """
+
+    closed = False  # set by ``shutdown``, no processors are started then
+
+    def __init__(self):
+        self._processors = {}
+        self._locks = {}
+        self._lock = Lock()  # guards _locks
+
+    def __contains__(self, key):
+        return key in self._processors
+
+    def get(self, key, default=None):
+        return self._processors.get(key, default)
+
+    def keys(self):
+        return list(self._processors)
+
+    def _getLock(self, key):
+        with self._lock:
+            return self._locks.setdefault(key, Lock())
+
+    def start(self, key, factory):
+        """ Start a processor made by *factory* unless one is running.
+
+        Returns True if a processor was started.
+        """
+        processor = self._processors.get(key)
+        if processor is not None and processor.is_alive():
+            return False
+        with self._getLock(key):
+            processor = self._processors.get(key)
+            if self.closed or (processor is not None
+                               and processor.is_alive()):
+                return False
+            processor = factory()
+            processor.start()
+            self._processors[key] = processor
+            return True
+
+    def stop(self, key, timeout=STOP_TIMEOUT):
+        """ Stop the processor for *key* and wait for it to finish.
+
+        Returns False if it is still running after *timeout* seconds. The
+        processor is not waited for any longer, e.g. for a message taking
+        long to send.
+        """
+        with self._getLock(key):
+            processor = self._processors.pop(key, None)
+            if processor is None:
+                return True
+            processor.halt()
+            processor.join(timeout)
+            return not processor.is_alive()
+
+    def shutdown(self, timeout=STOP_TIMEOUT):
+        """ Stop all processors within *timeout* seconds for good.
+
+        All processors are told to stop at once, so each has the whole
+        *timeout* to finish the messages being sent. Returns the keys of
+        the processors still running after that.
+        """
+        self.closed = True
+        deadline = time.monotonic() + timeout
+        processors = []
+        for key in self.keys():
+            processor = self._processors.pop(key, None)
+            if processor is not None:
+                processor.halt()
+                processors.append((key, processor))
+        running = []
+        for key, processor in processors:
+            processor.join(max(deadline - time.monotonic(), 0))
+            if processor.is_alive():
+                running.append(key)
+        return running
+
+
+class StorageWorkerThread(Thread):
+    """ Queue processor thread sending the mail of a queue storage.
+
+    The storage hands out claims on the messages due for sending in
+    batches, so the workers of a queue do not compete for the same
+    messages, see ``SegmentQueue`` for the methods it needs. The first
+    worker also lets the storage clean up when there is nothing to send.
+
+    Errors of the storage, like a locked database or a full disk, are
+    logged and the worker tries again after its interval. Mail which was
+    sent but could not be recorded as such is not sent again, recording it
+    is retried instead.
+    """
+
+    log = logging.getLogger('MailHost')
+
+    def __init__(self, queue, mailer, index=0, interval=3.0,
+                 max_attempts=MAX_ATTEMPTS, weighted=False):
+        super().__init__(name='Products.MailHost.StorageWorkerThread-%d'
+                              % index, daemon=True)
+        self.queue = queue
+        self.mailer = mailer
+        self.index = index
+        self.interval = interval
+        self.max_attempts = max_attempts
+        self.weighted = weighted
+        self._stopped = False
+        self._failed = set()
+        self._unrecorded = []  # (entry, state) to record with ``finish``
+        self._lock = Lock()
+        self._wakeup = Event()
+
+    def run(self, forever=True):
+        while not self._stopped:
+            try:
+                idle = self._run_once()
+            except Exception:
+                self.log.exception('Error while processing the mail queue '
+                                   '%s', self.queue.path)
+                idle = True
+            if idle:
+                if not forever:
+                    break
+                # Returns early when the thread is stopped
+                self._wakeup.wait(self.interval)
+
+    def _run_once(self):
+        """ Send a batch of messages, return True if there were none.
+        """
+        self._record_pending()
+        entries = self.queue.claim(CLAIM_SIZE, skip=self._failed,
+                                   weighted=self.weighted)
+        done = 0
+        try:
+            for entry in entries:
+                # if we are asked to stop while sending messages, do so
+                if self._stopped:
+                    break
+                if entry.destination in self._failed:
+                    # a destination failing once is not tried again
+                    self.queue.release([entry])
+                else:
+                    self._process(entry)
+                done += 1
+        finally:
+            # Other workers may send what is left over
+            if done < len(entries):
+                self.queue.release(entries[done:])
+        if entries:
+            return False
+        self._failed.clear()
+        if self.index == 0:
+            try:
+                self.queue.maintain()
+            except Exception:
+                self.log.exception('Failed to clean up %s', self.queue.path)
+        return True
+
+    def _process(self, entry):
+        with metrics.timed('mailhost_queue_process_seconds'):
+            try:
+                self._send(entry)
+            except Exception:
+                self.log.exception(
+                    'Error while sending mail from %s to %s (%s).',
+                    entry.fromaddr, ', '.join(entry.toaddrs), entry.id)
+                try:
+                    self._defer(entry)
+                except Exception:
+                    self.queue.release([entry])
+                    self.log.exception('Failed to defer %s', entry.id)
+        metrics.inc('mailhost_queue_processed_total')
+
+    def _send(self, entry):
+        message = self.queue.read(entry)
+        # Sending and recording it are done together, see ``stop``
+        with self._lock:
+            try:
+                self.mailer.send(entry.fromaddr, entry.toaddrs, message)
+            except smtplib.SMTPResponseException as e:
+                if not 500 <= e.smtp_code <= 599:
+                    raise
+                # permanent error, ditch the message
+                self.log.error(
+                    'Discarding email from %s to %s (%s) due to a '
+                    'permanent error: %s', entry.fromaddr,
+                    ', '.join(entry.toaddrs), entry.id, str(e))
+                self._record(entry, 'failed')
+            except smtplib.SMTPRecipientsRefused as e:
+                self.log.error('Email recipients refused for %s: %s',
+                               entry.id, ', '.join(e.recipients))
+                self._record(entry, 'failed')
+            else:
+                self.log.info('Mail from %s to %s sent.', entry.fromaddr,
+                              ', '.join(entry.toaddrs))
+                self._record(entry, 'sent')
+
+    def _record(self, entry, state):
+        """ Record the final *state* of *entry*, now or later.
+
+        The message was handed to the mailer already, so an error here
+        must not lead to deferring and sending it once more.
+        """
+        try:
+            self.queue.finish(entry, state)
+        except Exception:
+            self.log.exception('Failed to record %s as %s, trying again '
+                               'later', entry.id, state)
+            self._unrecorded.append((entry, state))
+
+    def _record_pending(self):
+        """ Try again to record the entries ``_record`` failed for.
+        """
+        unrecorded, self._unrecorded = self._unrecorded, []
+        for entry, state in unrecorded:
+            self._record(entry, state)
+
+    def _defer(self, entry):
+        """ Schedule the next attempt to send *entry* or give up on it.
+        """
+        self._failed.add(entry.destination)
+        attempts = entry.attempts + 1
+        if self.max_attempts and attempts >= self.max_attempts:
+            self.queue.finish(entry, 'dead', attempts=attempts)
+            self.log.error('Giving up on mail to %s (%s) after %d attempts',
+                           ', '.join(entry.toaddrs), entry.id, attempts)
+        else:
+            self.queue.finish(entry, 'deferred', attempts=attempts,
+                              next=time.time() + retry_delay(attempts))
+            metrics.inc('mailhost_queue_retries_total')
+
+    def halt(self):
+        """ Take no further messages, without waiting for the current one.
+        """
+        self._stopped = True
+        self._wakeup.set()
+
+    def stop(self):
+        self.halt()
+        # Wait for the message being sent, if any
+        with self._lock:
+            pass
+
+
+def make_queue_processor(mailer_factory, queue_path, count=1,
+                         max_attempts=MAX_ATTEMPTS, weighted=False):
+    """ Create a QueueProcessorGroup with *count* workers.
+
+    Every worker gets its own mailer from *mailer_factory* and with it its
+    own SMTP session. Messages which could not be sent *max_attempts* times
+    are moved to the ``dead`` folder of the queue, 0 retries them forever.
+    With *weighted*, the lanes of lower priority get a share of the
+    deliveries while there is mail of higher priority.
+    """
+    workers = []
+    for index in range(max(int(count), 1)):
+        worker = QueueWorkerThread(index, count, max_attempts=max_attempts,
+                                   weighted=weighted)
+        worker.setMailer(mailer_factory())
+        worker.setQueuePath(queue_path)
+        workers.append(worker)
+    return QueueProcessorGroup(workers)
+
+
+def lane_directory(path, priority=None):
+    """ Return the directory of the lane for *priority* of the queue *path*.
+
+    Raises ``ValueError`` for priorities not in ``PRIORITIES``.
+    """
+    if check_priority(priority) in (None, 'normal'):
+        return path
+    return os.path.join(path, 'lane-' + priority)
+
+
+def check_priority(priority):
+    """ Return *priority*, raise ``ValueError`` if it is not known. """
+    if priority is not None and priority not in PRIORITIES:
+        raise ValueError('Unknown priority %r, use one of %s'
+                         % (priority, ', '.join(PRIORITIES)))
+    return priority
+
+
+def retry_delay(attempts):
+    """ Return the seconds to wait after the failed attempt *attempts*. """
+    return min(RETRY_DELAY * 2 ** (attempts - 1), RETRY_MAX_DELAY)
+
+
+def _interleave(groups):
+    """ Return the items of the lists in the mapping *groups* taking turns.
+    """
+    return [item for turn in zip_longest(*groups.values())
+            for item in turn if item is not None]
+
+
+def _weighted(lanes):
+    """ Merge the lists *lanes* taking ``LANE_WEIGHTS`` items from each. """
+    lanes = [deque(lane) for lane in lanes]
+    entries = []
+    while any(lanes):
+        for lane, weight in zip(lanes, LANE_WEIGHTS):
+            for i in range(min(weight, len(lane))):
+                entries.append(lane.popleft())
+    return entries
+
+
+def _destination(toaddrs):
+    domains = {parseaddr(address)[1].rpartition('@')[2].lower()
+               for address in toaddrs}
+    return ','.join(sorted(domains))
+
+
+def _retry_filename(filename):
+    head, tail = os.path.split(filename)
+    return os.path.join(head, '.retry-' + tail)
+
+
+def _read_retry_state(filename):
+    """ Return the delivery attempts recorded for the message *filename*.
+    """
+    try:
+        with open(_retry_filename(filename)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_retry_state(filename, state):
+    head, tail = os.path.split(filename)
+    temporary = os.path.join(head, '.tmp-retry-' + tail)
+    with open(temporary, 'w') as f:
+        json.dump(state, f)
+    os.replace(temporary, _retry_filename(filename))
+
+
+def _count_maildir(path):
+    counts = {'new': 0, 'sending': 0, 'deferred': 0, 'failed': 0,
+              'dead': 0}
+    subdirs = [os.path.join(path, 'new'), os.path.join(path, 'cur')]
+    for priority in PRIORITIES:
+        lane = lane_directory(path, priority)
+        if lane != path and os.path.isdir(lane):
+            subdirs += [os.path.join(lane, 'new'), os.path.join(lane, 'cur')]
+    for subdir in subdirs:
+        messages = 0
+        sending = set()  # names of the messages being sent
+        retried = set()  # names of the messages with a retry state
+        with os.scandir(subdir) as entries:
+            for entry in entries:
+                name = entry.name
+                if not name.startswith('.'):
+                    messages += 1
+                elif name.startswith('.sending-'):
+                    sending.add(name[len('.sending-'):])
+                elif name.startswith('.rejected-'):
+                    counts['failed'] += 1
+                elif name.startswith('.retry-'):
+                    retried.add(name[len('.retry-'):])
+        # Messages being sent or retried are still in the queue under their
+        # name, those being retried have both entries while they are sent
+        counts['sending'] += len(sending)
+        counts['deferred'] += len(retried - sending)
+        counts['new'] += max(messages - len(sending | retried), 0)
+    try:
+        with os.scandir(os.path.join(path, 'dead')) as entries:
+            counts['dead'] = sum(1 for entry in entries
+                                 if not entry.name.startswith('.'))
+    except FileNotFoundError:
+        pass
+    return counts
+
+
+def queue_statistics(path, max_age=STATISTICS_MAX_AGE):
+    """ Return the number of messages in the maildir queue at *path*.
+
+    The result maps ``new`` to the number of messages waiting for delivery,
+    ``sending`` to those currently being delivered, ``deferred`` to those
+    waiting for another attempt, ``failed`` to the ones rejected by the SMTP
+    server and ``dead`` to those given up after too many attempts. Directory
+    entries are counted without building lists of names and the counts are
+    cached for *max_age* seconds, so large queues can be watched cheaply.
+
+    Raises ``ValueError`` if *path* is not a maildir.
+    """
+    now = time.time()
+    cached = _statistics.get(path)
+    if cached is not None and now - cached[0] <= max_age:
+        return dict(cached[1])
+    try:
+        counts = _count_maildir(path)
+    except (FileNotFoundError, NotADirectoryError):
+        raise ValueError('%s is not a Maildir folder' % path)
+    _statistics[path] = (now, counts)
+    return dict(counts)
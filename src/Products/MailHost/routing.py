@@ -0,0 +1,131 @@
+##############################################################################
+#
+# Copyright (c) 2026 Zope Foundation and Contributors.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+"""Routing of recipient domains to other SMTP relays.
+
+A MailHost's ``smtp_routes`` are lines like::
+
+    internal  example.com,*.example.com  relay.example.com:25
+    bulk      *  bulk.example.net:587 uid=mailer pwd=secret force_tls
+
+with the name of the route, comma separated patterns of recipient domains,
+the SMTP host and port, and optionally the user name, password and TLS
+mode for the relay. Recipients go by the first route with a pattern
+matching their domain, or by the settings of the MailHost itself.
+"""
+
+import re
+from email.utils import parseaddr
+from fnmatch import fnmatchcase
+
+from Products.MailHost.cache import LRUCache
+
+
+_name_re = re.compile(r'^[A-Za-z0-9_-]+$')
+
+_routes = LRUCache(64)  # maps smtp_routes -> parsed routes
+
+
+class Route(tuple):
+    """ A route of recipient domains to an SMTP relay.
+
+    Its last six items are those of a pool key, see ``_getPoolKey``.
+    """
+
+    def __new__(cls, name, patterns, host, port=25, uid=None, pwd=None,
+                force_tls=False, implicit_tls=False):
+        return tuple.__new__(cls, (name, tuple(patterns), host, int(port),
+                                   uid, pwd, bool(force_tls),
+                                   bool(implicit_tls)))
+
+    name = property(lambda self: self[0])
+    patterns = property(lambda self: self[1])
+
+    def settings(self):
+        """ Return host, port, user, password, force_tls, implicit_tls. """
+        return self[2:]
+
+    def matches(self, domain):
+        return any(fnmatchcase(domain, pattern) for pattern in self[1])
+
+
+def parse_route(line):
+    """ Return the Route described by the text *line*.
+
+    Raises ``ValueError`` for lines not in the form described above.
+    """
+    words = line.split()
+    if len(words) < 3 or not _name_re.match(words[0]):
+        raise ValueError('Invalid route %r, expected a name, domain '
+                         'patterns and an SMTP host' % line)
+    name, patterns, host = words[:3]
+    port = 25
+    if ':' in host:
+        host, port = host.rsplit(':', 1)
+        if not port.isdigit():
+            raise ValueError('Invalid port in route %r' % line)
+    options = {}
+    for word in words[3:]:
+        key, sep, value = word.partition('=')
+        if key in ('uid', 'pwd') and sep:
+            options[key] = value or None
+        elif key in ('force_tls', 'implicit_tls') and not sep:
+            options[key] = True
+        else:
+            raise ValueError('Invalid option %r in route %r' % (word, line))
+    patterns = [pattern.lower() for pattern in patterns.split(',')
+                if pattern]
+    return Route(name, patterns, host, port, **options)
+
+
+def parse_routes(lines):
+    """ Return the routes of the text *lines*, ignoring empty lines. """
+    lines = tuple(lines)
+    routes = _routes.get(lines)
+    if routes is None:
+        routes = tuple(parse_route(line) for line in lines if line.strip())
+        names = [route.name for route in routes]
+        if len(set(names)) != len(names):
+            raise ValueError('Route names must be unique')
+        _routes.set(lines, routes)
+    return routes
+
+
+def find_route(routes, address):
+    """ Return the first of *routes* for the recipient *address* or None.
+    """
+    domain = parseaddr(address)[1].rpartition('@')[2].lower()
+    for route in routes:
+        if route.matches(domain):
+            return route
+    return None
+
+
+def route_envelopes(routes, envelopes):
+    """ Split ``(mfrom, mto, message)`` *envelopes* by route.
+
+    Returns a list of ``(route, envelopes)`` pairs in the order in which
+    the routes are first needed, with None for the MailHost's own relay.
+    Recipients of an envelope going different routes get an envelope for
+    each route, with the same message.
+    """
+    routed = {}
+    for mfrom, mto, message in envelopes:
+        if isinstance(mto, str):
+            mto = [mto]
+        recipients = {}
+        for address in mto:
+            route = find_route(routes, address)
+            recipients.setdefault(route, []).append(address)
+        for route, addresses in recipients.items():
+            routed.setdefault(route, []).append((mfrom, addresses, message))
+    return list(routed.items())
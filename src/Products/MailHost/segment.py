@@ -0,0 +1,554 @@
+##############################################################################
+#
+# Copyright (c) 2026 Zope Foundation and Contributors.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+"""Mail queue in segment files with an index of the envelopes.
+
+The messages of a segment queue are appended to segment files of about
+``SEGMENT_SIZE`` bytes. Their envelopes, priorities and delivery states
+are appended to the ``index`` file next to them, one JSON object per line,
+so the queue processor finds, counts, orders and routes the messages
+without opening them. Segment files without unsent messages are removed
+and the index is rewritten once most of its lines are out of date.
+Messages which failed for good are moved out of their segment file into
+the ``dead`` folder, so they do not keep it forever. The first line of the
+index holds its generation, which every rewrite counts up, so readers in
+other processes notice that their offsets are out of date.
+
+A message is claimed for sending by creating a file named after it in the
+``claims`` folder, which fails if another process claimed it already, as
+the ``.sending-`` files of ``zope.sendmail`` do for a maildir queue. Claims
+older than ``MAX_SEND_TIME`` are taken to be left over by a process which
+died, and taken over by the one process which manages to rename the claim
+file. Any process may queue messages, writes are serialized with a lock
+file where ``fcntl`` is available.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from email.message import Message
+
+from zope.interface import implementer
+from zope.sendmail.queue import MAX_SEND_TIME
+
+from Products.MailHost import metrics
+from Products.MailHost.delivery import BatchDataManager
+from Products.MailHost.delivery import StorageMailDelivery
+from Products.MailHost.generator import PrefixedMessage
+from Products.MailHost.generator import flatten
+from Products.MailHost.interfaces import IQueueStorage
+from Products.MailHost.queue import CLAIM_SIZE
+from Products.MailHost.queue import MAX_ATTEMPTS
+from Products.MailHost.queue import PRIORITIES
+from Products.MailHost.queue import STATISTICS_MAX_AGE
+from Products.MailHost.queue import QueueProcessorGroup
+from Products.MailHost.queue import StorageWorkerThread
+from Products.MailHost.queue import _destination
+from Products.MailHost.queue import _interleave
+from Products.MailHost.queue import _weighted
+from Products.MailHost.queue import check_priority
+
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+LOG = logging.getLogger('MailHost')
+
+# Size in bytes after which messages go into a new segment file
+SEGMENT_SIZE = 16 * 1024 * 1024
+
+# Seconds a segment file is kept after it was last written to, so messages
+# of transactions still finishing are not lost
+SEGMENT_GRACE = 300.0
+
+# Index lines about sent messages and old states tolerated before the
+# index is rewritten, unless there are more lines about unsent messages
+COMPACT_LINES = 1000
+
+
+class Entry:
+    """ A message in a segment queue, as recorded in the index.
+    """
+
+    __slots__ = ('id', 'segment', 'offset', 'length', 'fromaddr', 'toaddrs',
+                 'priority', 'queued', 'state', 'attempts', 'next',
+                 'destination', 'file')
+
+    def __init__(self, record):
+        self.id = record['id']
+        self.segment = record['segment']
+        self.offset = record['offset']
+        self.length = record['length']
+        self.fromaddr = record['from']
+        self.toaddrs = record['to']
+        self.priority = record.get('priority', 'normal')
+        self.queued = record.get('queued', 0)
+        self.state = record.get('state', 'new')
+        self.attempts = record.get('attempts', 0)
+        self.next = record.get('next', 0)
+        self.destination = _destination(self.toaddrs)
+        self.file = record.get('file')  # set once moved out of the segment
+
+    def record(self):
+        """ Return the index record of the message in its current state.
+        """
+        record = {'id': self.id, 'segment': self.segment,
+                  'offset': self.offset, 'length': self.length,
+                  'from': self.fromaddr, 'to': self.toaddrs,
+                  'priority': self.priority, 'queued': self.queued}
+        if self.state != 'new':
+            record.update(state=self.state, attempts=self.attempts,
+                          next=self.next)
+        if self.file is not None:
+            record['file'] = self.file
+        return record
+
+
+@implementer(IQueueStorage)
+class SegmentQueue:
+    """ Mail queue in segment files with an index, see the module.
+    """
+
+    backend = 'segment'
+
+    def __init__(self, path):
+        self.path = path
+        self.index_path = os.path.join(path, 'index')
+        self.claims_path = os.path.join(path, 'claims')
+        self._entries = {}  # maps id -> Entry of the messages not yet sent
+        self._claimed = set()  # ids of the messages we are sending
+        self._lines = 0  # lines of the index read
+        self._offset = 0  # bytes of the index read
+        self._generation = None  # of the index read
+        self._segment = None  # number of the segment written to
+        self._lock = threading.RLock()
+
+    def create(self):
+        if os.path.exists(self.index_path):
+            return
+        os.makedirs(self.path, exist_ok=True)
+        with self._lock, self._file_lock():
+            if not os.path.exists(self.index_path):
+                self._replace_index(1, [])
+
+    def delivery(self, priority=None):
+        return SegmentMailDelivery(self, check_priority(priority))
+
+    def processor(self, mailer_factory, count=1, max_attempts=MAX_ATTEMPTS,
+                  weighted=False):
+        workers = []
+        for index in range(max(int(count), 1)):
+            workers.append(StorageWorkerThread(
+                self, mailer_factory(), index, max_attempts=max_attempts,
+                weighted=weighted))
+        return QueueProcessorGroup(workers, self)
+
+    def statistics(self, max_age=STATISTICS_MAX_AGE):
+        """ Return the number of messages in the queue by state.
+
+        The counts are taken from the index, which is read up to its end
+        every time, so *max_age* is not needed.
+        """
+        counts = {'new': 0, 'sending': 0, 'deferred': 0, 'failed': 0,
+                  'dead': 0}
+        with self._lock:
+            self._refresh()
+            claimed = self._claims()
+            for entry in self._entries.values():
+                if entry.id in claimed:
+                    counts['sending'] += 1
+                else:
+                    counts[entry.state] += 1
+        return counts
+
+    @contextmanager
+    def _locked(self):
+        """ Keep other threads and processes from changing the queue. """
+        with self._lock:
+            self.create()
+            with self._file_lock():
+                yield
+
+    @contextmanager
+    def _file_lock(self):
+        """ Keep other processes from changing the queue. """
+        with open(os.path.join(self.path, 'lock'), 'ab') as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            yield  # closing the file releases the lock
+
+    def _refresh(self):
+        """ Read the lines appended to the index since the last call.
+        """
+        try:
+            f = open(self.index_path, 'rb')
+        except OSError:
+            raise ValueError('%s is not a mail queue' % self.path)
+        with f:
+            header = f.readline()
+            try:
+                generation = json.loads(header)['generation']
+            except (ValueError, TypeError, KeyError):
+                generation = 0  # no header yet
+            if generation != self._generation:
+                # The index was rewritten
+                self._entries.clear()
+                self._lines = self._offset = 0
+                self._generation = generation
+            if not self._offset and generation:
+                self._offset = len(header)
+            f.seek(self._offset)
+            data = f.read()
+        end = data.rfind(b'\n') + 1  # a line being written is read later
+        for line in data[:end].splitlines():
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # Left incomplete by a process which died while writing
+                LOG.warning('Skipping incomplete line in %s: %r',
+                            self.index_path, line[:100])
+                continue
+            self._apply(record)
+            self._lines += 1
+        self._offset += end
+
+    def _apply(self, record):
+        if 'segment' in record:
+            self._entries[record['id']] = Entry(record)
+            return
+        entry = self._entries.get(record['id'])
+        if entry is None:
+            return
+        if record['state'] == 'sent':
+            del self._entries[entry.id]
+        else:
+            entry.state = record['state']
+            entry.attempts = record.get('attempts', entry.attempts)
+            entry.next = record.get('next', 0)
+            entry.file = record.get('file', entry.file)
+
+    def _append(self, records):
+        """ Append *records* to the index and sync it to disk. """
+        with self._locked():
+            self._write_index(records)
+
+    def _write_index(self, records):
+        """ Append *records* to the index, while locked. """
+        data = b''.join(json.dumps(record).encode() + b'\n'
+                        for record in records)
+        with open(self.index_path, 'a+b') as f:
+            if f.seek(0, os.SEEK_END):
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b'\n':
+                    # Do not continue an incomplete line
+                    data = b'\n' + data
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        self._refresh()
+
+    def _claim_files(self):
+        """ Return the names of the files in the claims folder. """
+        try:
+            return os.listdir(self.claims_path)
+        except FileNotFoundError:
+            return []
+
+    def _claims(self):
+        """ Return the ids of the messages claimed by any process. """
+        return {name for name in self._claim_files() if '.' not in name}
+
+    def _claim(self, entry, now):
+        """ Claim *entry* for this process, return whether that worked. """
+        path = os.path.join(self.claims_path, entry.id)
+        try:
+            os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            return True
+        except FileExistsError:
+            pass
+        except FileNotFoundError:
+            os.makedirs(self.claims_path, exist_ok=True)
+            return self._claim(entry, now)
+        # Left over by a process which did not finish sending? Of all
+        # processes finding it stale only the one renaming it takes over.
+        stale = '%s.stale-%s' % (path, os.urandom(8).hex())
+        try:
+            stat = os.stat(path)
+            if stat.st_mtime > now - MAX_SEND_TIME:
+                return False
+            os.rename(path, stale)
+        except FileNotFoundError:
+            return False
+        renamed = os.stat(stale)
+        if (renamed.st_ino, renamed.st_mtime) != (stat.st_ino, stat.st_mtime):
+            # Another process took it over meanwhile, give its claim back
+            os.replace(stale, path)
+            return False
+        os.unlink(stale)
+        try:
+            os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+        except FileExistsError:
+            return False
+        return True
+
+    def _unclaim(self, entry):
+        try:
+            os.unlink(os.path.join(self.claims_path, entry.id))
+        except FileNotFoundError:
+            pass
+
+    def _segment_path(self, number):
+        return os.path.join(self.path, 'segment-%08d' % number)
+
+    def _segments(self):
+        """ Return the numbers of the segment files, oldest first. """
+        return sorted(int(name[8:]) for name in os.listdir(self.path)
+                      if name.startswith('segment-') and name[8:].isdigit())
+
+    def _current_segment(self):
+        """ Return the number of the segment to write to, while locked. """
+        number = self._segment
+        try:
+            if number is None:
+                raise FileNotFoundError
+            size = os.stat(self._segment_path(number)).st_size
+        except FileNotFoundError:
+            numbers = self._segments()
+            if not numbers:
+                number = 1
+                size = 0
+            else:
+                number = numbers[-1]
+                size = os.stat(self._segment_path(number)).st_size
+        if size >= SEGMENT_SIZE:
+            number = max(self._segments()) + 1
+        self._segment = number
+        return number
+
+    def write(self, messages, priority='normal'):
+        """ Append ``(fromaddr, toaddrs, message)`` *messages* to a segment.
+
+        The messages are synced to disk, but stay invisible to the queue
+        processor until the returned records are passed to ``index``.
+        """
+        records = []
+        with self._locked():
+            number = self._current_segment()
+            with open(self._segment_path(number), 'ab') as f:
+                for fromaddr, toaddrs, message in messages:
+                    with metrics.timed('mailhost_queue_write_seconds'):
+                        offset = f.tell()
+                        if isinstance(message, (Message, PrefixedMessage)):
+                            flatten(message, f)
+                        else:
+                            f.write(message)
+                        records.append({
+                            'id': os.urandom(8).hex(), 'segment': number,
+                            'offset': offset, 'length': f.tell() - offset,
+                            'from': fromaddr, 'to': list(toaddrs),
+                            'priority': priority, 'queued': time.time()})
+                    metrics.inc('mailhost_queue_written_total')
+                f.flush()
+                os.fsync(f.fileno())
+        return records
+
+    def index(self, records):
+        """ Hand the messages written with *records* to the processor. """
+        if records:
+            self._append(records)
+
+    def read(self, entry):
+        """ Return the bytes of the message of *entry*. """
+        if entry.file is not None:
+            with open(os.path.join(self.path, entry.file), 'rb') as f:
+                return f.read()
+        with open(self._segment_path(entry.segment), 'rb') as f:
+            f.seek(entry.offset)
+            return f.read(entry.length)
+
+    def claim(self, size=CLAIM_SIZE, skip=(), weighted=False):
+        """ Claim up to *size* messages due for sending, in sending order.
+
+        Messages for the destinations in *skip* are left alone. Messages
+        of higher priority come first, or most of the time if *weighted*,
+        and destinations take turns within a priority. Messages claimed by
+        another process are skipped.
+        """
+        now = time.time()
+        with self._lock:
+            self._refresh()
+            lanes = {priority: {} for priority in PRIORITIES}
+            for entry in sorted(self._entries.values(),
+                                key=lambda entry: entry.queued):
+                if (entry.state in ('new', 'deferred')
+                        and entry.next <= now
+                        and entry.id not in self._claimed
+                        and entry.destination not in skip):
+                    lanes[entry.priority].setdefault(
+                        entry.destination, []).append(entry)
+            lanes = [_interleave(groups) for groups in lanes.values()]
+            if weighted:
+                entries = _weighted(lanes)
+            else:
+                entries = [entry for lane in lanes for entry in lane]
+            claimed = []
+            for entry in entries:
+                if len(claimed) >= size:
+                    break
+                if self._claim(entry, now):
+                    claimed.append(entry)
+            self._claimed.update(entry.id for entry in claimed)
+        return claimed
+
+    def release(self, entries):
+        """ Give up the claim on *entries* without changing their state. """
+        with self._lock:
+            for entry in entries:
+                self._unclaim(entry)
+                self._claimed.discard(entry.id)
+
+    def finish(self, entry, state, **info):
+        """ Record the new *state* of a claimed *entry* and release it.
+
+        *state* is ``sent``, ``deferred``, ``failed`` or ``dead``, *info*
+        has the ``attempts`` made and the time of the ``next`` attempt.
+        """
+        record = {'id': entry.id, 'state': state}
+        record.update(info)
+        try:
+            self._append([record])
+        finally:
+            self.release([entry])
+
+    def maintain(self):
+        """ Remove segment files of sent mail, rewrite an outdated index.
+
+        Messages which failed for good are moved into the ``dead`` folder
+        first, and claims of messages no longer queued are removed.
+        """
+        with self._locked():
+            self._refresh()
+            numbers = self._segments()
+            self._move_dead(numbers[-1:])
+            used = {entry.segment for entry in self._entries.values()
+                    if entry.file is None}
+            now = time.time()
+            expired = now - SEGMENT_GRACE
+            for number in numbers[:-1]:
+                path = self._segment_path(number)
+                if number not in used and os.stat(path).st_mtime < expired:
+                    os.unlink(path)
+            for name in self._claim_files():
+                if name in self._entries:
+                    continue
+                path = os.path.join(self.claims_path, name)
+                try:
+                    if os.stat(path).st_mtime < now - MAX_SEND_TIME:
+                        os.unlink(path)
+                except FileNotFoundError:
+                    pass
+            if self._lines - len(self._entries) > max(COMPACT_LINES,
+                                                      len(self._entries)):
+                self._compact()
+
+    def _move_dead(self, keep):
+        """ Move failed and dead messages out of their segment, while locked.
+
+        The segments numbered in *keep* are still written to and left as
+        they are.
+        """
+        entries = [entry for entry in self._entries.values()
+                   if entry.state in ('failed', 'dead')
+                   and entry.file is None and entry.segment not in keep]
+        if not entries:
+            return
+        folder = os.path.join(self.path, 'dead')
+        os.makedirs(folder, exist_ok=True)
+        records = []
+        for entry in entries:
+            name = os.path.join('dead', entry.id)
+            temporary = os.path.join(self.path, name + '.tmp')
+            with open(temporary, 'wb') as f:
+                f.write(self.read(entry))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temporary, os.path.join(self.path, name))
+            records.append({'id': entry.id, 'state': entry.state,
+                            'attempts': entry.attempts, 'next': entry.next,
+                            'file': name})
+        self._write_index(records)
+
+    def _compact(self):
+        self._replace_index(self._generation + 1, [
+            entry.record() for entry in self._entries.values()])
+        self._refresh()
+
+    def _replace_index(self, generation, records):
+        """ Replace the index by one of *generation*, while locked. """
+        temporary = self.index_path + '.tmp'
+        with open(temporary, 'wb') as f:
+            for record in [{'generation': generation}] + records:
+                f.write(json.dumps(record).encode() + b'\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, self.index_path)
+
+
+class SegmentDataManager(BatchDataManager):
+    """ Write all messages queued in one transaction into a segment queue.
+
+    The messages are appended to a segment file and synced to disk while
+    the transaction votes. When it is finished, they are added to the
+    index, which is synced once for all of them. Messages written by an
+    aborted transaction are left in the segment file without an index
+    entry and removed with it.
+    """
+
+    def __init__(self, queue):
+        super().__init__()
+        self.queue = queue
+        self.written = []
+
+    def add(self, fromaddr, toaddrs, message, priority='normal'):
+        self.messages.append((fromaddr, toaddrs, message, priority))
+
+    def abort(self, txn):
+        del self.written[:]
+        super().abort(txn)
+
+    def tpc_vote(self, txn):
+        by_priority = {}
+        for fromaddr, toaddrs, message, priority in self.messages:
+            by_priority.setdefault(priority, []).append(
+                (fromaddr, toaddrs, message))
+        for priority, messages in by_priority.items():
+            self.written.extend(self.queue.write(messages, priority))
+
+    def tpc_finish(self, txn):
+        try:
+            self.queue.index(self.written)
+        except Exception:
+            # As in MailDataManager, an exception here must not break the
+            # transaction, which is already committed elsewhere.
+            LOG.exception('Failed in tpc_finish for %s', self.queue.path)
+
+
+class SegmentMailDelivery(StorageMailDelivery):
+    """ Queued delivery of one or many messages into a segment queue.
+    """
+
+    dataManagerFactory = SegmentDataManager
@@ -0,0 +1,364 @@
+##############################################################################
+#
+# Copyright (c) 2026 Zope Foundation and Contributors.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+"""Mail queue in a SQLite database.
+
+The messages of a SQLite queue are rows of the ``messages`` table of the
+database ``queue.sqlite`` in the queue directory, with their envelope,
+priority, delivery state, attempts and the time of the next attempt. The
+database is used in WAL mode, so the queue can be read while mail is
+queued. Workers of any number of processes claim batches of messages in
+one database transaction each, and the messages are counted by state from
+an index, without a file per message.
+
+Messages are inserted as ``pending`` when the Zope transaction votes and
+become ``new`` when it is finished, each in a short database transaction,
+so transactions queueing mail do not hold up each other or the workers.
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from email.message import Message
+
+from zope.interface import implementer
+from zope.sendmail.queue import MAX_SEND_TIME
+
+from Products.MailHost import metrics
+from Products.MailHost.delivery import BatchDataManager
+from Products.MailHost.delivery import StorageMailDelivery
+from Products.MailHost.generator import PrefixedMessage
+from Products.MailHost.generator import as_bytes
+from Products.MailHost.interfaces import IQueueStorage
+from Products.MailHost.queue import CLAIM_SIZE
+from Products.MailHost.queue import MAX_ATTEMPTS
+from Products.MailHost.queue import PRIORITIES
+from Products.MailHost.queue import STATISTICS_MAX_AGE
+from Products.MailHost.queue import QueueProcessorGroup
+from Products.MailHost.queue import StorageWorkerThread
+from Products.MailHost.queue import _destination
+from Products.MailHost.queue import _interleave
+from Products.MailHost.queue import _weighted
+from Products.MailHost.queue import check_priority
+
+
+LOG = logging.getLogger('MailHost')
+
+# Seconds to wait for other connections writing to the database
+BUSY_TIMEOUT = 30.0
+
+# Seconds after which pending messages of a transaction which was never
+# finished, e.g. as its process died, are marked failed
+PENDING_TIMEOUT = 3600.0
+
+# Attempts to hand the messages of a finished transaction to the processor
+INDEX_ATTEMPTS = 3
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY,
+    fromaddr TEXT NOT NULL,
+    toaddrs TEXT NOT NULL,
+    destination TEXT NOT NULL,
+    priority INTEGER NOT NULL,
+    state TEXT NOT NULL DEFAULT 'new',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next REAL NOT NULL DEFAULT 0,
+    queued REAL NOT NULL,
+    claimed REAL,
+    message BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS messages_due ON messages (state, priority, next);
+"""
+
+
+class Entry:
+    """ A message in a SQLite queue, without the message itself.
+    """
+
+    __slots__ = ('id', 'fromaddr', 'toaddrs', 'destination', 'priority',
+                 'attempts', 'queued')
+
+    def __init__(self, id, fromaddr, toaddrs, destination, priority,
+                 attempts, queued):
+        self.id = id
+        self.fromaddr = fromaddr
+        self.toaddrs = json.loads(toaddrs)
+        self.destination = destination
+        self.priority = PRIORITIES[priority]
+        self.attempts = attempts
+        self.queued = queued
+
+
+@implementer(IQueueStorage)
+class SQLiteQueue:
+    """ Mail queue in a SQLite database, see the module.
+
+    Every thread uses a connection of its own.
+    """
+
+    backend = 'sqlite'
+
+    def __init__(self, path):
+        self.path = path
+        self.database = os.path.join(path, 'queue.sqlite')
+        self._local = threading.local()
+        self._created = False
+
+    def create(self):
+        if self._created:
+            return
+        os.makedirs(self.path, exist_ok=True)
+        connection = self._connect(create=True)
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.executescript(SCHEMA)
+        self._created = True
+
+    def _connect(self, create=False):
+        """ Return the connection of the current thread.
+
+        Raises ``ValueError`` if there is no database and *create* is false.
+        """
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            if not create and not os.path.exists(self.database):
+                raise ValueError('%s is not a mail queue' % self.path)
+            # Transactions are begun and ended explicitly
+            connection = sqlite3.connect(self.database, timeout=BUSY_TIMEOUT,
+                                         isolation_level=None)
+            # Queued mail must survive a power loss like a maildir file
+            connection.execute('PRAGMA synchronous=FULL')
+            self._local.connection = connection
+        return connection
+
+    def delivery(self, priority=None):
+        return SQLiteMailDelivery(self, check_priority(priority))
+
+    def processor(self, mailer_factory, count=1, max_attempts=MAX_ATTEMPTS,
+                  weighted=False):
+        workers = []
+        for index in range(max(int(count), 1)):
+            workers.append(StorageWorkerThread(
+                self, mailer_factory(), index, max_attempts=max_attempts,
+                weighted=weighted))
+        return QueueProcessorGroup(workers, self)
+
+    def statistics(self, max_age=STATISTICS_MAX_AGE):
+        """ Return the number of messages in the queue by state.
+
+        The messages are counted from an index of the database every time,
+        so *max_age* is not needed.
+        """
+        counts = {'new': 0, 'sending': 0, 'deferred': 0, 'failed': 0,
+                  'dead': 0}
+        rows = self._connect().execute(
+            "SELECT state, count(*) FROM messages WHERE state != 'pending' "
+            'GROUP BY state')
+        counts.update(rows)
+        return counts
+
+    def write(self, messages):
+        """ Insert ``(fromaddr, toaddrs, message, priority)`` *messages*.
+
+        The rows are inserted as ``pending``, so they are not sent until
+        the returned ids are passed to ``index``.
+        """
+        self.create()
+        now = time.time()
+        ids = []
+        with _transaction(self._connect()) as connection:
+            for fromaddr, toaddrs, message, priority in messages:
+                with metrics.timed('mailhost_queue_write_seconds'):
+                    if isinstance(message, (Message, PrefixedMessage)):
+                        message = as_bytes(message)
+                    cursor = connection.execute(
+                        'INSERT INTO messages (fromaddr, toaddrs, '
+                        'destination, priority, state, queued, message) '
+                        "VALUES (?, ?, ?, ?, 'pending', ?, ?)",
+                        (fromaddr, json.dumps(list(toaddrs)),
+                         _destination(toaddrs), PRIORITIES.index(priority),
+                         now, message))
+                    ids.append(cursor.lastrowid)
+                metrics.inc('mailhost_queue_written_total')
+        return ids
+
+    def index(self, ids):
+        """ Hand the messages inserted with ``write`` to the processor. """
+        if ids:
+            with _transaction(self._connect()) as connection:
+                connection.executemany(
+                    "UPDATE messages SET state = 'new' "
+                    "WHERE id = ? AND state = 'pending'",
+                    [(id, ) for id in ids])
+
+    def discard(self, ids):
+        """ Remove the messages inserted with ``write``. """
+        if ids:
+            with _transaction(self._connect()) as connection:
+                connection.executemany(
+                    "DELETE FROM messages WHERE id = ? AND state = 'pending'",
+                    [(id, ) for id in ids])
+
+    def read(self, entry):
+        """ Return the bytes of the message of *entry*. """
+        row = self._connect().execute(
+            'SELECT message FROM messages WHERE id = ?', (entry.id, ))
+        return row.fetchone()[0]
+
+    def claim(self, size=CLAIM_SIZE, skip=(), weighted=False):
+        """ Claim up to *size* messages due for sending, in sending order.
+
+        Messages for the destinations in *skip* are left alone. Messages
+        of higher priority come first, or most of the time if *weighted*,
+        and destinations take turns within a priority. Messages claimed by
+        a process which did not finish them in ``MAX_SEND_TIME`` seconds
+        are claimed again.
+        """
+        now = time.time()
+        query = ('SELECT id, fromaddr, toaddrs, destination, priority, '
+                 'attempts, queued FROM messages '
+                 "WHERE (state IN ('new', 'deferred') AND next <= ? "
+                 "OR state = 'sending' AND claimed < ?) ")
+        if skip:
+            query += 'AND destination NOT IN (%s) ' % ', '.join(
+                '?' * len(skip))
+        query += 'AND priority = ? ORDER BY queued LIMIT ?'
+        with _transaction(self._connect()) as connection:
+            lanes = []
+            for priority in range(len(PRIORITIES)):
+                groups = {}
+                for row in connection.execute(
+                        query, (now, now - MAX_SEND_TIME) + tuple(skip)
+                        + (priority, size)):
+                    entry = Entry(*row)
+                    groups.setdefault(entry.destination, []).append(entry)
+                lanes.append(_interleave(groups))
+            if weighted:
+                entries = _weighted(lanes)
+            else:
+                entries = [entry for lane in lanes for entry in lane]
+            entries = entries[:size]
+            connection.executemany(
+                "UPDATE messages SET state = 'sending', claimed = ? "
+                'WHERE id = ?', [(now, entry.id) for entry in entries])
+        return entries
+
+    def release(self, entries):
+        """ Give up the claim on *entries* without changing their state. """
+        with _transaction(self._connect()) as connection:
+            connection.executemany(
+                "UPDATE messages SET state = CASE WHEN attempts THEN "
+                "'deferred' ELSE 'new' END, claimed = NULL WHERE id = ?",
+                [(entry.id, ) for entry in entries])
+
+    def finish(self, entry, state, attempts=None, next=0):
+        """ Record the new *state* of a claimed *entry* and release it.
+
+        *state* is ``sent``, ``deferred``, ``failed`` or ``dead``, with the
+        number of *attempts* made and the time of the *next* attempt.
+        """
+        with _transaction(self._connect()) as connection:
+            if state == 'sent':
+                connection.execute('DELETE FROM messages WHERE id = ?',
+                                   (entry.id, ))
+            else:
+                connection.execute(
+                    'UPDATE messages SET state = ?, attempts = ?, next = ?, '
+                    'claimed = NULL WHERE id = ?',
+                    (state, entry.attempts if attempts is None else attempts,
+                     next, entry.id))
+
+    def maintain(self):
+        """ Mark messages of transactions which were never finished failed.
+
+        These may belong to a committed transaction whose messages could
+        not be handed to the processor, so they are kept for inspection.
+        SQLite checkpoints its log by itself.
+        """
+        with _transaction(self._connect()) as connection:
+            ids = [id for id, in connection.execute(
+                "SELECT id FROM messages WHERE state = 'pending' "
+                'AND queued < ?', (time.time() - PENDING_TIMEOUT, ))]
+            connection.executemany(
+                "UPDATE messages SET state = 'failed' WHERE id = ?",
+                [(id, ) for id in ids])
+        if ids:
+            LOG.warning('Marked pending messages %s of %s failed, their '
+                        'transaction was never finished', ids,
+                        self.database)
+
+
+@contextmanager
+def _transaction(connection):
+    """ Run the ``with`` block in a database transaction of *connection*.
+    """
+    connection.execute('BEGIN IMMEDIATE')
+    try:
+        yield connection
+    except BaseException:
+        connection.rollback()
+        raise
+    connection.commit()
+
+
+class SQLiteDataManager(BatchDataManager):
+    """ Write all messages queued in one transaction into a SQLite queue.
+
+    The messages are inserted as ``pending`` while the transaction votes,
+    so a full disk or a busy database aborts it. They are handed to the
+    queue processor when the transaction is finished, trying again a few
+    times if the database stays busy, or removed if it is aborted.
+    """
+
+    def __init__(self, queue):
+        super().__init__()
+        self.queue = queue
+        self.written = []
+
+    def add(self, fromaddr, toaddrs, message, priority='normal'):
+        self.messages.append((fromaddr, toaddrs, message, priority))
+
+    def abort(self, txn):
+        try:
+            self.queue.discard(self.written)
+        except sqlite3.Error:
+            LOG.exception('Failed to remove messages from %s',
+                          self.queue.database)
+        del self.written[:]
+        super().abort(txn)
+
+    def tpc_vote(self, txn):
+        self.written.extend(self.queue.write(self.messages))
+
+    def tpc_finish(self, txn):
+        # As in MailDataManager, an exception here must not break the
+        # transaction, which is already committed elsewhere.
+        for attempt in range(INDEX_ATTEMPTS):
+            try:
+                self.queue.index(self.written)
+                return
+            except Exception:
+                LOG.warning('Failed in tpc_finish for %s',
+                            self.queue.path, exc_info=True)
+        LOG.error('Committed messages %s stay pending in %s, maintenance '
+                  'marks them failed', self.written, self.queue.database)
+
+
+class SQLiteMailDelivery(StorageMailDelivery):
+    """ Queued delivery of one or many messages into a SQLite queue.
+    """
+
+    dataManagerFactory = SQLiteDataManager
@@ -0,0 +1,96 @@
+##############################################################################
+#
+# Copyright (c) 2026 Zope Foundation and Contributors.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+"""Storages of the mail queue, see ``IQueueStorage``.
+
+A MailHost's ``smtp_queue_backend`` names the storage of its queues:
+
+``maildir``
+  A maildir per queue, as written by ``zope.sendmail``, the default.
+
+``segment``
+  Segment files with an index of the envelopes, see
+  ``Products.MailHost.segment``.
+
+``sqlite``
+  A SQLite database, see ``Products.MailHost.sqlite``.
+"""
+
+from zope.interface import implementer
+
+from Products.MailHost.delivery import QueuedMailBatchDelivery
+from Products.MailHost.delivery import get_maildir
+from Products.MailHost.interfaces import IQueueStorage
+from Products.MailHost.queue import MAX_ATTEMPTS
+from Products.MailHost.queue import STATISTICS_MAX_AGE
+from Products.MailHost.queue import lane_directory
+from Products.MailHost.queue import make_queue_processor
+from Products.MailHost.queue import queue_statistics
+from Products.MailHost.segment import SegmentQueue
+from Products.MailHost.sqlite import SQLiteQueue
+
+
+_queues = {}  # maps (backend, queue path) -> queue storage
+
+
+@implementer(IQueueStorage)
+class MaildirQueue:
+    """ Mail queue in a maildir, with a maildir for each lane inside it.
+    """
+
+    backend = 'maildir'
+
+    def __init__(self, path):
+        self.path = path
+
+    def create(self):
+        get_maildir(self.path)
+
+    def delivery(self, priority=None):
+        lane = lane_directory(self.path, priority)
+        if lane != self.path:
+            # Lanes live inside the queue
+            self.create()
+        return QueuedMailBatchDelivery(lane)
+
+    def processor(self, mailer_factory, count=1, max_attempts=MAX_ATTEMPTS,
+                  weighted=False):
+        processor = make_queue_processor(mailer_factory, self.path, count,
+                                         max_attempts, weighted)
+        processor.queue = self
+        return processor
+
+    def statistics(self, max_age=STATISTICS_MAX_AGE):
+        return queue_statistics(self.path, max_age)
+
+
+backends = {
+    'maildir': MaildirQueue,
+    'segment': SegmentQueue,
+    'sqlite': SQLiteQueue,
+}
+
+
+def get_queue(path, backend='maildir'):
+    """ Return the queue storage of *backend* for the queue at *path*.
+
+    Raises ``ValueError`` for backends not in ``backends``.
+    """
+    queue = _queues.get((backend, path))
+    if queue is None:
+        try:
+            factory = backends[backend]
+        except KeyError:
+            raise ValueError('Unknown queue backend %r, use one of %s'
+                             % (backend, ', '.join(sorted(backends))))
+        queue = _queues.setdefault((backend, path), factory(path))
+    return queue
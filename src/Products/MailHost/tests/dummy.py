@@ -12,6 +12,8 @@
 ##############################################################################
 """ Helpers for MailHost unit tests.
 """
+import smtplib
+
 from Products.MailHost.MailHost import MailHost
 
 
@@ -21,11 +23,16 @@ class DummyMailHost(MailHost):
     def __init__(self, id):
         self.id = id
         self.sent = ''
+        self.sent_many = []
 
     def _send(self, mfrom, mto, messageText, immediate=False):
         self.sent = messageText
         self.immediate = immediate
 
+    def _send_many(self, envelopes, immediate=False):
+        self.sent_many = envelopes
+        self.immediate = immediate
+
 
 class FakeContent:
 
@@ -38,3 +45,82 @@ class FakeContent:
     @staticmethod
     def check_status(context, REQUEST=None):
         return 'Message Sent'
+
+
+class DummySocket:
+
+    def __init__(self):
+        self.data = bytearray()
+
+    def sendall(self, data):
+        self.data += data
+
+
+class DummySMTP:
+    """Stand-in for ``smtplib.SMTP`` recording what is done with it."""
+
+    instances = []
+
+    def __init__(self, host='localhost', port=25, timeout=None):
+        self.host = host
+        self.port = port
+        self.sent = []
+        self.commands = []
+        self.alive = True
+        self.does_esmtp = True
+        self.instances.append(self)
+
+    def _reply(self, command):
+        self.commands.append(command)
+        if not self.alive:
+            raise smtplib.SMTPServerDisconnected('Connection unexpectedly '
+                                                 'closed')
+        return 250, b'Ok'
+
+    def ehlo(self):
+        return self._reply('ehlo')
+
+    def has_extn(self, name):
+        return False
+
+    def login(self, username, password):
+        return self._reply('login')
+
+    def noop(self):
+        return self._reply('noop')
+
+    def rset(self):
+        return self._reply('rset')
+
+    def sendmail(self, fromaddr, toaddrs, message):
+        self._reply('sendmail')
+        self.sent.append((fromaddr, toaddrs, message))
+        return {}
+
+    def ehlo_or_helo_if_needed(self):
+        pass
+
+    def mail(self, fromaddr):
+        self.envelope = (fromaddr, [])
+        return self._reply('mail')
+
+    def rcpt(self, toaddr):
+        self.envelope[1].append(toaddr)
+        return self._reply('rcpt')
+
+    def putcmd(self, cmd):
+        self._reply(cmd)
+        self.sock = DummySocket()
+
+    def getreply(self):
+        if not self.sock.data:
+            return 354, b'End data with <CR><LF>.<CR><LF>'
+        self.sent.append(self.envelope + (bytes(self.sock.data), ))
+        return 250, b'Ok'
+
+    def quit(self):
+        self._reply('quit')
+        self.alive = False
+
+    def close(self):
+        self.alive = False
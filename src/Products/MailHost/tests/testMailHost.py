@@ -23,13 +23,16 @@ from email import message_from_bytes
 from email import message_from_string
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
+from unittest import mock
 
 import transaction
 import zope.sendmail.maildir
 
 from ..MailHost import MailHost
 from ..MailHost import MailHostError
+from ..MailHost import _copy_message
 from ..MailHost import _mungeHeaders
+from ..MailHost import _prepareMessage
 from .dummy import DummyMailHost
 from .dummy import FakeContent
 
@@ -116,6 +119,36 @@ This is the message body."""
         mh2.absolute_url = lambda self: 'http://example.com/mh2'
         self.assertEqual(mh1._getThreadKey(), mh2._getThreadKey())
 
+    def test__getThreadKey_cached(self):
+        mh = self._makeOne('mh')
+        mh.smtp_queue_directory = '/abc'
+        with mock.patch('Products.MailHost.MailHost.realpath',
+                        side_effect=os.path.realpath) as realpath:
+            key = mh._getThreadKey()
+            self.assertEqual(mh._getThreadKey(), key)
+            self.assertEqual(realpath.call_count, 1)
+            mh.smtp_queue_directory = '/def'
+            self.assertNotEqual(mh._getThreadKey(), key)
+            self.assertEqual(realpath.call_count, 2)
+
+    def test__startQueueProcessorThread_running(self):
+        from ..MailHost import queue_threads
+
+        class Running:
+            def is_alive(self):
+                return True
+
+        mh = self._makeOne('mh')
+        mh.smtp_queue_directory = '/abc'
+        key = mh._getThreadKey()
+        queue_threads._processors[key] = Running()
+        try:
+            with mock.patch.object(queue_threads, 'start') as start:
+                mh._startQueueProcessorThread()
+            start.assert_not_called()
+        finally:
+            del queue_threads._processors[key]
+
     def testAddressParser(self):
         msg = """\
 To: "Name, Nick" <recipient@example.com>, "Foo Bar" <foo@example.com>
@@ -228,6 +261,88 @@ This is the message body."""
         self.assertEqual(_rm_date(mailhost.sent), outmsg)
         self.assertEqual(mailhost.immediate, False)
 
+    def testSendMany(self):
+        msg = MIMEText('Message body')
+        msg['From'] = 'sender@example.com'
+        msg['To'] = 'first@example.com'
+        mailhost = self._makeOne('MailHost')
+        mailhost.send_many([
+            msg,
+            'From: sender@example.com\nTo: second@example.com\n\nBody',
+            ('Body', 'third@example.com', 'sender@example.com', 'Hi'),
+        ], immediate=True)
+        self.assertTrue(mailhost.immediate)
+        self.assertEqual(
+            [(mfrom, mto) for mfrom, mto, msg in mailhost.sent_many],
+            [('sender@example.com', ['first@example.com']),
+             ('sender@example.com', ['second@example.com']),
+             ('sender@example.com', ['third@example.com'])])
+        self.assertIn(b'Subject: Hi\r\n', mailhost.sent_many[2][2])
+        with self.assertRaises(MailHostError):
+            mailhost.send_many(['Subject: no recipients\n\nBody'])
+
+    def testSendRecipientBatches(self):
+        mailhost = self._makeOne('MailHost')
+        mto = ['user%d@example.com' % i for i in range(5)]
+        mailhost.send('Subject: Hi\n\nBody', mto=mto,
+                      mfrom='sender@example.com', recipient_batch_size=2)
+        self.assertFalse(mailhost.immediate)
+        self.assertEqual([mto for mfrom, mto, msg in mailhost.sent_many],
+                         [mto[0:2], mto[2:4], mto[4:]])
+        messages = {msg for mfrom, mto, msg in mailhost.sent_many}
+        self.assertEqual(len(messages), 1)
+        message, = messages
+        self.assertIn(b'To: undisclosed-recipients:;\r\n', message)
+        self.assertNotIn(b'user0@example.com', message)
+
+    def testSendRecipientBatchesDefault(self):
+        mailhost = self._makeOne('MailHost')
+        mailhost.smtp_recipient_batch_size = 3
+        mto = ', '.join('user%d@example.com' % i for i in range(3))
+        mailhost.send('Subject: Hi\n\nBody', mto=mto,
+                      mfrom='sender@example.com')
+        # Not more recipients than the batch size, so no fan out
+        self.assertEqual(mailhost.sent_many, [])
+        self.assertIn(b'To: user0@example.com, user1@example.com',
+                      mailhost.sent)
+        mailhost.send('Subject: Hi\n\nBody',
+                      mto=mto + ', user3@example.com',
+                      mfrom='sender@example.com')
+        self.assertEqual([len(mto) for mfrom, mto, msg in mailhost.sent_many],
+                         [3, 1])
+
+    def testSendRecipientBatchesKeepsHeaders(self):
+        # Recipients taken from the message keep their headers
+        mailhost = self._makeOne('MailHost')
+        mailhost.send('From: sender@example.com\n'
+                      'To: first@example.com, second@example.com\n'
+                      'Cc: third@example.com\n\nBody',
+                      recipient_batch_size=2)
+        self.assertEqual([mto for mfrom, mto, msg in mailhost.sent_many],
+                         [['first@example.com', 'second@example.com'],
+                          ['third@example.com']])
+        self.assertIn(b'To: first@example.com, second@example.com\r\n',
+                      mailhost.sent_many[0][2])
+
+    def testSendPersonalized(self):
+        mailhost = self._makeOne('MailHost')
+        mto = ['Jürgen <juergen@example.com>', 'jane@example.com']
+        mailhost.send('Subject: Hi\n\nBody', mto=mto,
+                      mfrom='sender@example.com', personalize=True,
+                      immediate=True)
+        self.assertTrue(mailhost.immediate)
+        (_, mto1, msg1), (_, mto2, msg2) = mailhost.sent_many
+        self.assertEqual(mto1, [mto[0]])
+        self.assertEqual(mto2, [mto[1]])
+        self.assertEqual(
+            msg1.prefix,
+            b'To: =?utf-8?q?J=C3=BCrgen?= <juergen@example.com>\r\n')
+        self.assertEqual(msg2.prefix, b'To: jane@example.com\r\n')
+        # The serialized message is shared, not copied per recipient
+        self.assertIs(msg1.body, msg2.body)
+        self.assertEqual(message_from_bytes(bytes(msg2)).get_all('To'),
+                         ['jane@example.com'])
+
     def testSendImmediate(self):
         outmsg = b"""\
 From: sender@example.com\r
@@ -246,6 +361,14 @@ This is the message body."""
         self.assertEqual(_rm_date(mailhost.sent), outmsg)
         self.assertEqual(mailhost.immediate, True)
 
+    def testSendImmediateRenderOnCommit(self):
+        mailhost = self._makeOne('MailHost')
+        mailhost.smtp_render_on_commit = True
+        mailhost.send('Subject: Now\n\nBody', mto='user@example.com',
+                      mfrom='sender@example.com', immediate=True)
+        self.assertIn(b'Subject: Now', mailhost.sent)
+        self.assertEqual(mailhost.immediate, True)
+
     def testSendBodyWithUrl(self):
         # The implementation of rfc822.Message reacts poorly to
         # message bodies containing ':' characters as in a url
@@ -482,6 +605,30 @@ wqFVbiB0cnVjbyA8c3Ryb25nPmZhbnTDoXN0aWNvPC9zdHJvbmc+IQ=3D=3D
         pattern = pattern.replace(b"\n", b"\r\n")
         self.assertRegex(mailhost.sent, pattern)
 
+    def testSendMessageObjectLeavesOriginalUntouched(self):
+        attachment = MIMEText('x' * 1024)
+        attachment.add_header('Content-Disposition', 'attachment',
+                              filename='big.txt')
+        text = MIMEText('Hello')
+        del text['Content-Type']
+        msg = MIMEMultipart()
+        msg.attach(text)
+        msg.attach(attachment)
+        msg['To'] = 'Foo Bar <foo@example.com>'
+        original = msg.as_string()
+
+        mo = _copy_message(msg)
+        self.assertIsNot(mo.get_payload(), msg.get_payload())
+        self.assertIsNot(mo.get_payload()[1], attachment)
+        self.assertIs(mo.get_payload()[1]._payload, attachment._payload)
+
+        mailhost = self._makeOne('MailHost')
+        mailhost.send(msg, mfrom='sender@example.com', subject='Hi',
+                      charset='utf-8')
+        self.assertEqual(msg.as_string(), original)
+        self.assertIn(b'From: sender@example.com', mailhost.sent)
+        self.assertIn(b'charset="utf-8"', mailhost.sent)
+
     def testExplicitBase64Encoding(self):
         mailhost = self._makeOne('MailHost')
         mailhost.send('Date: Sun, 27 Aug 2006 17:00:00 +0200\n\nA Message',
@@ -680,6 +827,7 @@ D=EDt =EFs =E9=E9n test
         self.assertEqual(mailhost.smtp_host, 'localhost')
         self.assertEqual(mailhost.smtp_port, 25)
         self.assertEqual(mailhost.implicit_tls, True)
+        self.assertEqual(mailhost.smtp_render_on_commit, False)
 
     def test_createDefaultMailer(self):
         mailhost = MailHost()
@@ -776,6 +924,135 @@ Content-Transfer-Encoding: 8bit
         md = zope.sendmail.maildir.Maildir(self.smtp_queue_directory)
         self.assertEqual(len(list(md)), 1)
 
+    def testSendMany(self):
+        mh = self._makeOne('MailHost')
+        mh.send_many([('Message %d' % i, 'user@example.com',
+                       'zope@example.com', 'Hello world')
+                      for i in range(3)])
+        transaction.commit()
+        self.assertTrue(mh.started_queue_processor_thread)
+        md = zope.sendmail.maildir.Maildir(self.smtp_queue_directory)
+        self.assertEqual(len(list(md)), 3)
+
+    def testSendRecipientBatches(self):
+        mh = self._makeOne('MailHost')
+        mh.smtp_recipient_batch_size = 100
+        mh.send('Subject: Hi\n\nBody',
+                mto=['user%d@example.com' % i for i in range(250)],
+                mfrom='zope@example.com')
+        transaction.commit()
+        md = zope.sendmail.maildir.Maildir(self.smtp_queue_directory)
+        recipients = []
+        for filename in md:
+            with open(filename, 'rb') as f:
+                msg = message_from_bytes(f.read())
+            recipients.append(len(msg['X-Zope-To'].split(', ')))
+        self.assertEqual(sorted(recipients), [50, 100, 100])
+
+    def testSendPersonalized(self):
+        mh = self._makeOne('MailHost')
+        mh.send('Subject: Hi\n\nBody', mto=['a@example.com', 'b@example.com'],
+                mfrom='zope@example.com', personalize=True)
+        transaction.commit()
+        md = zope.sendmail.maildir.Maildir(self.smtp_queue_directory)
+        messages = {}
+        for filename in md:
+            with open(filename, 'rb') as f:
+                msg = message_from_bytes(f.read())
+            messages[msg['To']] = msg
+        self.assertEqual(sorted(messages), ['a@example.com', 'b@example.com'])
+        first, second = messages.values()
+        # Every copy gets its own Message-Id in front of the shared bytes
+        self.assertNotEqual(first['Message-Id'], second['Message-Id'])
+        self.assertEqual(first.get_payload(), 'Body')
+
+    def testStreamLargeMessageIntoQueue(self):
+        msg = ('From: zope@example.com\n'
+               'To: user@example.com\n'
+               'Subject: Large\n'
+               'Date: Sun, 27 Aug 2006 17:00:00 +0200\n'
+               'Message-Id: <1@example.com>\n'
+               '\n' + 'x' * 2048 + '\n')
+        mh = self._makeOne('MailHost')
+        mh.smtp_stream_threshold = 1024
+        mh.send(msg)
+        transaction.commit()
+        md = zope.sendmail.maildir.Maildir(self.smtp_queue_directory)
+        filename, = list(md)
+        with open(filename, 'rb') as f:
+            self.assertEqual(f.read(),
+                             b'X-Zope-From: zope@example.com\n'
+                             b'X-Zope-To: user@example.com\n'
+                             + _mungeHeaders(msg)[0])
+
+    def testPriority(self):
+        mh = self._makeOne('MailHost')
+        mh.send('Subject: Reset your password\n\nBody',
+                mto='user@example.com', mfrom='zope@example.com',
+                priority='high')
+        mh.send_many([('Newsletter', 'user@example.com',
+                       'zope@example.com')] * 2, priority='low')
+        with self.assertRaises(ValueError):
+            mh.send('Body', mto='user@example.com',
+                    mfrom='zope@example.com', priority='urgent')
+        transaction.commit()
+        for lane, count in (('', 0), ('lane-high', 1), ('lane-low', 2)):
+            md = zope.sendmail.maildir.Maildir(
+                os.path.join(self.smtp_queue_directory, lane))
+            self.assertEqual(len(list(md)), count)
+        self.assertEqual(mh.queueLength(), 3)
+
+    def testRenderOnCommit(self):
+        mh = self._makeOne('MailHost')
+        mh.smtp_render_on_commit = True
+        msg = MIMEText('Body')
+        mto = ['user@example.com']
+        with mock.patch('Products.MailHost.MailHost._prepareMessage',
+                        wraps=_prepareMessage) as prepare:
+            mh.send('Subject: Aborted\n\nBody', mto=mto,
+                    mfrom='zope@example.com')
+            transaction.abort()
+            mh.send(msg, mto=mto, mfrom='zope@example.com', subject='Hi')
+            savepoint = transaction.savepoint()
+            mh.send_many([('Rolled back', mto, 'zope@example.com')])
+            savepoint.rollback()
+            mh.send_many([('Body', mto, 'zope@example.com', 'Many')] * 2)
+            # Changes after sending are not sent
+            msg['X-Changed'] = 'yes'
+            mto.append('other@example.com')
+            self.assertEqual(prepare.call_count, 0)
+            transaction.commit()
+        self.assertEqual(prepare.call_count, 3)
+        md = zope.sendmail.maildir.Maildir(self.smtp_queue_directory)
+        messages = []
+        for path in md:
+            with open(path, 'rb') as f:
+                messages.append(message_from_bytes(f.read()))
+        self.assertEqual(sorted(mo['Subject'] for mo in messages),
+                         ['Hi', 'Many', 'Many'])
+        self.assertEqual({mo['X-Zope-To'] for mo in messages},
+                         {'user@example.com'})
+        self.assertNotIn('X-Changed', messages[0])
+
+    def testRenderOnCommitErrors(self):
+        mh = self._makeOne('MailHost')
+        mh.smtp_render_on_commit = True
+        mh.send('Subject: No recipients\n\nBody')
+        with self.assertRaises(MailHostError):
+            transaction.commit()
+        transaction.abort()
+        md = zope.sendmail.maildir.Maildir(self.smtp_queue_directory, True)
+        self.assertEqual(list(md), [])
+
+    def testQueueLength(self):
+        mh = self._callFUT()
+        self.assertEqual(mh.queueLength(), 1)
+        self.assertEqual(mh.queueStatistics(),
+                         {'new': 1, 'sending': 0, 'deferred': 0,
+                          'failed': 0, 'dead': 0})
+        mh.smtp_queue_directory = os.path.join(self.tmpdir, 'missing')
+        self.assertTrue(mh.queueLength().startswith('n/a'))
+
     def testNotStartQueueProcessorThread(self):
         os.environ['MAILHOST_QUEUE_ONLY'] = '1'
         try:
@@ -786,6 +1063,28 @@ Content-Transfer-Encoding: 8bit
         md = zope.sendmail.maildir.Maildir(self.smtp_queue_directory)
         self.assertEqual(len(list(md)), 1)
 
+    def testShutdown(self):
+        from ..MailHost import shutdown
+        from ..queue import ProcessorRegistry
+        from .test_queue import DummyProcessor
+
+        mh = self._callFUT()
+        registry = ProcessorRegistry()
+        key = mh._getThreadKey()
+        processor = DummyProcessor()
+        processor.queue = mh._getQueue()
+        registry.start(key, lambda: processor)
+        os.environ['MAILHOST_SHUTDOWN_TIMEOUT'] = '0.5'
+        try:
+            with mock.patch('Products.MailHost.MailHost.queue_threads',
+                            registry):
+                self.assertEqual(shutdown(),
+                                 {self.smtp_queue_directory: 1})
+        finally:
+            del os.environ['MAILHOST_SHUTDOWN_TIMEOUT']
+        self.assertTrue(registry.closed)
+        self.assertNotIn(key, registry)
+
 
 _date_hdr_re = re.compile(b"^Date:.*\r\n", re.I | re.M)
 
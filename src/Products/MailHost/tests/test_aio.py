@@ -0,0 +1,194 @@
+##############################################################################
+#
+# Copyright (c) 2026 Zope Foundation and Contributors.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+"""Asynchronous delivery unit tests.
+"""
+
+import asyncio
+import smtplib
+import time
+import unittest
+from unittest import mock
+
+import transaction
+
+from Products.MailHost import aio
+from Products.MailHost.aio import AsyncDeliveryEngine
+from Products.MailHost.aio import AsyncMailer
+from Products.MailHost.aio import SMTPSettings
+from Products.MailHost.delivery import DirectMailBatchDelivery
+from Products.MailHost.MailHost import MailHost
+
+
+class DummyAsyncSMTP:
+
+    instances = []
+    active = 0
+    max_active = 0
+
+    def __init__(self, **kwargs):
+        self.kwargs = kwargs
+        self.is_connected = False
+        self.sent = []
+        self.instances.append(self)
+
+    async def connect(self):
+        self.is_connected = True
+
+    async def sendmail(self, sender, recipients, message):
+        cls = self.__class__
+        cls.active += 1
+        cls.max_active = max(cls.active, cls.max_active)
+        try:
+            await asyncio.sleep(0.02)
+        finally:
+            cls.active -= 1
+        if 'refused@example.com' in recipients:
+            raise smtplib.SMTPRecipientsRefused(recipients)
+        self.sent.append((sender, recipients, message))
+
+    async def quit(self):
+        self.is_connected = False
+
+    def close(self):
+        self.is_connected = False
+
+
+class TestAsyncDeliveryEngine(unittest.TestCase):
+
+    def setUp(self):
+        transaction.abort()
+        DummyAsyncSMTP.instances = []
+        DummyAsyncSMTP.max_active = 0
+        self.engine = AsyncDeliveryEngine(max_sessions=5)
+        self.engine.smtp = DummyAsyncSMTP
+
+    def tearDown(self):
+        self.engine.stop(5)
+        transaction.abort()
+
+    def _sent(self):
+        return [sent for client in DummyAsyncSMTP.instances
+                for sent in client.sent]
+
+    def test_concurrent_sessions(self):
+        settings = SMTPSettings('localhost', 25)
+        for i in range(20):
+            self.engine.submit(settings, 'me@example.com',
+                               'user@example.com', b'Subject: %d\r\n' % i)
+        self.assertTrue(self.engine.wait(5))
+        self.assertEqual(sorted(message for _, _, message in self._sent()),
+                         sorted(b'Subject: %d\r\n' % i for i in range(20)))
+        self.assertEqual(DummyAsyncSMTP.max_active, 5)
+        self.assertEqual(len(DummyAsyncSMTP.instances), 5)
+        self.assertEqual(self.engine.pending, 0)
+
+    def test_sessions_per_relay(self):
+        self.engine.submit(SMTPSettings('relay1', 25), 'me@example.com',
+                           ['user@example.com'], b'1')
+        self.assertTrue(self.engine.wait(5))
+        self.engine.submit(SMTPSettings('relay2', 2525, force_tls=True),
+                           'me@example.com', ['user@example.com'], b'2')
+        self.assertTrue(self.engine.wait(5))
+        self.engine.submit(SMTPSettings('relay1', 25), 'me@example.com',
+                           ['user@example.com'], b'3')
+        self.assertTrue(self.engine.wait(5))
+        relay1, relay2 = DummyAsyncSMTP.instances
+        self.assertEqual([message for _, _, message in relay1.sent],
+                         [b'1', b'3'])
+        self.assertEqual(relay2.kwargs['hostname'], 'relay2')
+        self.assertEqual(relay2.kwargs['port'], 2525)
+        self.assertTrue(relay2.kwargs['start_tls'])
+
+    def test_failure_is_logged(self):
+        settings = SMTPSettings()
+        self.engine.submit(settings, 'me@example.com',
+                           ['refused@example.com'], b'1')
+        self.engine.submit(settings, 'me@example.com',
+                           ['user@example.com'], b'2')
+        self.assertTrue(self.engine.wait(5))
+        self.assertEqual([message for _, _, message in self._sent()], [b'2'])
+
+    def test_stop_deadline(self):
+        self.engine.start()
+        thread = self.engine._thread
+        with mock.patch.object(self.engine, 'wait',
+                               side_effect=lambda timeout: time.sleep(0.2)), \
+                mock.patch.object(thread, 'join', wraps=thread.join) as join:
+            self.engine.stop(0.5)
+        # Stopping the loop gets what is left of the timeout
+        (timeout, ), kw = join.call_args
+        self.assertLessEqual(timeout, 0.3)
+        self.assertFalse(self.engine.is_alive())
+
+    def test_shutdown(self):
+        settings = SMTPSettings()
+        self.engine.submit(settings, 'me@example.com',
+                           ['user@example.com'], b'1')
+        self.engine.shutdown(5)
+        self.assertFalse(self.engine.is_alive())
+        # Mail submitted later is dropped, the loop is not started again
+        with self.assertLogs('MailHost', 'ERROR'):
+            self.engine.submit(settings, 'me@example.com',
+                               ['user@example.com'], b'2')
+        self.engine.start()
+        self.assertFalse(self.engine.is_alive())
+        self.assertEqual(self.engine.pending, 0)
+        self.assertEqual([message for _, _, message in self._sent()], [b'1'])
+
+    def test_delivery_on_commit(self):
+        mailer = AsyncMailer(self.engine, SMTPSettings())
+        delivery = DirectMailBatchDelivery(mailer)
+        delivery.send('me@example.com', ['user@example.com'],
+                      b'Subject: Test\r\n\r\nBody')
+        self.engine.wait(5)
+        self.assertEqual(self._sent(), [])
+        transaction.commit()
+        self.assertTrue(self.engine.wait(5))
+        (fromaddr, toaddrs, message), = self._sent()
+        self.assertEqual(toaddrs, ['user@example.com'])
+        self.assertTrue(message.startswith(b'Message-Id: <'))
+
+    def test_abort(self):
+        mailer = AsyncMailer(self.engine, SMTPSettings())
+        DirectMailBatchDelivery(mailer).send(
+            'me@example.com', ['user@example.com'], b'Subject: Test')
+        transaction.abort()
+        self.assertTrue(self.engine.wait(5))
+        self.assertEqual(self._sent(), [])
+
+    def test_mailhost(self):
+        mh = MailHost('MailHost')
+        mh.smtp_async = True
+        saved, aio._engine = aio._engine, self.engine
+        saved_module, aio.aiosmtplib = aio.aiosmtplib, object()
+        try:
+            mh.send('Subject: Test\n\nBody', mto='user@example.com',
+                    mfrom='me@example.com')
+            transaction.commit()
+        finally:
+            aio._engine = saved
+            aio.aiosmtplib = saved_module
+        self.assertTrue(self.engine.wait(5))
+        (fromaddr, toaddrs, message), = self._sent()
+        self.assertEqual(fromaddr, 'me@example.com')
+        self.assertIn(b'\r\nSubject: Test\r\n', message)
+
+    def test_mailhost_without_aiosmtplib(self):
+        mh = MailHost('MailHost')
+        mh.smtp_async = True
+        saved_module, aio.aiosmtplib = aio.aiosmtplib, None
+        try:
+            delivery = mh._makeDirectDelivery()
+        finally:
+            aio.aiosmtplib = saved_module
+        self.assertNotIsInstance(delivery.mailer, AsyncMailer)
@@ -0,0 +1,175 @@
+##############################################################################
+#
+# Copyright (c) 2026 Zope Foundation and Contributors.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+"""Message build process unit tests.
+"""
+
+import os
+import time
+import unittest
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+from email import message_from_bytes
+from email.mime.application import MIMEApplication
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from unittest import mock
+
+from Products.MailHost import builder
+from Products.MailHost.builder import build_pools
+from Products.MailHost.builder import close_build_pools
+from Products.MailHost.builder import result
+from Products.MailHost.builder import submit
+from Products.MailHost.MailHost import MailHostError
+from Products.MailHost.MailHost import _buildMessage
+from Products.MailHost.tests.dummy import DummyMailHost
+
+
+def _large_message():
+    msg = MIMEMultipart()
+    msg['Subject'] = 'Report'
+    msg.attach(MIMEText('<p>See the attachment</p>', 'html'))
+    msg.attach(MIMEApplication(b'\x00\xff' * 4096, Name='report.bin'))
+    return msg
+
+
+class TestBuildPool(unittest.TestCase):
+
+    def tearDown(self):
+        close_build_pools()
+
+    def test_submit(self):
+        msg = _large_message()
+        args = (msg, 'user@example.com', 'zope@example.com')
+        future = submit(1, _buildMessage, *args)
+        mfrom, mto, message = future.result(timeout=60)
+        self.assertIs(build_pools[1], builder.get_build_pool(1))
+        self.assertEqual((mfrom, mto), ('zope@example.com',
+                                        ['user@example.com']))
+        built = message_from_bytes(message)
+        self.assertEqual(built['Subject'], 'Report')
+        self.assertEqual(built.get_payload()[1].get_payload(decode=True),
+                         b'\x00\xff' * 4096)
+        # Errors are raised by the future
+        future = submit(1, _buildMessage, 'Subject: Hi\n\nBody')
+        with self.assertRaises(MailHostError):
+            future.result(timeout=60)
+        close_build_pools()
+        self.assertEqual(build_pools, {})
+
+    def test_broken_pool(self):
+        broken = mock.Mock()
+        broken.submit.side_effect = BrokenProcessPool
+        build_pools[2] = broken
+        with mock.patch.object(builder, 'ProcessPoolExecutor') as factory:
+            submit(2, len, 'abc')
+        factory.return_value.submit.assert_called_once_with(len, 'abc')
+        self.assertIs(build_pools[2], factory.return_value)
+        del build_pools[2]
+
+    def test_died(self):
+        future = submit(1, os._exit, 1)
+        broken = build_pools[1]
+        # The message is built in this process instead
+        self.assertEqual(result(future, len, 'abc'), 3)
+        self.assertEqual(submit(1, len, 'abcd').result(timeout=60), 4)
+        self.assertIsNot(build_pools[1], broken)
+
+    def test_hanging(self):
+        future = submit(1, time.sleep, 30)
+        for process in list(build_pools[1]._processes.values()):
+            self.addCleanup(process.terminate)
+        with mock.patch.object(builder, 'BUILD_TIMEOUT', 0.5), \
+                self.assertLogs('MailHost', 'ERROR'):
+            # The message is built in this process instead
+            self.assertEqual(result(future, len, 'abc'), 3)
+        self.assertNotIn(1, build_pools)
+        self.assertEqual(submit(1, len, 'abcd').result(timeout=60), 4)
+
+    def test_size_changed(self):
+        with mock.patch.object(builder, 'ProcessPoolExecutor') as factory:
+            factory.side_effect = [mock.Mock(), mock.Mock()]
+            old = builder.get_build_pool(1)
+            new = builder.get_build_pool(2)
+        old.shutdown.assert_called_once_with(wait=False)
+        new.shutdown.assert_not_called()
+        self.assertEqual(build_pools, {2: new})
+        build_pools.clear()
+
+
+class TestMailHostBuild(unittest.TestCase):
+
+    def setUp(self):
+        self.mh = DummyMailHost('MailHost')
+        self.mh.smtp_build_processes = 1
+        self.mh.smtp_build_threshold = 4096
+
+    def tearDown(self):
+        close_build_pools()
+
+    def _submit(self):
+        return mock.patch('Products.MailHost.MailHost.submit',
+                          wraps=submit)
+
+    def test_send(self):
+        with self._submit() as pooled:
+            self.mh.send('Subject: Small\n\nBody', mto='user@example.com',
+                         mfrom='zope@example.com')
+            self.assertEqual(pooled.call_count, 0)
+            self.mh.send(_large_message(), mto='user@example.com',
+                         mfrom='zope@example.com')
+            self.assertEqual(pooled.call_count, 1)
+        self.assertIsInstance(self.mh.sent, bytes)
+        self.assertIn(b'Subject: Report', self.mh.sent)
+        self.assertIn(b'Name="report.bin"', self.mh.sent)
+
+    def test_send_personalized(self):
+        with self._submit() as pooled:
+            self.mh.send(_large_message(), mto=['a@example.com',
+                                                'b@example.com'],
+                         mfrom='zope@example.com', personalize=True)
+            self.assertEqual(pooled.call_count, 1)
+        self.assertEqual([mto for mfrom, mto, msg in self.mh.sent_many],
+                         [['a@example.com'], ['b@example.com']])
+        self.assertEqual(self.mh.sent_many[0][2].prefix,
+                         b'To: a@example.com\n')
+
+    def test_send_many(self):
+        with self._submit() as pooled:
+            self.mh.send_many([
+                (_large_message(), 'a@example.com', 'zope@example.com'),
+                ('Small', 'b@example.com', 'zope@example.com'),
+                (_large_message(), 'c@example.com', 'zope@example.com'),
+            ])
+            self.assertEqual(pooled.call_count, 2)
+        self.assertEqual([mto for mfrom, mto, msg in self.mh.sent_many],
+                         [['a@example.com'], ['b@example.com'],
+                          ['c@example.com']])
+
+    def test_died(self):
+        died = Future()
+        died.set_exception(BrokenProcessPool())
+        with mock.patch('Products.MailHost.MailHost.submit',
+                        return_value=died):
+            self.mh.send(_large_message(), mto='user@example.com',
+                         mfrom='zope@example.com')
+            self.mh.send_many([(_large_message(), 'a@example.com',
+                                'zope@example.com')])
+        self.assertIn(b'Subject: Report', self.mh.sent)
+        self.assertEqual(self.mh.sent_many[0][1], ['a@example.com'])
+
+    def test_disabled(self):
+        self.mh.smtp_build_processes = 0
+        with self._submit() as pooled:
+            self.mh.send(_large_message(), mto='user@example.com',
+                         mfrom='zope@example.com')
+        self.assertEqual(pooled.call_count, 0)
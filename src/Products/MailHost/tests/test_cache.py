@@ -0,0 +1,183 @@
+##############################################################################
+#
+# Copyright (c) 2026 Zope Foundation and Contributors.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+"""Cache unit tests.
+"""
+
+import unittest
+
+from Products.MailHost.cache import LRUCache
+from Products.MailHost.cache import cache_statistics
+from Products.MailHost.generator import _folded_headers
+from Products.MailHost.MailHost import MailHost
+from Products.MailHost.MailHost import _address_cache
+from Products.MailHost.MailHost import _address_list_cache
+from Products.MailHost.MailHost import _encode_address_string
+from Products.MailHost.MailHost import _format_addresses
+from Products.MailHost.MailHost import _mungeHeaders
+from Products.MailHost.MailHost import _plan_cache
+
+
+DATE = 'Date: Sun, 27 Aug 2006 17:00:00 +0200\n'
+
+MESSAGES = [
+    # (messageText, keyword arguments for _mungeHeaders)
+    ('From: me@example.com\nTo: you@example.com\nSubject: Hi\n' + DATE +
+     '\nHello %s\n', {}),
+    ('From: me@example.com\nSubject: Hi\n' + DATE + '\nGrüße %s\n',
+     {'mto': 'you@example.com', 'charset': 'utf-8'}),
+    ('From: me@example.com\nTo: you@example.com\n' + DATE +
+     'Content-Type: text/plain; charset=iso-8859-1\n\nHello %s\n',
+     {'subject': 'Grüße'}),
+    ('From: me@example.com\nTo: you@example.com\n' + DATE +
+     '\n<p>Hello %s</p>\n', {'msg_type': 'text/html', 'charset': 'utf-8'}),
+    ('From: me@example.com\r\nTo: you@example.com\r\n' + DATE.strip() +
+     '\r\n\r\n.Hello %s\r\n', {}),
+    ('From: me@example.com\nTo: you@example.com\n' + DATE +
+     '\nHello %s\n', {'encode': 'quoted-printable'}),
+    ('From: me@example.com\nTo: you@example.com\n' + DATE +
+     'Content-Type: multipart/mixed; boundary="XYZ"\n\n--XYZ\n'
+     'Content-Type: text/plain\n\nHello %s\n--XYZ--\n', {'charset': 'utf-8'}),
+]
+
+
+class TestLRUCache(unittest.TestCase):
+
+    def test_lru(self):
+        cache = LRUCache(2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        cache.set('c', 3)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.get('c'), 3)
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.statistics(),
+                         {'hits': 3, 'misses': 1, 'size': 2, 'maxsize': 2})
+        cache.clear()
+        self.assertEqual(cache.statistics(),
+                         {'hits': 0, 'misses': 0, 'size': 0, 'maxsize': 2})
+
+
+class TestMessagePlans(unittest.TestCase):
+
+    def setUp(self):
+        _plan_cache.clear()
+
+    def tearDown(self):
+        _plan_cache.clear()
+
+    def test_same_result_as_parsing(self):
+        for messageText, kw in MESSAGES:
+            expected = []
+            for name in ('Alice', 'Bob', 'Carol'):
+                _plan_cache.clear()
+                expected.append(_mungeHeaders(messageText % name, **kw))
+            _plan_cache.clear()
+            for name, result in zip(('Alice', 'Bob', 'Carol'), expected):
+                self.assertEqual(_mungeHeaders(messageText % name, **kw),
+                                 result)
+
+    def test_cached_by_header_block(self):
+        messageText, kw = MESSAGES[1]
+        for name in ('Alice', 'Bob', 'Carol'):
+            _mungeHeaders(messageText % name, **kw)
+        self.assertEqual(_plan_cache.statistics()['size'], 1)
+        self.assertEqual(_plan_cache.statistics()['hits'], 2)
+        _mungeHeaders(messageText % 'Dave', mto='you@example.com')
+        self.assertEqual(_plan_cache.statistics()['size'], 2)
+
+    def test_multipart_not_cached(self):
+        messageText, kw = MESSAGES[-1]
+        _mungeHeaders(messageText % 'Alice', **kw)
+        self.assertEqual(_plan_cache.statistics()['size'], 0)
+
+
+class TestFoldedHeaders(unittest.TestCase):
+
+    def setUp(self):
+        _folded_headers.clear()
+
+    def tearDown(self):
+        _folded_headers.clear()
+
+    def test_same_result_as_folding(self):
+        messageText = ('From: me@example.com\nTo: you@example.com\n'
+                       'Subject: %s\n' % ('A long subject line ' * 10)
+                       + DATE + '\nHello\n')
+        uncached = _mungeHeaders(messageText)[0]
+        self.assertGreater(_folded_headers.statistics()['size'], 0)
+        self.assertEqual(_mungeHeaders(messageText)[0], uncached)
+        self.assertGreater(_folded_headers.statistics()['hits'], 0)
+        self.assertIn(b'A long\r\n subject line', uncached)
+
+
+class TestAddressCaches(unittest.TestCase):
+
+    def setUp(self):
+        _address_cache.clear()
+        _address_list_cache.clear()
+
+    def tearDown(self):
+        _address_cache.clear()
+        _address_list_cache.clear()
+
+    def test_encode_address_string(self):
+        address = 'Jürgen Müller <juergen@example.com>'
+        first = _encode_address_string(address, 'utf-8')
+        second = _encode_address_string(address, 'utf-8')
+        self.assertIsNot(first, second)
+        self.assertEqual(str(first), str(second))
+        self.assertEqual(str(first),
+                         '=?utf-8?q?J=C3=BCrgen_M=C3=BCller?= '
+                         '<juergen@example.com>')
+        self.assertEqual(_address_cache.statistics()['hits'], 1)
+        _encode_address_string(address, 'iso-8859-1')
+        self.assertEqual(_address_cache.statistics()['size'], 2)
+
+    def test_format_addresses(self):
+        text = 'Jane <jane@example.com>, john@example.com'
+        addresses = _format_addresses(text)
+        self.assertEqual(addresses,
+                         ['Jane <jane@example.com>', 'john@example.com'])
+        addresses.append('changed')
+        self.assertEqual(_format_addresses(text),
+                         ['Jane <jane@example.com>', 'john@example.com'])
+        self.assertEqual(_address_list_cache.statistics()['hits'], 1)
+
+    def test_munge_headers(self):
+        messageText = ('From: me@example.com\n'
+                       'Cc: Jane <jane@example.com>\n' + DATE + '\nHello')
+        for i in range(3):
+            msg, mto, mfrom = _mungeHeaders(messageText,
+                                            mto='John <john@example.com>',
+                                            mfrom='Me <me@example.com>')
+            self.assertEqual(mto, ['John <john@example.com>'])
+            self.assertIn(b'\r\nFrom: Me <me@example.com>\r\n', msg)
+        self.assertEqual(_address_cache.statistics()['hits'], 4)
+        self.assertEqual(_address_list_cache.statistics()['hits'], 2)
+
+    def test_statistics(self):
+        _format_addresses('jane@example.com')
+        _format_addresses('jane@example.com')
+        statistics = cache_statistics()
+        self.assertEqual(statistics['address_lists'],
+                         {'hits': 1, 'misses': 1, 'size': 1,
+                          'maxsize': _address_list_cache.maxsize})
+        self.assertEqual(set(statistics),
+                         {'addresses', 'address_lists', 'message_plans',
+                          'folded_headers'})
+        mh = MailHost('MailHost')
+        self.assertEqual(mh.cacheStatistics(), statistics)
+        self.assertIn('mailhost_cache_hits_total{cache="address_lists"} 1\n',
+                      mh.deliveryMetricsText())
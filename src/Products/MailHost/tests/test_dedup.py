@@ -0,0 +1,235 @@
+##############################################################################
+#
+# Copyright (c) 2026 Zope Foundation and Contributors.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+"""Duplicate mail unit tests.
+"""
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from unittest import mock
+
+import transaction
+from transaction import TransactionManager
+from zope.interface.verify import verifyObject
+from zope.sendmail.maildir import Maildir
+
+from Products.MailHost import dedup
+from Products.MailHost.dedup import DuplicateMailError
+from Products.MailHost.dedup import SentIndex
+from Products.MailHost.dedup import SentKeysDataManager
+from Products.MailHost.dedup import message_key
+from Products.MailHost.interfaces import IMailHost
+from Products.MailHost.tests.dummy import DummyMailHost
+from Products.MailHost.tests.testMailHost import QueueingDummyMailHost
+
+
+class TestSentIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(suffix='MailHostTests')
+        self.index = SentIndex(self.tmpdir)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def test_record(self):
+        self.assertEqual(self.index.record(['a', 'b'], 60), ['a', 'b'])
+        self.assertEqual(self.index.record(['b', 'c'], 60), ['c'])
+        self.assertTrue(self.index.seen('a', 60))
+        self.assertFalse(self.index.seen('d', 60))
+        # Other processes see the keys
+        self.assertTrue(SentIndex(self.tmpdir).seen('c', 60))
+        self.assertTrue(os.path.isfile(os.path.join(self.tmpdir,
+                                                    'sent.sqlite')))
+
+    def test_window(self):
+        self.index.record(['a'], 60)
+        later = time.time() + 61
+        with mock.patch('time.time', return_value=later):
+            self.assertFalse(self.index.seen('a', 60))
+            self.assertEqual(self.index.record(['a'], 60), ['a'])
+        self.assertEqual(self.index.record(['a'], 60), [])
+
+    def test_forget(self):
+        self.index.record(['a', 'b'], 60)
+        self.index.forget(['a'])
+        self.assertFalse(self.index.seen('a', 60))
+        self.assertTrue(self.index.seen('b', 60))
+
+    def test_prune(self):
+        index = SentIndex()
+        with mock.patch.object(dedup, 'PRUNE_INTERVAL', 3), \
+                mock.patch.object(dedup, 'MAX_KEYS', 2):
+            for key in 'abc':
+                index.record([key], 60)
+        count, = index._connect().execute(
+            'SELECT count(*) FROM sent').fetchone()
+        self.assertEqual(count, 2)
+        self.assertFalse(index.seen('a', 60))
+
+    def _begin(self, manager, *keys):
+        txn = manager.begin()
+        data_manager = SentKeysDataManager(self.index, 60)
+        for key in keys:
+            self.assertFalse(self.index.seen(key, 60))
+            data_manager.add(key)
+        txn.join(data_manager)
+        return txn
+
+    def test_concurrent(self):
+        first, second = TransactionManager(), TransactionManager()
+        txn1 = self._begin(first, 'a')
+        txn2 = self._begin(second, 'a', 'b')
+        txn1.commit()
+        with self.assertRaises(DuplicateMailError):
+            txn2.commit()
+        txn2.abort()
+        self.assertTrue(self.index.seen('a', 60))
+        # The reservation of the aborted transaction is undone
+        self.assertFalse(self.index.seen('b', 60))
+
+    def test_vote_failed(self):
+        class FailingDataManager(SentKeysDataManager):
+            def sortKey(self):
+                return '~'  # votes after the keys are reserved
+
+            def tpc_vote(self, txn):
+                raise OSError('disk full')
+
+        txn = self._begin(TransactionManager(), 'a')
+        txn.join(FailingDataManager(self.index, 60))
+        with self.assertRaises(OSError):
+            txn.commit()
+        txn.abort()
+        self.assertFalse(self.index.seen('a', 60))
+
+    def test_message_key(self):
+        msg = MIMEText('Body')
+        self.assertEqual(message_key('Body', 'user@example.com'),
+                         message_key('Body', 'user@example.com'))
+        self.assertEqual(message_key(msg, None), message_key(msg, None))
+        self.assertNotEqual(message_key('Body', None),
+                            message_key(b'Body', None))
+        self.assertNotEqual(message_key('Body', ['a', 'b']),
+                            message_key('Body', ['ab']))
+        self.assertNotEqual(message_key('Body', None),
+                            message_key('Body', ''))
+        self.assertNotEqual(message_key(MIMEText('Body')),
+                            message_key(MIMEText('Other body')))
+
+    def test_message_key_multipart(self):
+        msg = MIMEMultipart()
+        msg.attach(MIMEText('Body'))
+        key = message_key(msg)
+        self.assertEqual(message_key(msg), key)
+        self.assertIsNone(msg.get_boundary())
+
+
+class TestMailHostDedup(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(suffix='MailHostTests')
+        self.queue_path = os.path.join(self.tmpdir, 'queue')
+        self.mh = QueueingDummyMailHost('MailHost', self.queue_path)
+        self.mh.smtp_dedup_window = 600.0
+
+    def tearDown(self):
+        transaction.abort()
+        dedup._indexes.clear()
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def _send(self, body='Body', **kw):
+        self.mh.send(body, mto='user@example.com', mfrom='zope@example.com',
+                     **kw)
+
+    def _queued(self):
+        return len(list(Maildir(self.queue_path, True)))
+
+    def test_interface(self):
+        self.assertTrue(verifyObject(IMailHost, self.mh))
+
+    def test_queued(self):
+        self._send()
+        self._send()
+        transaction.commit()
+        self.assertEqual(self._queued(), 1)
+        self._send()
+        self._send('Other body')
+        transaction.commit()
+        self.assertEqual(self._queued(), 2)
+
+    def test_multipart(self):
+        msg = MIMEMultipart()
+        msg['Subject'] = 'Report'
+        msg.attach(MIMEText('Body'))
+        self._send(msg)
+        self._send(msg)
+        transaction.commit()
+        self.assertEqual(self._queued(), 1)
+        self.assertIsNone(msg.get_boundary())
+
+    def test_idempotency_key(self):
+        self._send(idempotency_key='order-1')
+        self._send('Other body', idempotency_key='order-1')
+        self._send(idempotency_key='order-2')
+        transaction.commit()
+        self.assertEqual(self._queued(), 2)
+
+    def test_retried(self):
+        self._send()
+        transaction.abort()
+        self._send()
+        transaction.commit()
+        self.assertEqual(self._queued(), 1)
+
+    def test_send_many(self):
+        self.mh.send_many([('Body', 'user@example.com', 'zope@example.com'),
+                           ('Body', 'user@example.com', 'zope@example.com'),
+                           ('Body', 'other@example.com', 'zope@example.com')])
+        transaction.commit()
+        self.assertEqual(self._queued(), 2)
+
+    def test_render_on_commit(self):
+        self.mh.smtp_render_on_commit = True
+        self._send()
+        self._send()
+        transaction.commit()
+        self.assertEqual(self._queued(), 1)
+
+    def test_disabled(self):
+        self.mh.smtp_dedup_window = 0.0
+        self._send(idempotency_key='order-1')
+        self._send(idempotency_key='order-1')
+        transaction.commit()
+        self.assertEqual(self._queued(), 2)
+
+    def test_immediate(self):
+        mh = DummyMailHost('MailHost')
+        mh.smtp_dedup_window = 600.0
+        sent = []
+        with mock.patch.object(mh, '_send',
+                               side_effect=[OSError('refused'), None,
+                                            None]) as send:
+            with self.assertRaises(OSError):
+                mh.send('Body', mto='user@example.com',
+                        mfrom='zope@example.com', immediate=True)
+            # Mail which failed is sent again
+            for i in range(2):
+                mh.send('Body', mto='user@example.com',
+                        mfrom='zope@example.com', immediate=True)
+            sent = send.call_count
+        self.assertEqual(sent, 2)
@@ -32,16 +32,30 @@ except ModuleNotFoundError:
 
 _MAILHOST_BODY = b"""\
 <?xml version="1.0" encoding="utf-8"?>
-<object name="foo_mailhost" meta_type="Mail Host" smtp_host="localhost"
-   smtp_port="25" smtp_pwd="" smtp_queue="False" smtp_queue_directory="/tmp"
-   smtp_uid=""/>
+<object name="foo_mailhost" meta_type="Mail Host" smtp_async="False"
+   smtp_build_processes="0" smtp_build_threshold="262144"
+   smtp_dedup_window="0.0" smtp_host="localhost" smtp_max_sessions="0"
+   smtp_pool_idle_timeout="60.0" smtp_pool_size="0" smtp_port="25" smtp_pwd=""
+   smtp_queue="False" smtp_queue_backend="maildir" smtp_queue_directory="/tmp"
+   smtp_queue_max_attempts="20" smtp_queue_weighted="False"
+   smtp_queue_workers="1" smtp_rate_limit="0.0" smtp_recipient_batch_size="0"
+   smtp_render_on_commit="False" smtp_stream_threshold="0" smtp_uid=""/>
 """
 
 _MAILHOST_BODY_v2 = b"""\
 <?xml version="1.0" encoding="utf-8"?>
-<object name="foo_mailhost" meta_type="Mail Host" smtp_host="localhost"
-   smtp_port="25" smtp_pwd="" smtp_queue="True"
-   smtp_queue_directory="/tmp/mailqueue" smtp_uid=""/>
+<object name="foo_mailhost" meta_type="Mail Host" smtp_async="True"
+   smtp_build_processes="2" smtp_build_threshold="65536"
+   smtp_dedup_window="600.0" smtp_host="localhost" smtp_max_sessions="3"
+   smtp_pool_idle_timeout="30.0" smtp_pool_size="4" smtp_port="25" smtp_pwd=""
+   smtp_queue="True" smtp_queue_backend="segment"
+   smtp_queue_directory="/tmp/mailqueue" smtp_queue_max_attempts="5"
+   smtp_queue_weighted="True" smtp_queue_workers="4" smtp_rate_limit="2.5"
+   smtp_recipient_batch_size="100" smtp_render_on_commit="True"
+   smtp_stream_threshold="1048576" smtp_uid="">
+ <route>internal example.com,*.example.com relay.example.com:25</route>
+ <route>bulk * bulk.example.net:587 force_tls</route>
+</object>
 """
 
 
@@ -62,6 +76,22 @@ class MailHostXMLAdapterTests(BodyAdapterTestCase, unittest.TestCase):
         self.assertEqual(obj.smtp_uid, '')
         self.assertEqual(obj.smtp_queue, False)
         self.assertEqual(obj.smtp_queue_directory, '/tmp')
+        self.assertEqual(obj.smtp_queue_workers, 1)
+        self.assertEqual(obj.smtp_queue_max_attempts, 20)
+        self.assertEqual(obj.smtp_queue_weighted, False)
+        self.assertEqual(obj.smtp_queue_backend, 'maildir')
+        self.assertEqual(obj.smtp_async, False)
+        self.assertEqual(obj.smtp_render_on_commit, False)
+        self.assertEqual(obj.smtp_dedup_window, 0.0)
+        self.assertEqual(obj.smtp_build_processes, 0)
+        self.assertEqual(obj.smtp_build_threshold, 262144)
+        self.assertEqual(obj.smtp_rate_limit, 0.0)
+        self.assertEqual(obj.smtp_max_sessions, 0)
+        self.assertEqual(obj.smtp_pool_size, 0)
+        self.assertEqual(obj.smtp_pool_idle_timeout, 60.0)
+        self.assertEqual(obj.smtp_recipient_batch_size, 0)
+        self.assertEqual(obj.smtp_stream_threshold, 0)
+        self.assertEqual(obj.smtp_routes, ())
 
     def setUp(self):
         from Products.MailHost.MailHost import MailHost
@@ -99,11 +129,67 @@ class MailHostXMLAdapterTestsWithQueue(BodyAdapterTestCase, unittest.TestCase):
     def _verifyImport(self, obj):
         self.assertEqual(obj.smtp_queue, True)
         self.assertEqual(obj.smtp_queue_directory, '/tmp/mailqueue')
+        self.assertEqual(obj.smtp_queue_workers, 4)
+        self.assertEqual(obj.smtp_queue_max_attempts, 5)
+        self.assertEqual(obj.smtp_queue_weighted, True)
+        self.assertEqual(obj.smtp_queue_backend, 'segment')
+        self.assertEqual(obj.smtp_async, True)
+        self.assertEqual(obj.smtp_render_on_commit, True)
+        self.assertEqual(obj.smtp_dedup_window, 600.0)
+        self.assertEqual(obj.smtp_build_processes, 2)
+        self.assertEqual(obj.smtp_build_threshold, 65536)
+        self.assertEqual(obj.smtp_rate_limit, 2.5)
+        self.assertEqual(obj.smtp_max_sessions, 3)
+        self.assertEqual(obj.smtp_pool_size, 4)
+        self.assertEqual(obj.smtp_pool_idle_timeout, 30.0)
+        self.assertEqual(obj.smtp_recipient_batch_size, 100)
+        self.assertEqual(obj.smtp_stream_threshold, 1048576)
+        self.assertEqual(obj.smtp_routes, (
+            'internal example.com,*.example.com relay.example.com:25',
+            'bulk * bulk.example.net:587 force_tls'))
 
     def test_body_get(self):
         # Default Correctly Handled in MailHostXMLAdapterTests
         pass
 
+    def test_body_set_invalid(self):
+        from Products.GenericSetup.testing import DummySetupEnviron
+
+        # Checked as by manage_makeChanges
+        adapter = self._getTargetClass()(self._obj, DummySetupEnviron())
+        for old, new in ((b'bulk * bulk', b'bulk'),
+                         (b'"segment"', b'"tape"')):
+            with self.assertRaises(ValueError):
+                adapter.body = _MAILHOST_BODY_v2.replace(old, new)
+        # Nothing was changed
+        self.assertEqual(self._obj.smtp_routes, ())
+        self.assertEqual(self._obj.smtp_queue_backend, 'maildir')
+        self.assertEqual(self._obj.smtp_queue_workers, 1)
+        self.assertEqual(self._obj.smtp_pool_size, 0)
+
+    def test_body_set_clamped(self):
+        from Products.GenericSetup.testing import DummySetupEnviron
+
+        adapter = self._getTargetClass()(self._obj, DummySetupEnviron())
+        adapter.body = _MAILHOST_BODY_v2.replace(
+            b'smtp_queue_workers="4"', b'smtp_queue_workers="0"').replace(
+            b'smtp_rate_limit="2.5"', b'smtp_rate_limit="-1"')
+        self.assertEqual(self._obj.smtp_queue_workers, 1)
+        self.assertEqual(self._obj.smtp_rate_limit, 0.0)
+
+    def test_body_set_closes_pool(self):
+        from Products.GenericSetup.testing import DummySetupEnviron
+        from Products.MailHost.pool import connection_pools
+        from Products.MailHost.pool import get_pool
+
+        self._obj.smtp_pool_size = 4
+        old = self._obj._getPoolKey()
+        get_pool(old, 4, 60.0)
+        adapter = self._getTargetClass()(self._obj, DummySetupEnviron())
+        adapter.body = _MAILHOST_BODY_v2.replace(
+            b'smtp_host="localhost"', b'smtp_host="relay.example.org"')
+        self.assertNotIn(old, connection_pools)
+
     def setUp(self):
         from Products.MailHost.MailHost import MailHost
 
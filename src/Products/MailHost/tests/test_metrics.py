@@ -0,0 +1,156 @@
+##############################################################################
+#
+# Copyright (c) 2026 Zope Foundation and Contributors.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+"""Delivery metrics unit tests.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import transaction
+from zope.sendmail.maildir import Maildir
+
+from Products.MailHost import metrics
+from Products.MailHost.MailHost import MailHost
+from Products.MailHost.metrics import MetricsRegistry
+from Products.MailHost.tests.dummy import DummySMTP
+
+
+class DummyResponse:
+
+    def __init__(self):
+        self.headers = {}
+
+    def setHeader(self, name, value):
+        self.headers[name] = value
+
+
+class DummyRequest:
+
+    def __init__(self):
+        self.RESPONSE = DummyResponse()
+
+
+class TestMetricsRegistry(unittest.TestCase):
+
+    def test_counters(self):
+        registry = MetricsRegistry(counters={'a_total': 'A'}, histograms={})
+        registry.inc('a_total')
+        registry.inc('a_total', 2)
+        registry.inc('b_total')
+        self.assertEqual(registry.snapshot(), {'a_total': 3, 'b_total': 1})
+
+    def test_histograms(self):
+        registry = MetricsRegistry(counters={}, histograms={'t_seconds': 'T'})
+        for value in (0.0005, 0.001, 0.3, 100):
+            registry.observe('t_seconds', value)
+        histogram = registry.snapshot()['t_seconds']
+        self.assertEqual(histogram['count'], 4)
+        self.assertAlmostEqual(histogram['sum'], 100.3015)
+        buckets = dict(histogram['buckets'])
+        self.assertEqual(buckets[0.001], 2)
+        self.assertEqual(buckets[0.25], 2)
+        self.assertEqual(buckets[0.5], 3)
+        self.assertEqual(buckets[10.0], 3)
+        self.assertEqual(buckets[float('inf')], 4)
+
+    def test_prometheus(self):
+        registry = MetricsRegistry(counters={'a_total': 'A'},
+                                   histograms={'t_seconds': 'T'})
+        registry.inc('a_total', 5)
+        registry.observe('t_seconds', 0.002)
+        text = registry.prometheus()
+        self.assertIn('# HELP a_total A\n# TYPE a_total counter\n'
+                      'a_total 5\n', text)
+        self.assertIn('# TYPE t_seconds histogram\n', text)
+        self.assertIn('t_seconds_bucket{le="0.001"} 0\n', text)
+        self.assertIn('t_seconds_bucket{le="0.0025"} 1\n', text)
+        self.assertIn('t_seconds_bucket{le="+Inf"} 1\n', text)
+        self.assertIn('t_seconds_sum 0.002\nt_seconds_count 1\n', text)
+
+    def test_reset(self):
+        registry = MetricsRegistry()
+        registry.inc('mailhost_messages_total')
+        registry.observe('mailhost_send_seconds', 1.0)
+        registry.reset()
+        snapshot = registry.snapshot()
+        self.assertEqual(snapshot['mailhost_messages_total'], 0)
+        self.assertEqual(snapshot['mailhost_send_seconds']['count'], 0)
+
+
+class TestMailHostMetrics(unittest.TestCase):
+
+    def setUp(self):
+        transaction.abort()
+        DummySMTP.instances = []
+        self.saved = metrics.get_registry()
+        self.registry = MetricsRegistry()
+        metrics.set_registry(self.registry)
+        self.tmpdir = tempfile.mkdtemp(suffix='MailHostTests')
+        self.queue_path = os.path.join(self.tmpdir, 'queue')
+
+    def tearDown(self):
+        metrics.set_registry(self.saved)
+        transaction.abort()
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def test_timed(self):
+        with metrics.timed('mailhost_send_seconds'):
+            pass
+        self.assertEqual(
+            self.registry.snapshot()['mailhost_send_seconds']['count'], 1)
+
+    def test_immediate_send(self):
+        mh = MailHost('MailHost')
+
+        def makeMailer():
+            mailer = MailHost._makeMailer(mh)
+            mailer.smtp = DummySMTP
+            return mailer
+
+        mh._makeMailer = makeMailer
+        mh.send('Subject: Test\n\nBody', mto='user@example.com',
+                mfrom='me@example.com', immediate=True)
+        snapshot = mh.deliveryMetrics()
+        self.assertEqual(snapshot['mailhost_messages_total'], 1)
+        self.assertEqual(snapshot['mailhost_smtp_sent_total'], 1)
+        self.assertEqual(snapshot['mailhost_smtp_failed_total'], 0)
+        self.assertEqual(snapshot['mailhost_smtp_sent_bytes_total'],
+                         len(DummySMTP.instances[0].sent[0][2]))
+        for name in ('mailhost_send_seconds',
+                     'mailhost_munge_headers_seconds',
+                     'mailhost_as_bytes_seconds',
+                     'mailhost_smtp_connect_seconds',
+                     'mailhost_smtp_data_seconds'):
+            self.assertEqual(snapshot[name]['count'], 1, name)
+
+    def test_queue(self):
+        mh = MailHost('MailHost', smtp_queue=True,
+                      smtp_queue_directory=self.queue_path)
+        mh._startQueueProcessorThread = lambda: None
+        mh.send('Subject: Test\n\nBody', mto='user@example.com',
+                mfrom='me@example.com')
+        transaction.commit()
+        snapshot = mh.deliveryMetrics()
+        self.assertEqual(snapshot['mailhost_queue_written_total'], 1)
+        self.assertEqual(snapshot['mailhost_queue_write_seconds']['count'], 1)
+        self.assertEqual(len(list(Maildir(self.queue_path))), 1)
+
+        request = DummyRequest()
+        text = mh.deliveryMetricsText(request)
+        self.assertEqual(request.RESPONSE.headers['Content-Type'],
+                         'text/plain; version=0.0.4')
+        self.assertIn('mailhost_queue_written_total 1\n', text)
+        self.assertIn('# TYPE mailhost_queue_messages gauge\n', text)
+        self.assertIn('mailhost_queue_messages{state="new"} ', text)
@@ -0,0 +1,210 @@
+##############################################################################
+#
+# Copyright (c) 2026 Zope Foundation and Contributors.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+"""SMTP connection pool unit tests.
+"""
+
+import smtplib
+import unittest
+
+import transaction
+
+from Products.MailHost.MailHost import MailHost
+from Products.MailHost.MailHost import _mungeHeaders
+from Products.MailHost.pool import DataWriter
+from Products.MailHost.pool import SMTPConnectionPool
+from Products.MailHost.pool import connection_pools
+from Products.MailHost.tests.dummy import DummySMTP
+from Products.MailHost.tests.dummy import DummySocket
+
+
+class TestSMTPConnectionPool(unittest.TestCase):
+
+    def setUp(self):
+        transaction.abort()
+        DummySMTP.instances = []
+
+    def tearDown(self):
+        transaction.abort()
+        for pool in connection_pools.values():
+            pool.clear()
+        connection_pools.clear()
+
+    def _makeMailHost(self, **kw):
+        mh = MailHost('mh', smtp_host='relay.example.com', **kw)
+        mh.smtp_pool_size = 2
+        return mh
+
+    def _makeMailer(self, mh):
+        mailer = mh._makeMailer()
+        mailer.smtp = DummySMTP
+        return mailer
+
+    def test_reuses_connection(self):
+        mh = self._makeMailHost()
+        for i in range(3):
+            self._makeMailer(mh).send('a@example.com', ['b@example.com'],
+                                      b'message %d' % i)
+        self.assertEqual(len(DummySMTP.instances), 1)
+        smtp = DummySMTP.instances[0]
+        self.assertEqual(len(smtp.sent), 3)
+        self.assertEqual(smtp.commands.count('ehlo'), 1)
+        self.assertTrue(smtp.alive)
+
+    def test_pool_per_settings(self):
+        self._makeMailer(self._makeMailHost()).send(
+            'a@example.com', ['b@example.com'], b'message')
+        self._makeMailer(self._makeMailHost(smtp_uid='user',
+                                            smtp_pwd='secret')).send(
+            'a@example.com', ['b@example.com'], b'message')
+        self.assertEqual(len(DummySMTP.instances), 2)
+        self.assertEqual(len(connection_pools), 2)
+        self.assertIn('login', DummySMTP.instances[1].commands)
+
+    def test_no_pooling_by_default(self):
+        mh = MailHost('mh')
+        for i in range(2):
+            self._makeMailer(mh).send('a@example.com', ['b@example.com'],
+                                      b'message')
+        self.assertEqual(len(DummySMTP.instances), 2)
+        self.assertFalse(any(smtp.alive for smtp in DummySMTP.instances))
+        self.assertEqual(connection_pools, {})
+
+    def test_reconnect_after_failed_health_check(self):
+        mh = self._makeMailHost()
+        self._makeMailer(mh).send('a@example.com', ['b@example.com'], b'1')
+        DummySMTP.instances[0].alive = False
+        self._makeMailer(mh).send('a@example.com', ['b@example.com'], b'2')
+        self.assertEqual(len(DummySMTP.instances), 2)
+        self.assertEqual(DummySMTP.instances[1].sent[0][2], b'2')
+
+    def test_idle_timeout(self):
+        mh = self._makeMailHost()
+        mh.smtp_pool_idle_timeout = -1
+        self._makeMailer(mh).send('a@example.com', ['b@example.com'], b'1')
+        self._makeMailer(mh).send('a@example.com', ['b@example.com'], b'2')
+        self.assertEqual(len(DummySMTP.instances), 2)
+        self.assertNotIn('noop', DummySMTP.instances[0].commands)
+
+    def test_disconnect_during_send_discards_connection(self):
+        mh = self._makeMailHost()
+        mailer = self._makeMailer(mh)
+        mailer.vote('a@example.com', ['b@example.com'], b'1')
+        mailer.connection.alive = False
+        with self.assertRaises(smtplib.SMTPServerDisconnected):
+            mailer.send('a@example.com', ['b@example.com'], b'1')
+        self.assertEqual(len(connection_pools[mh._getPoolKey()]), 0)
+
+    def test_abort_resets_and_returns_connection(self):
+        mh = self._makeMailHost()
+        mailer = self._makeMailer(mh)
+        mailer.vote('a@example.com', ['b@example.com'], b'1')
+        mailer.abort()
+        self.assertIsNone(mailer.connection)
+        self.assertEqual(DummySMTP.instances[0].commands[-1], 'rset')
+        self.assertEqual(len(connection_pools[mh._getPoolKey()]), 1)
+
+    def test_max_size(self):
+        pool = SMTPConnectionPool(max_size=1)
+        first, second = DummySMTP(), DummySMTP()
+        pool.release(first)
+        pool.release(second)
+        self.assertEqual(len(pool), 1)
+        self.assertTrue(first.alive)
+        self.assertFalse(second.alive)
+
+    def test_manage_makeChanges_closes_old_pool(self):
+        mh = self._makeMailHost()
+        self._makeMailer(mh).send('a@example.com', ['b@example.com'], b'1')
+        mh.manage_makeChanges(title='', smtp_host='other.example.com',
+                              smtp_port=25, smtp_pool_size=2)
+        self.assertEqual(connection_pools, {})
+        self.assertFalse(DummySMTP.instances[0].alive)
+
+    def test_send_many_uses_one_session(self):
+        mh = MailHost('mh')
+        mh._makeMailer = lambda: self._makeMailer(MailHost('mh'))
+        mh.send_many([('Message %d' % i, 'user@example.com',
+                       'zope@example.com', 'Hello world')
+                      for i in range(3)], immediate=True)
+        self.assertEqual(len(DummySMTP.instances), 1)
+        self.assertEqual(len(DummySMTP.instances[0].sent), 3)
+
+    def test_send_many_direct_delivery(self):
+        mh = MailHost('mh')
+        mh._makeMailer = lambda: self._makeMailer(MailHost('mh'))
+        mh.send_many([('Message %d' % i, 'user@example.com',
+                       'zope@example.com', 'Hello world')
+                      for i in range(3)])
+        self.assertEqual(DummySMTP.instances, [])
+        transaction.commit()
+        self.assertEqual(len(DummySMTP.instances), 1)
+        sent = DummySMTP.instances[0].sent
+        self.assertEqual(len(sent), 3)
+        self.assertTrue(all(message.startswith(b'Message-Id: <')
+                            for fromaddr, toaddrs, message in sent))
+        self.assertFalse(DummySMTP.instances[0].alive)
+
+    def test_streaming_large_message(self):
+        msg = ('From: sender@example.com\n'
+               'To: user@example.com\n'
+               'Subject: Large\n'
+               'Date: Sun, 27 Aug 2006 17:00:00 +0200\n'
+               '\n'
+               '.leading period\n' + 'x' * 2048 + '\n')
+        mh = MailHost('mh')
+        mh.smtp_stream_threshold = 1024
+        mh._makeMailer = lambda: self._makeMailer(MailHost('mh'))
+        mh.send(msg, immediate=True)
+        smtp = DummySMTP.instances[0]
+        self.assertNotIn('sendmail', smtp.commands)
+        self.assertIn('data', smtp.commands)
+        fromaddr, toaddrs, data = smtp.sent[0]
+        self.assertEqual(fromaddr, 'sender@example.com')
+        self.assertEqual(toaddrs, ['user@example.com'])
+        expected = _mungeHeaders(msg)[0].replace(b'\r\n.', b'\r\n..')
+        self.assertEqual(data, expected + b'.\r\n')
+
+    def test_personalized_messages_are_not_copied(self):
+        mh = MailHost('mh')
+        mh._makeMailer = lambda: self._makeMailer(MailHost('mh'))
+        mh.send('Subject: Hi\n\nBody', mto=['a@example.com', 'b@example.com'],
+                mfrom='sender@example.com', personalize=True, immediate=True)
+        smtp = DummySMTP.instances[0]
+        self.assertNotIn('sendmail', smtp.commands)
+        (_, mto1, data1), (_, mto2, data2) = smtp.sent
+        self.assertEqual((mto1, mto2), (['a@example.com'], ['b@example.com']))
+        self.assertTrue(data1.startswith(b'To: a@example.com\r\n'))
+        self.assertTrue(data2.startswith(b'To: b@example.com\r\n'))
+        self.assertEqual(data1.split(b'\r\n', 1)[1],
+                         data2.split(b'\r\n', 1)[1])
+        self.assertTrue(data1.endswith(b'\r\nBody\r\n.\r\n'))
+
+
+class TestDataWriter(unittest.TestCase):
+
+    def test_line_endings_and_periods(self):
+        sock = DummySocket()
+        writer = DataWriter(sock)
+        for chunk in (b'a\r', b'\n.b\n', b'.c', b'\rd'):
+            writer.write(chunk)
+        self.assertEqual(sock.data, b'')
+        writer.close()
+        self.assertEqual(sock.data, b'a\r\n..b\r\n..c\r\nd\r\n.\r\n')
+
+    def test_flushes_when_buffer_is_full(self):
+        sock = DummySocket()
+        writer = DataWriter(sock, bufsize=4)
+        writer.write(b'abc\r\n')
+        self.assertEqual(sock.data, b'abc\r\n')
+        writer.close()
+        self.assertEqual(sock.data, b'abc\r\n.\r\n')
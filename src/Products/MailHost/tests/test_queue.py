@@ -0,0 +1,788 @@
+##############################################################################
+#
+# Copyright (c) 2026 Zope Foundation and Contributors.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+"""Mail queue processing unit tests.
+"""
+
+import json
+import os
+import shutil
+import smtplib
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+import transaction
+from zope.interface.verify import verifyObject
+from zope.sendmail.maildir import Maildir
+
+from Products.MailHost import queue
+from Products.MailHost.delivery import BatchDataManager
+from Products.MailHost.delivery import QueueDataManager
+from Products.MailHost.delivery import QueuedMailBatchDelivery
+from Products.MailHost.interfaces import IQueueStorage
+from Products.MailHost.MailHost import MailHost
+from Products.MailHost.queue import ProcessorRegistry
+from Products.MailHost.queue import QueueProcessorGroup
+from Products.MailHost.queue import QueueWorkerThread
+from Products.MailHost.queue import lane_directory
+from Products.MailHost.queue import make_queue_processor
+from Products.MailHost.queue import queue_statistics
+from Products.MailHost.storage import get_queue
+
+
+class DummyMailer:
+
+    def __init__(self, sent):
+        self.sent = sent
+
+    def send(self, fromaddr, toaddrs, message):
+        self.sent.append(message)
+
+
+class FlakyMailer(DummyMailer):
+    """ Cannot reach the mail servers of example.org """
+
+    def __init__(self, sent):
+        self.sent = sent
+        self.attempts = []
+
+    def send(self, fromaddr, toaddrs, message):
+        self.attempts.append(message)
+        if toaddrs[0].endswith('@example.org'):
+            raise smtplib.SMTPServerDisconnected('Connection timed out')
+        self.sent.append(message)
+
+
+class TestQueueWorkers(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(suffix='MailHostTests')
+        self.queue_path = os.path.join(self.tmpdir, 'queue')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def _queueMessages(self, count):
+        maildir = Maildir(self.queue_path, True)
+        for i in range(count):
+            msg = maildir.newMessage()
+            msg.write(b'X-Zope-From: zope@example.com\n'
+                      b'X-Zope-To: user@example.com\n'
+                      b'Subject: %d\n\nbody' % i)
+            msg.commit()
+
+    def test_make_queue_processor(self):
+        sent = []
+        group = make_queue_processor(lambda: DummyMailer(sent),
+                                     self.queue_path, 3)
+        self.assertIsInstance(group, QueueProcessorGroup)
+        self.assertEqual([worker.index for worker in group.workers],
+                         [0, 1, 2])
+        self.assertEqual(len({id(worker.mailer) for worker in group.workers}),
+                         3)
+        self.assertFalse(group.is_alive())
+
+    def test_workers_partition_queue(self):
+        self._queueMessages(20)
+        sent = []
+        group = make_queue_processor(lambda: DummyMailer(sent),
+                                     self.queue_path, 3)
+        per_worker = []
+        for worker in group.workers:
+            before = len(sent)
+            worker.run(forever=False)
+            per_worker.append(len(sent) - before)
+        self.assertEqual(sorted(sent),
+                         sorted(b'Subject: %d\n\nbody' % i
+                                for i in range(20)))
+        self.assertEqual(sum(per_worker), 20)
+        self.assertEqual(list(Maildir(self.queue_path)), [])
+
+
+class TestRetries(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(suffix='MailHostTests')
+        self.queue_path = os.path.join(self.tmpdir, 'queue')
+        self.maildir = Maildir(self.queue_path, True)
+        self.sent = []
+        self.mailer = FlakyMailer(self.sent)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def _queueMessage(self, toaddr, body):
+        msg = self.maildir.newMessage()
+        msg.write(b'X-Zope-From: zope@example.com\n'
+                  b'X-Zope-To: %s\n%s' % (toaddr.encode(), body))
+        msg.commit()
+        return msg._new_filename
+
+    def _run(self, max_attempts=queue.MAX_ATTEMPTS):
+        group = make_queue_processor(lambda: self.mailer, self.queue_path,
+                                     max_attempts=max_attempts)
+        group.workers[0].run(forever=False)
+
+    def _retryState(self, filename):
+        head, tail = os.path.split(filename)
+        with open(os.path.join(head, '.retry-' + tail)) as f:
+            return json.load(f)
+
+    def test_backoff(self):
+        filename = self._queueMessage('user@example.org', b'1')
+        self._run()
+        self.assertEqual(self.mailer.attempts, [b'1'])
+        state = self._retryState(filename)
+        self.assertEqual(state['attempts'], 1)
+        self.assertEqual(state['destination'], 'example.org')
+        self.assertGreater(state['next'], time.time() + 50)
+        self.assertEqual(sorted(os.listdir(os.path.dirname(filename))),
+                         ['.retry-' + os.path.basename(filename),
+                          os.path.basename(filename)])
+        self.assertEqual(queue_statistics(self.queue_path, max_age=0),
+                         {'new': 0, 'sending': 0, 'deferred': 1, 'failed': 0,
+                          'dead': 0})
+        # Not due yet
+        self._run()
+        self.assertEqual(self.mailer.attempts, [b'1'])
+
+        queue._write_retry_state(filename, dict(state, next=0))
+        self._run()
+        self.assertEqual(self.mailer.attempts, [b'1', b'1'])
+        state = self._retryState(filename)
+        self.assertEqual(state['attempts'], 2)
+        self.assertGreater(state['next'], time.time() + 110)
+
+    def test_sent_after_retry(self):
+        filename = self._queueMessage('user@example.org', b'1')
+        with mock.patch.object(queue, 'RETRY_DELAY', 0.0):
+            self._run()
+            self.mailer.send = DummyMailer(self.sent).send
+            self._run()
+        self.assertEqual(self.sent, [b'1'])
+        self.assertEqual(os.listdir(os.path.dirname(filename)), [])
+
+    def test_dead_letters(self):
+        filename = self._queueMessage('user@example.org', b'1')
+        with mock.patch.object(queue, 'RETRY_DELAY', 0.0):
+            for i in range(3):
+                self._run(max_attempts=2)
+        self.assertEqual(self.mailer.attempts, [b'1', b'1'])
+        dead = os.path.join(self.queue_path, 'dead')
+        self.assertEqual(sorted(os.listdir(dead)),
+                         ['.retry-' + os.path.basename(filename),
+                          os.path.basename(filename)])
+        self.assertEqual(os.listdir(os.path.dirname(filename)), [])
+        self.assertEqual(queue_statistics(self.queue_path, max_age=0),
+                         {'new': 0, 'sending': 0, 'deferred': 0, 'failed': 0,
+                          'dead': 1})
+
+    def test_fair_ordering(self):
+        for i in range(3):
+            self._queueMessage('user@example.org', b'org %d' % i)
+            self._queueMessage('user@example.com', b'com %d' % i)
+        self._run()
+        # One failure puts the other messages to example.org off
+        self.assertEqual(len(self.mailer.attempts), 4)
+        self.assertEqual(sorted(self.sent), [b'com 0', b'com 1', b'com 2'])
+        self.assertEqual(queue_statistics(self.queue_path, max_age=0),
+                         {'new': 2, 'sending': 0, 'deferred': 1, 'failed': 0,
+                          'dead': 0})
+
+    def test_destinations_kept(self):
+        first = self._queueMessage('user@example.org', b'org 0')
+        second = self._queueMessage('user@example.org', b'org 1')
+        worker = make_queue_processor(lambda: self.mailer,
+                                      self.queue_path).workers[0]
+        with mock.patch.object(worker, '_destination',
+                               wraps=worker._destination) as read:
+            worker.run(forever=False)
+            worker.run(forever=False)
+        # Each message was read for its destination once
+        self.assertEqual(sorted(args for args, kw in read.call_args_list),
+                         sorted([(first, ), (second, )]))
+        # Messages gone are forgotten
+        os.unlink(second)
+        worker.run(forever=False)
+        self.assertEqual(list(worker._destinations[self.queue_path]),
+                         [first])
+
+    def test_permanent_error(self):
+        filename = self._queueMessage('user@example.com', b'1')
+
+        def reject(fromaddr, toaddrs, message):
+            raise smtplib.SMTPRecipientsRefused({toaddrs[0]: (550, b'')})
+
+        self.mailer.send = reject
+        self._run()
+        self.assertEqual(os.listdir(os.path.dirname(filename)),
+                         ['.rejected-' + os.path.basename(filename)])
+
+
+class TestPriorityLanes(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(suffix='MailHostTests')
+        self.queue_path = os.path.join(self.tmpdir, 'queue')
+        self.sent = []
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def _makeProcessor(self, weighted=False):
+        group = make_queue_processor(lambda: DummyMailer(self.sent),
+                                     self.queue_path, weighted=weighted)
+        return group.workers[0]
+
+    def _queueMessages(self, priority, count):
+        maildir = Maildir(lane_directory(self.queue_path, priority))
+        for i in range(count):
+            msg = maildir.newMessage()
+            msg.write(b'X-Zope-From: zope@example.com\n'
+                      b'X-Zope-To: user%d@example.com\n%s %d'
+                      % (i, priority.encode(), i))
+            msg.commit()
+            # Older messages come first within a lane
+            os.utime(msg._new_filename, (i, i))
+
+    def test_lane_directory(self):
+        self.assertEqual(lane_directory('/queue'), '/queue')
+        self.assertEqual(lane_directory('/queue', 'normal'), '/queue')
+        self.assertEqual(lane_directory('/queue', 'high'),
+                         os.path.join('/queue', 'lane-high'))
+        with self.assertRaises(ValueError):
+            lane_directory('/queue', 'urgent')
+
+    def test_strict(self):
+        worker = self._makeProcessor()
+        self._queueMessages('low', 2)
+        self._queueMessages('normal', 2)
+        self._queueMessages('high', 2)
+        self.assertEqual(queue_statistics(self.queue_path, max_age=0)['new'],
+                         6)
+        worker.run(forever=False)
+        self.assertEqual(self.sent, [b'high 0', b'high 1', b'normal 0',
+                                     b'normal 1', b'low 0', b'low 1'])
+
+    def test_high_priority_overtakes(self):
+        worker = self._makeProcessor()
+        self._queueMessages('normal', 3)
+        send = worker.mailer.send
+
+        def send_and_queue(fromaddr, toaddrs, message):
+            send(fromaddr, toaddrs, message)
+            if message == b'normal 0':
+                self._queueMessages('high', 1)
+
+        worker.mailer.send = send_and_queue
+        worker.run(forever=False)
+        self.assertEqual(self.sent, [b'normal 0', b'high 0', b'normal 1',
+                                     b'normal 2'])
+
+    def test_weighted(self):
+        worker = self._makeProcessor(weighted=True)
+        self._queueMessages('low', 2)
+        self._queueMessages('normal', 4)
+        self._queueMessages('high', 4)
+        with mock.patch.object(queue, 'LANE_WEIGHTS', (2, 1, 1)):
+            worker.run(forever=False)
+        self.assertEqual([message.split()[0] for message in self.sent],
+                         [b'high', b'high', b'normal', b'low',
+                          b'high', b'high', b'normal', b'low',
+                          b'normal', b'normal'])
+
+
+class TestQueueDataManager(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(suffix='MailHostTests')
+        self.queue_path = os.path.join(self.tmpdir, 'queue')
+        transaction.begin()
+
+    def tearDown(self):
+        transaction.abort()
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def _send(self, count):
+        delivery = QueuedMailBatchDelivery(self.queue_path)
+        for i in range(count):
+            delivery.send('zope@example.com', ['user@example.com'],
+                          b'Subject: %d\n\nbody' % i)
+
+    def _listdir(self, subdir):
+        return os.listdir(os.path.join(self.queue_path, subdir))
+
+    def test_one_data_manager_per_transaction(self):
+        self._send(3)
+        QueuedMailBatchDelivery(self.queue_path).sendMany(
+            [('zope@example.com', ['user@example.com'], b'Subject: 3\n\n')])
+        resources = transaction.get()._resources
+        self.assertEqual(len(resources), 1)
+        self.assertIsInstance(resources[0], QueueDataManager)
+        self.assertEqual(len(resources[0].messages), 4)
+        self.assertEqual(self._listdir('tmp'), [])
+
+    def test_grouped_fsync(self):
+        self._send(5)
+        with mock.patch('os.fsync') as fsync:
+            transaction.commit()
+        # One for each message file and one for the ``new`` folder
+        self.assertEqual(fsync.call_count, 6)
+        self.assertEqual(len(self._listdir('new')), 5)
+        self.assertEqual(self._listdir('tmp'), [])
+
+    def test_abort(self):
+        self._send(2)
+        transaction.abort()
+        self.assertEqual(self._listdir('new'), [])
+        self.assertEqual(self._listdir('tmp'), [])
+
+    def test_abort_after_vote(self):
+        self._send(2)
+
+        class FailingDataManager(QueueDataManager):
+            def sortKey(self):
+                return '~'  # votes after the queue
+
+            def tpc_vote(self, txn):
+                raise OSError('No space left on device')
+
+        transaction.get().join(FailingDataManager(None))
+        with self.assertRaises(OSError):
+            transaction.commit()
+        transaction.abort()
+        self.assertEqual(self._listdir('new'), [])
+        self.assertEqual(self._listdir('tmp'), [])
+
+    def test_finish_failed(self):
+        self._send(3)
+        rename = os.rename
+        renamed = []
+
+        def flaky_rename(src, dst):
+            renamed.append(src)
+            if len(renamed) == 1:
+                raise OSError('Input/output error')
+            rename(src, dst)
+
+        with mock.patch('os.rename', side_effect=flaky_rename), \
+                self.assertLogs('MailHost', 'ERROR'):
+            transaction.commit()
+        # The messages after the one which failed are queued
+        self.assertEqual(len(self._listdir('new')), 2)
+        self.assertEqual(self._listdir('tmp'),
+                         [os.path.basename(renamed[0])])
+
+    def test_savepoint(self):
+        self._send(1)
+        savepoint = transaction.savepoint()
+        self._send(2)
+        savepoint.rollback()
+        transaction.commit()
+        self.assertEqual(len(self._listdir('new')), 1)
+
+
+class DummyProcessor:
+
+    def __init__(self, stopping=None):
+        self.alive = False
+        self.stopping = stopping
+
+    def start(self):
+        self.alive = True
+
+    def halt(self):
+        if self.stopping is None:
+            self.alive = False
+
+    def is_alive(self):
+        return self.alive
+
+    def join(self, timeout=None):
+        if self.stopping is not None and self.stopping.wait(timeout):
+            self.alive = False
+
+
+class TestProcessorRegistry(unittest.TestCase):
+
+    def test_start_once(self):
+        registry = ProcessorRegistry()
+        made = []
+
+        def factory():
+            time.sleep(0.01)
+            made.append(DummyProcessor())
+            return made[-1]
+
+        threads = [threading.Thread(target=registry.start,
+                                    args=('queue', factory))
+                   for i in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(made), 1)
+        self.assertIs(registry.get('queue'), made[0])
+        self.assertFalse(registry.start('queue', factory))
+        # A processor which died is replaced
+        made[0].alive = False
+        self.assertTrue(registry.start('queue', factory))
+        self.assertEqual(len(made), 2)
+
+    def test_stop_does_not_block_other_keys(self):
+        registry = ProcessorRegistry()
+        stopping = threading.Event()
+        registry.start('slow', lambda: DummyProcessor(stopping))
+        stopper = threading.Thread(target=registry.stop, args=('slow', ))
+        stopper.start()
+        try:
+            self.assertTrue(registry.start('other', DummyProcessor))
+            self.assertTrue(stopper.is_alive())
+        finally:
+            stopping.set()
+            stopper.join()
+        self.assertNotIn('slow', registry)
+        self.assertEqual(registry.keys(), ['other'])
+
+    def test_stop_timeout(self):
+        registry = ProcessorRegistry()
+        registry.start('slow', lambda: DummyProcessor(threading.Event()))
+        start = time.monotonic()
+        self.assertFalse(registry.stop('slow', timeout=0.1))
+        self.assertLess(time.monotonic() - start, 1.0)
+        self.assertNotIn('slow', registry)
+
+    def test_stop_wakes_up_workers(self):
+        tmpdir = tempfile.mkdtemp(suffix='MailHostTests')
+        self.addCleanup(shutil.rmtree, tmpdir, ignore_errors=True)
+        worker = QueueWorkerThread(interval=60.0)
+        worker.setMailer(DummyMailer([]))
+        worker.setQueuePath(os.path.join(tmpdir, 'queue'))
+        registry = ProcessorRegistry()
+        registry.start('queue', lambda: QueueProcessorGroup([worker]))
+        time.sleep(0.05)  # let the worker go to sleep
+        start = time.monotonic()
+        self.assertTrue(registry.stop('queue', timeout=5.0))
+        self.assertLess(time.monotonic() - start, 5.0)
+        self.assertFalse(worker.is_alive())
+        self.assertTrue(registry.stop('queue'))
+
+    def test_shutdown(self):
+        tmpdir = tempfile.mkdtemp(suffix='MailHostTests')
+        self.addCleanup(shutil.rmtree, tmpdir, ignore_errors=True)
+        worker = QueueWorkerThread(interval=60.0)
+        worker.setMailer(DummyMailer([]))
+        worker.setQueuePath(os.path.join(tmpdir, 'queue'))
+        registry = ProcessorRegistry()
+        registry.start('queue', lambda: QueueProcessorGroup([worker]))
+        registry.start('stuck', lambda: DummyProcessor(threading.Event()))
+        start = time.monotonic()
+        self.assertEqual(registry.shutdown(timeout=0.5), ['stuck'])
+        self.assertLess(time.monotonic() - start, 5.0)
+        self.assertFalse(worker.is_alive())
+        self.assertEqual(registry.keys(), [])
+        # No processors are started after the shutdown
+        self.assertFalse(registry.start('queue', DummyProcessor))
+        self.assertNotIn('queue', registry)
+
+
+class TestQueueStatistics(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(suffix='MailHostTests')
+        self.queue_path = os.path.join(self.tmpdir, 'queue')
+        Maildir(self.queue_path, True)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def _touch(self, subdir, name):
+        with open(os.path.join(self.queue_path, subdir, name), 'w'):
+            pass
+
+    def test_counts(self):
+        for name in ('1', '2', '3'):
+            self._touch('new', name)
+        self._touch('cur', '4')
+        self._touch('cur', '.sending-4')
+        self._touch('cur', '.rejected-5')
+        self._touch('tmp', '6')
+        self._touch('new', '.retry-3')
+        os.mkdir(os.path.join(self.queue_path, 'dead'))
+        self._touch('dead', '7')
+        self._touch('dead', '.retry-7')
+        self.assertEqual(queue_statistics(self.queue_path, max_age=0),
+                         {'new': 2, 'sending': 1, 'deferred': 1, 'failed': 1,
+                          'dead': 1})
+
+    def test_retry_being_sent(self):
+        for name in ('1', '2', '3'):
+            self._touch('new', name)
+        self._touch('new', '.retry-1')
+        self._touch('new', '.sending-1')
+        self._touch('new', '.retry-2')
+        # A message retried while it is sent is only counted as sending
+        self.assertEqual(queue_statistics(self.queue_path, max_age=0),
+                         {'new': 1, 'sending': 1, 'deferred': 1, 'failed': 0,
+                          'dead': 0})
+
+    def test_cached(self):
+        self.assertEqual(queue_statistics(self.queue_path)['new'], 0)
+        self._touch('new', '1')
+        self.assertEqual(queue_statistics(self.queue_path)['new'], 0)
+        self.assertEqual(queue_statistics(self.queue_path, max_age=0)['new'],
+                         1)
+
+    def test_not_a_maildir(self):
+        with self.assertRaises(ValueError):
+            queue_statistics(os.path.join(self.tmpdir, 'missing'))
+
+
+EMPTY = {'new': 0, 'sending': 0, 'deferred': 0, 'failed': 0, 'dead': 0}
+
+
+class QueueStorageTests:
+    """ Tests shared by the queue storages, see test_segment and test_sqlite.
+
+    Subclasses set the ``storage`` module and its ``queue_class``, and
+    implement ``_make_due`` for their storage.
+    """
+
+    storage = None
+    queue_class = None
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(suffix='MailHostTests')
+        self.queue_path = os.path.join(self.tmpdir, 'queue')
+        self.queue = self.queue_class(self.queue_path)
+        transaction.begin()
+
+    def tearDown(self):
+        transaction.abort()
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def _send(self, count, toaddr='user@example.com', priority=None):
+        delivery = self.queue.delivery(priority)
+        delivery.sendMany([('zope@example.com', [toaddr],
+                            b'Subject: %d\n\nbody' % i)
+                           for i in range(count)])
+
+    def _run(self, mailer, **kw):
+        processor = self.queue.processor(lambda: mailer, **kw)
+        for worker in processor.workers:
+            worker.run(forever=False)
+
+    def _make_due(self):
+        """ Make the deferred messages due for sending now. """
+        raise NotImplementedError
+
+    def test_interface(self):
+        verifyObject(IQueueStorage, self.queue)
+
+    def test_get_queue(self):
+        backend = self.queue_class.backend
+        queue = get_queue(self.queue_path, backend)
+        self.assertIsInstance(queue, self.queue_class)
+        self.assertIs(get_queue(self.queue_path, backend), queue)
+
+    def test_commit(self):
+        self._send(3)
+        with self.assertRaises(ValueError):
+            self.queue.statistics()
+        transaction.commit()
+        self.assertEqual(self.queue.statistics(), dict(EMPTY, new=3))
+        # Another process sees the messages
+        entries = self.queue_class(self.queue_path).claim()
+        self.assertEqual([entry.toaddrs for entry in entries],
+                         [['user@example.com']] * 3)
+        self.assertTrue(self.queue.read(entries[0]).endswith(
+            b'Subject: 0\n\nbody'))
+
+    def test_abort(self):
+        self._send(2)
+        transaction.abort()
+        self._send(1)
+        transaction.commit()
+        self.assertEqual(self.queue.statistics(), dict(EMPTY, new=1))
+
+    def test_abort_after_vote(self):
+        self._send(2)
+
+        class FailingDataManager(BatchDataManager):
+            def sortKey(self):
+                return '~'  # votes after the queue
+
+            def tpc_vote(self, txn):
+                raise OSError('No space left on device')
+
+        transaction.get().join(FailingDataManager())
+        with self.assertRaises(OSError):
+            transaction.commit()
+        transaction.abort()
+        self.assertEqual(self.queue.statistics(), EMPTY)
+        self.assertEqual(self.queue.claim(), [])
+
+    def test_savepoint(self):
+        self._send(1)
+        savepoint = transaction.savepoint()
+        self._send(2)
+        savepoint.rollback()
+        transaction.commit()
+        self.assertEqual(self.queue.statistics()['new'], 1)
+
+    def test_process(self):
+        self._send(5)
+        transaction.commit()
+        sent = []
+        self._run(DummyMailer(sent), count=2)
+        self.assertEqual(sorted(message.split(b'\n', 1)[1]
+                                for message in sent),
+                         [b'Subject: %d\n\nbody' % i for i in range(5)])
+        self.assertEqual(self.queue.statistics(), EMPTY)
+
+    def test_claim_once(self):
+        self._send(3)
+        transaction.commit()
+        self.assertEqual(len(self.queue.claim(2)), 2)
+        # Other processes skip the claimed messages
+        other = self.queue_class(self.queue_path)
+        self.assertEqual(len(other.claim()), 1)
+        self.assertEqual(other.claim(), [])
+        self.assertEqual(other.statistics(), dict(EMPTY, sending=3))
+
+    def test_claim_stale(self):
+        self._send(1)
+        transaction.commit()
+        self.assertEqual(len(self.queue.claim()), 1)
+        other = self.queue_class(self.queue_path)
+        self.assertEqual(other.claim(), [])
+        # The claim of a process which did not finish is given up
+        with mock.patch.object(self.storage, 'MAX_SEND_TIME', -1):
+            self.assertEqual(len(other.claim()), 1)
+
+    def test_priorities(self):
+        self._send(2, priority='low')
+        self._send(1)
+        self._send(1, priority='high')
+        with self.assertRaises(ValueError):
+            self.queue.delivery('urgent')
+        transaction.commit()
+        entries = self.queue.claim()
+        self.assertEqual([entry.priority for entry in entries],
+                         ['high', 'normal', 'low', 'low'])
+        self.queue.release(entries)
+        self.assertEqual(len(self.queue.claim(2)), 2)
+        self.assertEqual(self.queue.statistics(),
+                         dict(EMPTY, new=2, sending=2))
+
+    def test_weighted(self):
+        self._send(10, priority='high')
+        self._send(10, priority='low')
+        transaction.commit()
+        entries = self.queue.claim(weighted=True)
+        self.assertEqual([entry.priority for entry in entries[:12]],
+                         ['high'] * 8 + ['low'] + ['high'] * 2 + ['low'])
+
+    def test_destinations_take_turns(self):
+        self._send(3, toaddr='user@example.com')
+        self._send(2, toaddr='user@example.org')
+        transaction.commit()
+        self.assertEqual([entry.destination for entry in self.queue.claim()],
+                         ['example.com', 'example.org', 'example.com',
+                          'example.org', 'example.com'])
+        self.assertEqual(
+            [entry.destination for entry in self.queue.claim(
+                skip=('example.com', ))], [])
+
+    def test_retries(self):
+        self._send(1, toaddr='user@example.org')
+        self._send(1, toaddr='user@example.com')
+        transaction.commit()
+        sent = []
+        mailer = FlakyMailer(sent)
+        self._run(mailer, max_attempts=2)
+        self.assertEqual(len(sent), 1)
+        self.assertEqual(self.queue.statistics(), dict(EMPTY, deferred=1))
+        # Not due yet
+        self._run(mailer, max_attempts=2)
+        self.assertEqual(len(mailer.attempts), 2)
+        self._make_due()
+        self._run(mailer, max_attempts=2)
+        self.assertEqual(len(mailer.attempts), 3)
+        self.assertEqual(self.queue.statistics(), dict(EMPTY, dead=1))
+
+    def test_storage_errors(self):
+        self._send(2)
+        transaction.commit()
+        sent = []
+        processor = self.queue.processor(lambda: DummyMailer(sent))
+        worker, = processor.workers
+        with mock.patch.object(self.queue, 'claim',
+                               side_effect=OSError('Disk failure')):
+            # Logged, the worker goes on
+            worker.run(forever=False)
+        self.assertEqual(sent, [])
+        finish = self.queue.finish
+        failures = [OSError('Disk full')]
+
+        def flaky_finish(entry, state, **kw):
+            if failures:
+                raise failures.pop()
+            finish(entry, state, **kw)
+
+        with mock.patch.object(self.queue, 'finish', flaky_finish):
+            worker.run(forever=False)
+        # Recording the sent mail is retried, it is not sent again
+        self.assertEqual(len(sent), 2)
+        self.assertEqual(failures, [])
+        self.assertEqual(worker._unrecorded, [])
+        self.assertEqual(self.queue.statistics(), EMPTY)
+
+
+class MailHostQueueStorageTests:
+    """ MailHost tests shared by the queue storages.
+
+    Subclasses set the ``backend`` and the ``queue_file`` it creates.
+    """
+
+    backend = None
+    queue_file = None
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(suffix='MailHostTests')
+        self.queue_path = os.path.join(self.tmpdir, 'queue')
+        self.mh = MailHost('MailHost')
+        self.mh.manage_makeChanges('', 'localhost', 25, smtp_queue=True,
+                                   smtp_queue_directory=self.queue_path,
+                                   smtp_queue_backend=self.backend)
+
+    def tearDown(self):
+        transaction.abort()
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def test_send(self):
+        os.environ['MAILHOST_QUEUE_ONLY'] = '1'
+        try:
+            self.mh.send('Subject: Hi\n\nBody', mto='user@example.com',
+                         mfrom='zope@example.com')
+            self.mh.send('Subject: Hi\n\nBody', mto='user@example.com',
+                         mfrom='zope@example.com', priority='high')
+        finally:
+            del os.environ['MAILHOST_QUEUE_ONLY']
+        transaction.commit()
+        self.assertEqual(self.mh.queueStatistics(), dict(EMPTY, new=2))
+        self.assertEqual(self.mh.queueLength(), 2)
+        self.assertTrue(os.path.isfile(os.path.join(self.queue_path,
+                                                    self.queue_file)))
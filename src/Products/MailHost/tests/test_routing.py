@@ -0,0 +1,172 @@
+##############################################################################
+#
+# Copyright (c) 2026 Zope Foundation and Contributors.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+"""Delivery routing unit tests.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import transaction
+from zope.sendmail.maildir import Maildir
+
+from Products.MailHost.MailHost import MailHost
+from Products.MailHost.MailHost import queue_threads
+from Products.MailHost.pool import PooledSMTPMailer
+from Products.MailHost.pool import connection_pools
+from Products.MailHost.routing import Route
+from Products.MailHost.routing import find_route
+from Products.MailHost.routing import parse_route
+from Products.MailHost.routing import parse_routes
+from Products.MailHost.routing import route_envelopes
+from Products.MailHost.tests.dummy import DummySMTP
+
+
+ROUTES = (
+    'internal  example.com,*.example.com  relay.example.com',
+    'bulk  *.example.net  bulk.example.net:587 uid=mailer pwd=secret',
+)
+
+
+class TestRoutes(unittest.TestCase):
+
+    def test_parse_route(self):
+        self.assertEqual(parse_route(ROUTES[0]),
+                         Route('internal', ['example.com', '*.example.com'],
+                               'relay.example.com'))
+        route = parse_route(ROUTES[1])
+        self.assertEqual(route.name, 'bulk')
+        self.assertEqual(route.settings(),
+                         ('bulk.example.net', 587, 'mailer', 'secret', False,
+                          False))
+        self.assertEqual(parse_route('tls * localhost force_tls').settings(),
+                         ('localhost', 25, None, None, True, False))
+        self.assertEqual(
+            parse_route('ssl * localhost:465 implicit_tls').settings(),
+            ('localhost', 465, None, None, False, True))
+
+    def test_parse_route_invalid(self):
+        for line in ('internal example.com',
+                     'in/ternal example.com relay.example.com',
+                     'internal example.com relay.example.com:smtp',
+                     'internal example.com relay.example.com tls=yes'):
+            with self.assertRaises(ValueError):
+                parse_route(line)
+        with self.assertRaises(ValueError):
+            parse_routes(ROUTES + ('bulk * localhost', ))
+
+    def test_find_route(self):
+        routes = parse_routes(ROUTES + ('', ))
+        self.assertEqual(len(routes), 2)
+        self.assertEqual(find_route(routes, 'Jane <jane@EXAMPLE.com>').name,
+                         'internal')
+        self.assertEqual(find_route(routes, 'joe@mail.example.com').name,
+                         'internal')
+        self.assertEqual(find_route(routes, 'joe@lists.example.net').name,
+                         'bulk')
+        self.assertIsNone(find_route(routes, 'joe@example.net'))
+
+    def test_route_envelopes(self):
+        routes = parse_routes(ROUTES)
+        routed = route_envelopes(routes, [
+            ('me@example.org', ['a@example.org', 'b@example.com',
+                                'c@example.org'], b'1'),
+            ('me@example.org', 'd@example.com', b'2'),
+        ])
+        self.assertEqual(routed, [
+            (None, [('me@example.org', ['a@example.org', 'c@example.org'],
+                     b'1')]),
+            (routes[0], [('me@example.org', ['b@example.com'], b'1'),
+                         ('me@example.org', ['d@example.com'], b'2')]),
+        ])
+
+
+class TestMailHostRouting(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(suffix='MailHostTests')
+        self.queue_path = os.path.join(self.tmpdir, 'queue')
+        DummySMTP.instances = []
+        self.mh = MailHost('MailHost', smtp_host='smtp.example.org')
+        self.mh.manage_makeChanges('', 'smtp.example.org', 25,
+                                   smtp_routes='\n'.join(ROUTES))
+
+    def tearDown(self):
+        transaction.abort()
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+        connection_pools.clear()
+
+    def _send(self, immediate=False):
+        self.mh.send('Subject: Hi\n\nBody', mfrom='me@example.org',
+                     mto=['a@example.org', 'b@example.com',
+                          'c@lists.example.net'],
+                     immediate=immediate)
+
+    def test_manage_makeChanges(self):
+        self.assertEqual(self.mh.smtp_routes, ROUTES)
+        routes = self.mh._getRoutes()
+        self.assertIs(self.mh._getRoutes(), routes)
+        with self.assertRaises(ValueError):
+            self.mh.manage_makeChanges('', 'localhost', 25,
+                                       smtp_routes=['internal'])
+        self.assertEqual(self.mh.smtp_routes, ROUTES)
+        self.mh.manage_makeChanges('', 'localhost', 25)
+        self.assertEqual(self.mh._getRoutes(), ())
+
+    def test_removed_route_stops_processor(self):
+        processors = {}
+        for route in (None, ) + self.mh._getRoutes():
+            key = self.mh._getThreadKey(route)
+            processors[key] = mock.Mock(**{'is_alive.return_value': False})
+            queue_threads._processors[key] = processors[key]
+        try:
+            self.mh.manage_makeChanges('', 'smtp.example.org', 25,
+                                       smtp_routes=ROUTES[:1])
+            bulk = self.mh._getThreadKey(parse_route(ROUTES[1]))
+            self.assertEqual(sorted(queue_threads.keys()),
+                             sorted(set(processors) - {bulk}))
+            # All processors of another backend are stopped
+            self.mh.manage_makeChanges('', 'smtp.example.org', 25,
+                                       smtp_routes=ROUTES[:1],
+                                       smtp_queue_backend='sqlite')
+            self.assertEqual(queue_threads.keys(), [])
+        finally:
+            for key in processors:
+                queue_threads._processors.pop(key, None)
+
+    def test_immediate(self):
+        with mock.patch.object(PooledSMTPMailer, 'smtp', DummySMTP):
+            self._send(immediate=True)
+        sent = {(smtp.host, int(smtp.port)): smtp.sent[0][1]
+                for smtp in DummySMTP.instances}
+        self.assertEqual(sent, {('smtp.example.org', 25): ['a@example.org'],
+                                ('relay.example.com', 25): ['b@example.com'],
+                                ('bulk.example.net', 587):
+                                    ['c@lists.example.net']})
+
+    def test_queued(self):
+        self.mh.smtp_queue = True
+        self.mh.smtp_queue_directory = self.queue_path
+        os.environ['MAILHOST_QUEUE_ONLY'] = '1'
+        try:
+            self._send()
+        finally:
+            del os.environ['MAILHOST_QUEUE_ONLY']
+        transaction.commit()
+        for path in ('', 'route-internal', 'route-bulk'):
+            maildir = Maildir(os.path.join(self.queue_path, path))
+            self.assertEqual(len(list(maildir)), 1)
+        self.assertEqual(self.mh.queueStatistics()['new'], 3)
+        self.assertEqual(self.mh.queueLength(), 3)
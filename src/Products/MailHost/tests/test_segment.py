@@ -0,0 +1,164 @@
+##############################################################################
+#
+# Copyright (c) 2026 Zope Foundation and Contributors.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+"""Segment queue unit tests.
+"""
+
+import json
+import os
+import time
+import unittest
+from unittest import mock
+
+import transaction
+
+from Products.MailHost import segment
+from Products.MailHost.segment import SegmentQueue
+from Products.MailHost.storage import MaildirQueue
+from Products.MailHost.storage import get_queue
+from Products.MailHost.tests.test_queue import EMPTY
+from Products.MailHost.tests.test_queue import FlakyMailer
+from Products.MailHost.tests.test_queue import MailHostQueueStorageTests
+from Products.MailHost.tests.test_queue import QueueStorageTests
+
+
+class TestSegmentQueue(QueueStorageTests, unittest.TestCase):
+
+    storage = segment
+    queue_class = SegmentQueue
+
+    def _make_due(self):
+        for entry in self.queue._entries.values():
+            entry.next = 0
+
+    def _segments(self):
+        return sorted(name for name in os.listdir(self.queue_path)
+                      if name.startswith('segment-'))
+
+    def test_get_queue_default(self):
+        self.assertIsInstance(get_queue(self.queue_path), MaildirQueue)
+        with self.assertRaises(ValueError):
+            get_queue(self.queue_path, 'floppy')
+
+    def test_segment_files(self):
+        self._send(3)
+        transaction.commit()
+        self._send(2)
+        transaction.abort()
+        # Aborted messages are written, but not in the index
+        self.assertEqual(self._segments(), ['segment-00000001'])
+        self.assertEqual(self.queue.statistics(), dict(EMPTY, new=3))
+
+    def test_incomplete_line(self):
+        self._send(1)
+        transaction.commit()
+        with open(self.queue.index_path, 'ab') as f:
+            f.write(b'{"id": "0123", "segm')  # a process died writing
+        self._send(1)
+        transaction.commit()
+        other = SegmentQueue(self.queue_path)
+        self.assertEqual(other.statistics(), dict(EMPTY, new=2))
+        self.assertEqual(self.queue.statistics(), dict(EMPTY, new=2))
+
+    def test_maintain(self):
+        with mock.patch.object(segment, 'SEGMENT_SIZE', 1), \
+                mock.patch.object(segment, 'SEGMENT_GRACE', -1), \
+                mock.patch.object(segment, 'COMPACT_LINES', 2):
+            for i in range(3):
+                self._send(1)
+                transaction.commit()
+            self._send(1, toaddr='user@example.org')
+            transaction.commit()
+            self.assertEqual(len(self._segments()), 4)
+            other = SegmentQueue(self.queue_path)
+            self.assertEqual(other.statistics(), dict(EMPTY, new=4))
+            sent = []
+            self._run(FlakyMailer(sent), max_attempts=5)
+        self.assertEqual(len(sent), 3)
+        # The last segment is kept for further messages
+        self.assertEqual(self._segments(),
+                         ['segment-00000004'])
+        with open(self.queue.index_path) as f:
+            lines = f.readlines()
+        # The generation and the deferred message
+        self.assertEqual(len(lines), 2)
+        self.assertEqual(json.loads(lines[0]), {'generation': 2})
+        self.assertEqual(other.statistics(), dict(EMPTY, deferred=1))
+
+    def test_rewritten_in_place(self):
+        self._send(3)
+        transaction.commit()
+        other = SegmentQueue(self.queue_path)
+        self.assertEqual(other.statistics(), dict(EMPTY, new=3))
+        # A rewrite keeping the inode is noticed by the generation
+        with open(self.queue.index_path, 'r+b') as f:
+            f.readline()  # the header
+            first = f.readline()
+            f.seek(0)
+            f.truncate()
+            f.write(b'{"generation": 2}\n' + first)
+        self.assertEqual(other.statistics(), dict(EMPTY, new=1))
+
+    def test_stale_claim_taken_over_once(self):
+        self._send(1)
+        transaction.commit()
+        entry, = self.queue.claim()
+        claim = os.path.join(self.queue.claims_path, entry.id)
+        os.utime(claim, (0, 0))  # left over by a process which died
+        first = SegmentQueue(self.queue_path)
+        second = SegmentQueue(self.queue_path)
+        rename = os.rename
+        raced = []
+
+        def racing_rename(src, dst):
+            if not raced:
+                # The other process takes the claim over first
+                raced.append(None)
+                raced[0] = second._claim(entry, time.time())
+            rename(src, dst)
+
+        with mock.patch('os.rename', side_effect=racing_rename):
+            self.assertFalse(first._claim(entry, time.time()))
+        self.assertEqual(raced, [True])
+        # The claim of the second process is still there
+        self.assertEqual(os.listdir(self.queue.claims_path), [entry.id])
+        self.assertGreater(os.stat(claim).st_mtime, 0)
+
+    def test_dead_messages_leave_segment(self):
+        with mock.patch.object(segment, 'SEGMENT_SIZE', 1), \
+                mock.patch.object(segment, 'SEGMENT_GRACE', -1):
+            self._send(1, toaddr='user@example.org')
+            transaction.commit()
+            self._send(1)
+            transaction.commit()
+            self._run(FlakyMailer([]), max_attempts=1)
+            self.assertEqual(self.queue.statistics(),
+                             dict(EMPTY, dead=1))
+            self.queue.maintain()
+        self.assertEqual(self._segments(), ['segment-00000002'])
+        entry, = self.queue._entries.values()
+        self.assertEqual(entry.file, os.path.join('dead', entry.id))
+        self.assertTrue(self.queue.read(entry).endswith(b'body'))
+        other = SegmentQueue(self.queue_path)
+        self.assertEqual(other.statistics(), dict(EMPTY, dead=1))
+
+
+class TestMailHostSegmentQueue(MailHostQueueStorageTests, unittest.TestCase):
+
+    backend = 'segment'
+    queue_file = 'index'
+
+    def test_manage_makeChanges(self):
+        with self.assertRaises(ValueError):
+            self.mh.manage_makeChanges('', 'localhost', 25,
+                                       smtp_queue_backend='floppy')
+        self.assertEqual(self.mh.smtp_queue_backend, 'segment')
@@ -0,0 +1,121 @@
+##############################################################################
+#
+# Copyright (c) 2026 Zope Foundation and Contributors.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+"""SQLite queue unit tests.
+"""
+
+import sqlite3
+import unittest
+from unittest import mock
+
+import transaction
+
+from Products.MailHost import sqlite
+from Products.MailHost.delivery import BatchDataManager
+from Products.MailHost.sqlite import SQLiteQueue
+from Products.MailHost.tests.test_queue import EMPTY
+from Products.MailHost.tests.test_queue import MailHostQueueStorageTests
+from Products.MailHost.tests.test_queue import QueueStorageTests
+
+
+class TestSQLiteQueue(QueueStorageTests, unittest.TestCase):
+
+    storage = sqlite
+    queue_class = SQLiteQueue
+
+    def _make_due(self):
+        with self.queue._connect() as connection:
+            connection.execute('UPDATE messages SET next = 0')
+
+    def _row(self):
+        return self.queue._connect().execute(
+            'SELECT state, attempts, next, queued FROM messages').fetchone()
+
+    def test_attempts(self):
+        self._send(1)
+        transaction.commit()
+        entry, = self.queue.claim()
+        self.queue.finish(entry, 'deferred', attempts=1,
+                          next=entry.queued + 60)
+        self.assertEqual(self._row(),
+                         ('deferred', 1, entry.queued + 60, entry.queued))
+
+    def test_pending(self):
+        self._send(2)
+        other = SQLiteQueue(self.queue_path)
+        seen = []
+
+        class CheckingDataManager(BatchDataManager):
+            def sortKey(self):
+                return '~'  # votes after the queue
+
+            def tpc_vote(self, txn):
+                # Written, but neither counted nor claimed, and other
+                # connections may write to the database meanwhile
+                seen.append((other.statistics(), other.claim()))
+                other.write([('zope@example.com', ['user@example.com'],
+                              b'Other', 'normal')])
+
+            def tpc_finish(self, txn):
+                pass
+
+        transaction.get().join(CheckingDataManager())
+        transaction.commit()
+        self.assertEqual(seen, [(EMPTY, [])])
+        self.assertEqual(other.statistics(), dict(EMPTY, new=2))
+
+    def test_maintain(self):
+        self._send(1)
+        self.queue.write([('zope@example.com', ['user@example.com'],
+                           b'Lost', 'normal')])
+        transaction.commit()
+        with mock.patch.object(sqlite, 'PENDING_TIMEOUT', -1):
+            self.queue.maintain()
+        # Pending messages are kept, they may have been committed
+        self.assertEqual(self.queue.statistics(),
+                         dict(EMPTY, new=1, failed=1))
+
+    def test_index_retried(self):
+        self._send(1)
+        with mock.patch.object(self.queue, 'index',
+                               side_effect=self._flaky(self.queue.index, 1)):
+            transaction.commit()
+        self.assertEqual(self.queue.statistics(), dict(EMPTY, new=1))
+
+    def test_index_failed(self):
+        self._send(1)
+        with mock.patch.object(
+                self.queue, 'index',
+                side_effect=sqlite3.OperationalError('locked')), \
+                self.assertLogs('MailHost', 'ERROR') as logs:
+            transaction.commit()
+        self.assertIn('stay pending', logs.output[-1])
+        self.assertEqual(self.queue.statistics(), EMPTY)
+        with mock.patch.object(sqlite, 'PENDING_TIMEOUT', -1):
+            self.queue.maintain()
+        self.assertEqual(self.queue.statistics(), dict(EMPTY, failed=1))
+
+    def _flaky(self, fn, failures):
+        calls = []
+
+        def flaky(*args):
+            calls.append(args)
+            if len(calls) <= failures:
+                raise sqlite3.OperationalError('locked')
+            return fn(*args)
+        return flaky
+
+
+class TestMailHostSQLiteQueue(MailHostQueueStorageTests, unittest.TestCase):
+
+    backend = 'sqlite'
+    queue_file = 'queue.sqlite'
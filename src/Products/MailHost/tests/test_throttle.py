@@ -0,0 +1,156 @@
+##############################################################################
+#
+# Copyright (c) 2026 Zope Foundation and Contributors.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+"""Relay limit unit tests.
+"""
+
+import threading
+import time
+import unittest
+from unittest import mock
+
+import transaction
+
+from Products.MailHost import pool as pool_module
+from Products.MailHost.MailHost import MailHost
+from Products.MailHost.pool import SessionUnavailable
+from Products.MailHost.pool import connection_pools
+from Products.MailHost.tests.dummy import DummySMTP
+from Products.MailHost.throttle import RelayLimiter
+from Products.MailHost.throttle import get_limiter
+from Products.MailHost.throttle import limiters
+
+
+class TestRelayLimiter(unittest.TestCase):
+
+    def test_no_limits(self):
+        limiter = RelayLimiter()
+        start = time.monotonic()
+        for i in range(1000):
+            limiter.throttle()
+            self.assertTrue(limiter.open_session(0))
+        self.assertLess(time.monotonic() - start, 0.5)
+        self.assertEqual(limiter.sessions, 1000)
+
+    def test_rate(self):
+        limiter = RelayLimiter(rate=100)
+        start = time.monotonic()
+        for i in range(100):
+            # the burst allowance
+            limiter.throttle()
+        self.assertLess(time.monotonic() - start, 0.1)
+        for i in range(20):
+            limiter.throttle()
+        self.assertGreaterEqual(time.monotonic() - start, 0.19)
+
+    def test_max_sessions(self):
+        limiter = RelayLimiter(max_sessions=2)
+        self.assertTrue(limiter.open_session(0))
+        self.assertTrue(limiter.open_session(0))
+        self.assertFalse(limiter.open_session(0.01))
+        limiter.close_session()
+        self.assertTrue(limiter.open_session(0))
+        limiter.configure(0.0, 3)
+        self.assertTrue(limiter.open_session(0))
+        self.assertEqual(limiter.sessions, 3)
+
+    def test_get_limiter(self):
+        key = ('test_get_limiter', 25)
+        try:
+            limiter = get_limiter(key, 1.0, 2)
+            self.assertIs(get_limiter(key, 5.0, 3), limiter)
+            self.assertEqual(limiter.rate, 5.0)
+            self.assertEqual(limiter.max_sessions, 3)
+        finally:
+            limiters.pop(key, None)
+
+
+class TestMailHostLimits(unittest.TestCase):
+
+    def setUp(self):
+        transaction.abort()
+        DummySMTP.instances = []
+
+    def tearDown(self):
+        transaction.abort()
+        for pool in connection_pools.values():
+            pool.clear()
+        connection_pools.clear()
+        limiters.clear()
+
+    def _makeMailer(self, mh):
+        mailer = mh._makeMailer()
+        mailer.smtp = DummySMTP
+        return mailer
+
+    def test_settings(self):
+        mh = MailHost('mh')
+        mh.manage_makeChanges('Mail', 'relay.example.com', 25,
+                              smtp_rate_limit='2.5', smtp_max_sessions='3')
+        self.assertEqual(mh.smtp_rate_limit, 2.5)
+        self.assertEqual(mh.smtp_max_sessions, 3)
+        limiter = mh._makeMailer().pool.limiter
+        self.assertEqual(limiter.rate, 2.5)
+        self.assertEqual(limiter.max_sessions, 3)
+
+    def test_shared_by_mailers(self):
+        mh = MailHost('mh')
+        mh.smtp_max_sessions = 1
+        first = self._makeMailer(mh)
+        second = self._makeMailer(mh)
+        self.assertIs(first.pool.limiter, second.pool.limiter)
+        first.vote('a@example.com', ['b@example.com'], b'message')
+        self.assertEqual(first.pool.limiter.sessions, 1)
+
+        sent = []
+
+        def send():
+            second.send('a@example.com', ['b@example.com'], b'second')
+            sent.append(True)
+
+        thread = threading.Thread(target=send)
+        thread.start()
+        thread.join(0.2)
+        self.assertEqual(sent, [])
+        self.assertEqual(len(DummySMTP.instances), 1)
+        first.send('a@example.com', ['b@example.com'], b'first')
+        thread.join(5)
+        self.assertEqual(sent, [True])
+        self.assertEqual(len(DummySMTP.instances), 2)
+        self.assertEqual(first.pool.limiter.sessions, 0)
+
+    def test_idle_pooled_connection_is_reused(self):
+        mh = MailHost('mh')
+        mh.smtp_max_sessions = 1
+        mh.smtp_pool_size = 1
+        for i in range(3):
+            self._makeMailer(mh).send('a@example.com', ['b@example.com'],
+                                      b'message')
+        self.assertEqual(len(DummySMTP.instances), 1)
+        limiter = self._makeMailer(mh).pool.limiter
+        self.assertEqual(limiter.sessions, 1)
+        connection_pools[mh._getPoolKey()].clear()
+        self.assertEqual(limiter.sessions, 0)
+
+    def test_no_session_in_time(self):
+        mh = MailHost('mh')
+        mh.smtp_max_sessions = 1
+        first = self._makeMailer(mh)
+        second = self._makeMailer(mh)
+        first.vote('a@example.com', ['b@example.com'], b'message')
+        # The same thread waiting for a second session would never get it
+        with mock.patch.object(pool_module, 'SESSION_TIMEOUT', 0.1):
+            with self.assertRaises(SessionUnavailable):
+                second.vote('a@example.com', ['b@example.com'], b'message')
+        self.assertIsNone(second.connection)
+        first.send('a@example.com', ['b@example.com'], b'first')
+        self.assertEqual(first.pool.limiter.sessions, 0)
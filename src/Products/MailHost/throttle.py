@@ -0,0 +1,113 @@
+##############################################################################
+#
+# Copyright (c) 2026 Zope Foundation and Contributors.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+"""Limits on the traffic sent to a SMTP relay.
+"""
+
+import time
+from threading import Condition
+from threading import Lock
+
+
+limiters = {}  # maps SMTP connection settings -> RelayLimiter
+limiters_lock = Lock()
+
+
+class RelayLimiter:
+    """ Rate and concurrency limit for the mail sent to one SMTP relay.
+
+    ``rate`` is the number of messages per second allowed on average, with
+    bursts of up to one second worth of messages. It is enforced by a token
+    bucket. ``max_sessions`` is the number of SMTP connections which may be
+    open at the same time, including idle pooled ones. Zero means no limit
+    for either.
+    """
+
+    def __init__(self, rate=0.0, max_sessions=0):
+        self.rate = float(rate)
+        self.max_sessions = int(max_sessions)
+        self.sessions = 0
+        self._tokens = max(self.rate, 1.0)
+        self._updated = time.monotonic()
+        self._lock = Lock()
+        self._sessions_changed = Condition(Lock())
+
+    def configure(self, rate, max_sessions):
+        with self._lock:
+            self.rate = float(rate)
+        with self._sessions_changed:
+            self.max_sessions = int(max_sessions)
+            self._sessions_changed.notify_all()
+
+    def throttle(self):
+        """ Wait until the next message may be sent.
+        """
+        with self._lock:
+            rate = self.rate
+            if rate <= 0:
+                return
+            now = time.monotonic()
+            self._tokens = min(self._tokens + (now - self._updated) * rate,
+                               max(rate, 1.0))
+            self._updated = now
+            # Take the token now, even if it is only there in the future.
+            # This queues up concurrent senders in order.
+            self._tokens -= 1
+            delay = -self._tokens / rate
+        if delay > 0:
+            time.sleep(delay)
+
+    def open_session(self, timeout=None):
+        """ Reserve a SMTP session.
+
+        If all sessions are taken, wait up to *timeout* seconds for one to
+        be closed or for ``wake`` to be called. Returns whether the session
+        was reserved.
+        """
+        with self._sessions_changed:
+            if not self._available():
+                self._sessions_changed.wait(timeout)
+                if not self._available():
+                    return False
+            self.sessions += 1
+            return True
+
+    def _available(self):
+        return self.max_sessions <= 0 or self.sessions < self.max_sessions
+
+    def close_session(self):
+        """ Give back a session reserved with ``open_session``.
+        """
+        with self._sessions_changed:
+            self.sessions = max(self.sessions - 1, 0)
+            self._sessions_changed.notify_all()
+
+    def wake(self):
+        """ Wake up threads waiting in ``open_session``.
+        """
+        with self._sessions_changed:
+            self._sessions_changed.notify_all()
+
+
+def get_limiter(key, rate=0.0, max_sessions=0):
+    """ Return the RelayLimiter for the connection settings *key*.
+    """
+    limiter = limiters.get(key)
+    if limiter is None:
+        with limiters_lock:
+            limiter = limiters.get(key)
+            if limiter is None:
+                limiter = limiters[key] = RelayLimiter(rate, max_sessions)
+                return limiter
+    if limiter.rate != rate or limiter.max_sessions != max_sessions:
+        limiter.configure(rate, max_sessions)
+    return limiter